@@ -1,7 +1,19 @@
 from bson import ObjectId
 from bson.decimal128 import Decimal128
-from redis_api.redis_client import get_redis
+from concurrent.futures import ThreadPoolExecutor
+from api.connection import get_redis
 from api.payments import read_payments_from_student, read_payments_to_tutor
+from api.cache import get_cached, invalidate_cached, parse_cached
+from api.review_stats import (
+    TUTOR_ROLE,
+    STUDENT_ROLE,
+    review_stats_key,
+    cached_review_stats,
+    load_review_stats,
+    cache_review_stats,
+    get_review_stats,
+    average_rating
+)
 
 import os
 
@@ -9,182 +21,41 @@ TUTOR_PAY_PERCENTAGE = 75
 REDIS_PASS = os.getenv('REDIS_PASS')
 r = get_redis()
 
-def get_tutor_review_count(review_collection, tutor_id: str):
-    """
-    Apskaičiuoja, kiek atsiliepimų turi konkretus dėstytojas.
-    Naudoja Redis kešą
-    Aktyviai invaliduoja duomenis keičiant
-    Jei atsiliepimų nėra, grąžina 0 ir įrašo į kešą
-    """
 
-    cache_key = f"tutor:{tutor_id}:review_count"
+def tutor_pay_key(tutor_id: str) -> str:
+    # Naujas raktas: reiksme dabar hash'as (zr. api/cache.py), ne string
+    return f"cache:tutor:{tutor_id}:monthly_pay"
 
-    # Bandome gauti reikšmę iš Redis kešo
-    cached_value = r.get(cache_key)
-    if cached_value is not None:
-        print("Grąžiname reikšmę iš Redis kešo")
-        return int(cached_value)
 
-    # Jei keše nėra, atliekame MongoDB agregaciją
-    print("Atliekame MongoDB užklausą...")
-    aggregate_output_cursor = review_collection.aggregate([
-        {
-            "$match": {
-                "tutor.tutor_id": ObjectId(tutor_id),
-                "for_tutor": True,
-                "$or": [
-                    {"type": {"$exists": False}},
-                    {"type": {"$ne": "REVOKED"}}
-                ]
-            }
-        },
-        {"$count": "num_doc"}
-    ])
-
-    # Nustatome count; jei nėra dokumentų, skaičius = 0
-    try:
-        agg_doc = next(aggregate_output_cursor)
-        count = agg_doc['num_doc']
-    except StopIteration:
-        count = 0
+def student_pay_key(student_id: str) -> str:
+    return f"cache:student:{student_id}:monthly_pay"
 
-    # Įrašome į Redis (net jei count = 0)
-    r.set(cache_key, count)
 
-    return count
-
-def invalidate_tutor_review_cache(tutor_id: str):
+def get_tutor_review_count(review_collection, tutor_id: str):
     """
-    Aktyvus kešo išvalymas.
+    Grąžina, kiek atsiliepimų turi konkretus dėstytojas.
+    Skaitliukas palaikomas kuriant/atšaukiant atsiliepimus (api/review_stats.py),
+    todėl agregacija nevykdoma.
     """
-    cache_key = f"tutor:{tutor_id}:review_count"
-    deleted = r.delete(cache_key)
-    if deleted:
-        print(f"Redis kešas išvalytas dėstytojui {tutor_id}")
-    else:
-        print(f"Kešas dėstytojui {tutor_id} jau buvo tuščias")
+    stats = get_review_stats(review_collection, TUTOR_ROLE, str(tutor_id))
+    return stats['count']
 
 def get_student_review_count(review_collection, student_id: str):
     """
-    Apskaičiuoja, kiek atsiliepimų turi konkretus studentas.
-    Naudoja Redis kešą
-    Aktyviai invaliduoja duomenis keičiant
-    Jei atsiliepimų nėra, grąžina 0 ir įrašo į kešą
+    Grąžina, kiek atsiliepimų turi konkretus studentas.
+    Skaitliukas palaikomas kuriant/atšaukiant atsiliepimus (api/review_stats.py).
     """
-    cache_key = f"student:{student_id}:review_count"
-
-    # Bandome gauti reikšmę iš Redis kešo
-    cached_value = r.get(cache_key)
-    if cached_value is not None:
-        print("Grąžiname reikšmę iš Redis kešo (student)")
-        return int(cached_value)
-
-    # Jei keše nėra, atliekame MongoDB agregaciją
-    print("Atliekame MongoDB užklausą studentui...")
-    aggregate_output_cursor = review_collection.aggregate([
-        {
-            "$match": {
-                "student.student_id": ObjectId(student_id),
-                "for_tutor": False,
-                "$or": [
-                    {"type": {"$exists": False}},
-                    {"type": {"$ne": "REVOKED"}}
-                ]
-            }
-        },
-        {"$count": "num_doc"},
-    ])
-
-    # Nustatome count; jei nėra dokumentų, skaičius = 0
-    try:
-        agg_doc = next(aggregate_output_cursor)
-        count = agg_doc['num_doc']
-    except StopIteration:
-        count = 0
-
-    # Įrašome į Redis (net jei count = 0)
-    r.set(cache_key, count)
-
-    return count
-
-def invalidate_student_review_cache(student_id: str):
-    """
-    Aktyvus studento kešo išvalymas.
-    """
-    cache_key = f"student:{student_id}:review_count"
-    deleted = r.delete(cache_key)
-    if deleted:
-        print(f"Redis kešas išvalytas studentui {student_id}")
-    else:
-        print(f"Kešas studentui {student_id} jau buvo tuščias")
-
-
-from bson import ObjectId
-
+    stats = get_review_stats(review_collection, STUDENT_ROLE, str(student_id))
+    return stats['count']
 
 def calculate_tutor_rating(review_collection, tutor_id: str):
     """
-    Apskaičiuoja vidutinį dėstytojo įvertinimą pagal atsiliepimus.
-    Naudoja Redis kėšą, kad spartintų pakartotinius skaičiavimus
-    Įvertinimas apskaičiuojamas tik tiems atsiliepimams, kurie:
-        - priskirti šiam dėstytojui
-        - turi lauką 'rating'
-        - nėra atšaukti ('type' != 'REVOKED')
-        - for_tutor == True
+    Grąžina vidutinį dėstytojo įvertinimą (None, jei įvertinimų nėra).
+    Įvertinimų suma ir kiekis palaikomi kuriant/atšaukiant atsiliepimus,
+    į juos įeina tik neatšaukti atsiliepimai su 'rating', skirti dėstytojui.
     """
-
-    cache_key = f"tutor_rating:{tutor_id}"
-
-    # Pabandome gauti vertę iš Redis kėšo
-    cached = r.get(cache_key)
-    if cached:
-        try:
-            return float(cached)
-        except ValueError:
-            pass  # jei kėšas sugadintas, ignoruojame ir skaičiuojame iš naujo
-
-    # Jei kėše nėra, atliekame MongoDB agregaciją
-    aggregate_output_cursor = review_collection.aggregate([
-        {
-            "$match": {
-                "tutor.tutor_id": ObjectId(tutor_id),
-                "for_tutor": True,  # tik atsiliepimai skirti dėstytojui
-                "$or": [
-                    {"type": {"$exists": False}},
-                    {"type": {"$ne": "REVOKED"}}
-                ],
-                "rating": {"$exists": True}  # tik atsiliepimai su rating
-            }
-        },
-        {
-            "$group": {
-                "_id": None,
-                "average_rating": {"$avg": "$rating"}  # apskaičiuojame vidurkį
-            }
-        }
-    ])
-
-    # Ištraukiame rezultatą iš kursoriaus
-    try:
-        agg_doc = next(aggregate_output_cursor)
-        rating = agg_doc['average_rating']
-
-        # Įrašome į Redis be laiko limito
-        if rating is not None:
-            r.set(cache_key, rating)
-
-        return rating
-
-    except StopIteration:
-        return None  # jei nėra įvertintų atsiliepimų
-
-def invalidate_tutor_rating_cache(tutor_id: str):
-    """
-    Aktyvus dėstytojo įvertinimo kėšo išvalymas.
-    Iškviečiamas kai atšaukiamas ar pakeičiamas atsiliepimas.
-    """
-    cache_key = f"tutor_rating:{tutor_id}"
-    r.delete(cache_key)
+    stats = get_review_stats(review_collection, TUTOR_ROLE, str(tutor_id))
+    return average_rating(stats)
 
 def pay_month_tutor(
     lesson_collection,
@@ -194,18 +65,23 @@ def pay_month_tutor(
 ):
     """
     Apskaičiuoja mėnesinį atlyginimą dėstytojui pagal pamokas.
-    Naudoja Redis kešą
-    Aktyviai invaliduoja duomenis keičiant
+    Naudoja Redis kešą (api/cache.py) - perskaičiuoja tik vienas procesas
+    Aktyviai pažymi duomenis pasenusiais keičiant
     Jei pamokų nėra, grąžina 0 ir įrašo į kešą
     """
-    cache_key = f"tutor:{tutor_id}:monthly_pay"
-
-    # Tikriname Redis cache
-    cached_value = r.get(cache_key)
-    if cached_value is not None:
-        print("Grąžiname reikšmę iš Redis kešo")
-        return float(cached_value)
+    return get_cached(
+        tutor_pay_key(tutor_id),
+        lambda: _tutor_monthly_pay(
+            lesson_collection, tutor_collection, cassandra_session, tutor_id
+        )
+    )
 
+def _tutor_monthly_pay(
+    lesson_collection,
+    tutor_collection,
+    cassandra_session,
+    tutor_id: str
+) -> float:
     # MongoDB agregacija
     aggregate_output_cursor = lesson_collection.aggregate([
         {
@@ -251,11 +127,7 @@ def pay_month_tutor(
         float(payment['payment']) for payment in payments
     ])
 
-    monthly_pay -= pay_sum
-
-    # Įrašome į Redis
-    r.set(cache_key, monthly_pay)
-    return monthly_pay
+    return monthly_pay - pay_sum
 
 def invalidate_tutor_pay_cache(tutor_id: str):
     """
@@ -264,12 +136,8 @@ def invalidate_tutor_pay_cache(tutor_id: str):
     - pridedama nauja pamoka
     - pamoka pašalinama arba keičiasi kaina
     """
-    cache_key = f"tutor:{tutor_id}:monthly_pay"
-    deleted = r.delete(cache_key)
-    if deleted:
-        print(f"Redis kešas mėnesiniam atlyginimui išvalytas dėstytojui {tutor_id}")
-    else:
-        print(f"Kešas mėnesiniam atlyginimui jau buvo tuščias")
+    # Reiksme neistrinama, tik pazymima pasenusia - zr. api/cache.py
+    invalidate_cached([tutor_pay_key(tutor_id)])
 
 
 
@@ -281,18 +149,23 @@ def pay_month_student(
 ):
     """
     Apskaičiuoja mėnesinę sumą, kurią studentas sumokėjo už pamokas.
-    Naudoja Redis kešą
+    Naudoja Redis kešą (api/cache.py) - perskaičiuoja tik vienas procesas
     Automatiškai konvertuoja Decimal128 į float
     Jei duomenų nėra, grąžina 0 ir įrašo į kešą
     """
-    cache_key = f"student:{student_id}:monthly_pay"
-
-    # Tikriname Redis cache
-    cached_value = r.get(cache_key)
-    if cached_value is not None:
-        print("Grąžiname reikšmę iš Redis kešo")
-        return float(cached_value)
+    return get_cached(
+        student_pay_key(student_id),
+        lambda: _student_monthly_pay(
+            cassandra_session, tutor_collection, lesson_collection, student_id
+        )
+    )
 
+def _student_monthly_pay(
+    cassandra_session,
+    tutor_collection,
+    lesson_collection,
+    student_id: str
+) -> float:
     # MongoDB agregacija
     aggregate_output_cursor = lesson_collection.aggregate([
         {
@@ -338,17 +211,13 @@ def pay_month_student(
         float(payment['payment']) for payment in payments
     ])
 
-    monthly_pay -= pay_sum
-
-    # Įrašome į Redis
-    r.set(cache_key, monthly_pay)
-    return monthly_pay
+    return monthly_pay - pay_sum
 
 
 # --- Aktyvus Redis kešo invalidavimas ---
 def invalidate_student_pay_cache(student_ids):
     """
-    Išvalo Redis kešą vienam arba keliems studentams.
+    Pažymi pasenusiu Redis kešą vienam arba keliems studentams.
     student_ids gali būti:
       - vienas string
       - sąrašas studentų ID
@@ -356,13 +225,114 @@ def invalidate_student_pay_cache(student_ids):
     if isinstance(student_ids, str):
         student_ids = [student_ids]
 
-    for sid in student_ids:
-        cache_key = f"student:{sid}:monthly_pay"
-        deleted = r.delete(cache_key)
-        if deleted:
-            print(f"Redis kešas mėnesinei sumai išvalytas studentui {sid}")
-        else:
-            print(f"Kešas mėnesinei sumai jau buvo tuščias studentui {sid}")
+    invalidate_cached([student_pay_key(sid) for sid in student_ids])
+
+# --- Profilio puslapio reikšmės vienu kartu ---
+def _get_dashboard(
+    review_collection,
+    role: str,
+    user_id: str,
+    pay_key: str,
+    compute_pay
+) -> tuple[dict, float]:
+    """
+    Atsiliepimų skaitliukai ir mėnesio suma vienu Redis kreipiniu (2x HGETALL).
+    Trūkstamos reikšmės gaunamos lygiagrečiai; skaitliukai įrašomi atgal
+    pipeline, o mėnesio sumą perskaičiuoja ir įrašo get_cached (single-flight).
+    """
+    pipe = r.pipeline()
+    pipe.hgetall(review_stats_key(role, user_id))
+    pipe.hgetall(pay_key)
+    cached_stats, cached_pay = pipe.execute()
+
+    stats = cached_review_stats(cached_stats)
+
+    pay = None
+    found, cached_value, fresh = parse_cached(cached_pay)
+    if found and fresh:
+        pay = cached_value
+
+    misses = {}
+    if stats is None:
+        misses['stats'] = lambda: load_review_stats(review_collection, role, user_id)
+    if pay is None:
+        misses['pay'] = lambda: get_cached(pay_key, compute_pay, cached=cached_pay)
+
+    if not misses:
+        return stats, pay
+
+    if len(misses) == 1:
+        computed = {name: load() for name, load in misses.items()}
+    else:
+        with ThreadPoolExecutor(max_workers=len(misses)) as executor:
+            futures = {name: executor.submit(load) for name, load in misses.items()}
+            computed = {name: future.result() for name, future in futures.items()}
+
+    if 'stats' in computed:
+        stats = computed['stats']
+        cache_review_stats(r, role, user_id, stats, cached_stats.get('gen', '0'))
+    if 'pay' in computed:
+        pay = computed['pay']
+
+    return stats, pay
+
+
+def get_tutor_dashboard(
+    review_collection,
+    lesson_collection,
+    tutor_collection,
+    cassandra_session,
+    tutor_id: str
+) -> dict:
+    """
+    Grąžina {'rating', 'review_count', 'pay'} dėstytojo profiliui.
+    Tas pats kaip calculate_tutor_rating, get_tutor_review_count ir
+    pay_month_tutor, bet su vienu Redis kreipiniu skaitymui.
+    """
+    # Profilio puslapiai perduoda ObjectId
+    tutor_id = str(tutor_id)
+
+    stats, pay = _get_dashboard(
+        review_collection, TUTOR_ROLE, tutor_id,
+        tutor_pay_key(tutor_id),
+        lambda: _tutor_monthly_pay(
+            lesson_collection, tutor_collection, cassandra_session, tutor_id
+        )
+    )
+
+    return {
+        'rating': average_rating(stats),
+        'review_count': stats['count'],
+        'pay': pay
+    }
+
+
+def get_student_dashboard(
+    review_collection,
+    lesson_collection,
+    tutor_collection,
+    cassandra_session,
+    student_id: str
+) -> dict:
+    """
+    Grąžina {'review_count', 'pay'} studento profiliui
+    (get_student_review_count ir pay_month_student vienu kartu).
+    """
+    # Profilio puslapiai perduoda ObjectId
+    student_id = str(student_id)
+
+    stats, pay = _get_dashboard(
+        review_collection, STUDENT_ROLE, student_id,
+        student_pay_key(student_id),
+        lambda: _student_monthly_pay(
+            cassandra_session, tutor_collection, lesson_collection, student_id
+        )
+    )
+
+    return {
+        'review_count': stats['count'],
+        'pay': pay
+    }
 
 if __name__ == "__main__":
     from api.connection import get_db
@@ -0,0 +1,133 @@
+"""
+Redis kešas brangiems skaičiavimams (agregacijoms).
+
+Reikšmė laikoma Redis hash'e {v: JSON reikšmė, soft: šviežumo riba (unix laikas)}:
+    - iki soft reikšmė šviežia ir grąžinama iš karto;
+    - po soft (ar po invalidate_cached) reikšmė pasenusi: grąžinama sena reikšmė,
+      o ją perskaičiuoja tik vienas procesas fone (stale-while-revalidate);
+    - po hard TTL raktas išnyksta; tada skaičiuoja tik spynos savininkas,
+      o kiti palaukia jo rezultato (single-flight).
+"""
+
+import json
+import threading
+import time
+
+from redis.exceptions import LockError
+
+from api.connection import get_redis
+
+CACHE_SOFT_TTL = 10 * 60
+CACHE_HARD_TTL = 24 * 3600
+# Kiek ilgiausiai gali trukti vienas perskaičiavimas (spynos galiojimas)
+CACHE_COMPUTE_TIMEOUT = 30
+# Kiek laukiam kito proceso rezultato, kol skaičiuojam patys
+CACHE_WAIT_TIMEOUT = 5
+CACHE_POLL_INTERVAL = 0.05
+
+r = get_redis()
+
+# Jei rakto nera, nieko nekuriam - kitaip liktu hash'as be reiksmes ir be TTL
+_mark_stale = r.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('HSET', KEYS[1], 'soft', 0)
+end
+return 1
+""")
+
+
+def _lock(key: str):
+    # Spyna gali buti atlaisvinta kitoje gijoje (fono perskaiciavimas)
+    return r.lock(f"lock:cache:{key}", timeout=CACHE_COMPUTE_TIMEOUT, thread_local=False)
+
+
+def _release(lock):
+    try:
+        lock.release()
+    except LockError:
+        pass  # spyna jau pasibaigė
+
+
+def _store(pipe, key: str, value, soft_ttl: int, hard_ttl: int):
+    pipe.hset(key, mapping={'v': json.dumps(value), 'soft': time.time() + soft_ttl})
+    pipe.expire(key, hard_ttl)
+
+
+def parse_cached(cached: dict) -> tuple[bool, object, bool]:
+    """ HGETALL rezultatas -> (rasta, reikšmė, šviežia). """
+    if not cached or 'v' not in cached:
+        return False, None, False
+
+    try:
+        value = json.loads(cached['v'])
+    except ValueError:
+        return False, None, False  # sugadinta reikšmė - laikom nerasta
+
+    return True, value, float(cached.get('soft', 0)) > time.time()
+
+
+def _refresh(key: str, compute, soft_ttl: int, hard_ttl: int, lock):
+    try:
+        value = compute()
+        pipe = r.pipeline()
+        _store(pipe, key, value, soft_ttl, hard_ttl)
+        pipe.execute()
+        return value
+    finally:
+        _release(lock)
+
+
+def get_cached(
+    key: str,
+    compute,
+    soft_ttl: int = CACHE_SOFT_TTL,
+    hard_ttl: int = CACHE_HARD_TTL,
+    cached: dict = None
+):
+    """
+    Grąžina key reikšmę, prireikus ją perskaičiuodama per compute().
+    cached - jau nuskaitytas HGETALL(key) rezultatas (pvz. iš pipeline),
+    kad nereikėtų dar vieno kreipinio į Redis.
+    """
+    if cached is None:
+        cached = r.hgetall(key)
+
+    found, value, fresh = parse_cached(cached)
+    if found and fresh:
+        return value
+
+    lock = _lock(key)
+
+    if found:
+        # Pasenusi reikšmė: perskaičiuoja vienas, visi kiti gauna seną
+        if lock.acquire(blocking=False):
+            threading.Thread(
+                target=_refresh,
+                args=(key, compute, soft_ttl, hard_ttl, lock),
+                daemon=True
+            ).start()
+        return value
+
+    if lock.acquire(blocking=False):
+        return _refresh(key, compute, soft_ttl, hard_ttl, lock)
+
+    # Skaičiuoja kitas procesas - palaukiam jo rezultato
+    deadline = time.monotonic() + CACHE_WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(CACHE_POLL_INTERVAL)
+        found, value, _ = parse_cached(r.hgetall(key))
+        if found:
+            return value
+
+    return compute()
+
+
+def invalidate_cached(keys: list[str]):
+    """
+    Pažymi reikšmes pasenusiomis, bet jų neištrina: kitas skaitytojas gaus
+    seną reikšmę ir paleis vieną perskaičiavimą, o ne visi iš karto.
+    """
+    pipe = r.pipeline()
+    for key in keys:
+        _mark_stale(keys=[key], client=pipe)
+    pipe.execute()
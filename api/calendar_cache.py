@@ -0,0 +1,139 @@
+"""
+Suformatuotų pamokų sąrašų (kalendoriaus) kešas.
+
+Kiekvienam savininkui (korepetitoriui ar mokiniui) ir laikotarpiui (ISO
+savaitei arba mėnesiui) Redis hash'e calendar:<role>:<id>:<bucket> laikomas
+jau suformatuotas pamokų sąrašas {v: JSON, gen: kartos numeris}.
+
+Pamokų keitimai (api/lesson.py) invaliduoja tik tuos laikotarpius, kuriuos
+paliečia: seno ir naujo pamokos laiko savaitę ir mėnesį korepetitoriui ir
+visiems pamokos mokiniams. Invalidavimas padidina gen ir ištrina v, o
+skaitytojas įrašo perskaičiuotą sąrašą tik jei gen nepasikeitė - taip
+skaičiavimo metu įvykęs pakeitimas neperrašomas senais duomenimis.
+"""
+
+import json
+from datetime import datetime
+
+from api.connection import get_redis
+
+CALENDAR_TTL = 24 * 3600
+
+TUTOR_CALENDAR = 'tutor'
+STUDENT_CALENDAR = 'student'
+
+r = get_redis()
+
+# Irasom tik jei tarp skaitymo ir irasymo niekas neinvalidavo
+_store_if_current = r.register_script("""
+local gen = redis.call('HGET', KEYS[1], 'gen') or '0'
+if gen ~= ARGV[1] then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'v', ARGV[2], 'gen', gen)
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+""")
+
+
+def week_bucket(time: datetime) -> str:
+    year, week, _ = time.isocalendar()
+    return f"week:{year}-W{week:02d}"
+
+
+def month_bucket(year: int, month: int) -> str:
+    return f"month:{year:04d}-{month:02d}"
+
+
+def calendar_key(role: str, owner_id, bucket: str) -> str:
+    return f"calendar:{role}:{owner_id}:{bucket}"
+
+
+def get_calendars(role: str, owner_id, computes: dict, before_compute=None) -> dict:
+    """
+    computes - {bucket: funkcija, grąžinanti suformatuotą sąrašą}.
+    Grąžina {bucket: sąrašas}; trūkstami laikotarpiai perskaičiuojami.
+    before_compute - kviečiama vieną kartą prieš skaičiuojant (pvz. savininko
+    patikrinimas), jei visi laikotarpiai rasti keše - nekviečiama.
+    """
+    buckets = list(computes)
+
+    pipe = r.pipeline()
+    for bucket in buckets:
+        pipe.hgetall(calendar_key(role, owner_id, bucket))
+    cached_values = pipe.execute()
+
+    calendars, misses = {}, {}
+    for bucket, cached in zip(buckets, cached_values):
+        if 'v' in cached:
+            try:
+                calendars[bucket] = json.loads(cached['v'])
+                continue
+            except ValueError:
+                pass  # sugadinta reiksme - perskaiciuojam
+
+        misses[bucket] = cached.get('gen', '0')
+
+    if not misses:
+        return calendars
+
+    if before_compute is not None:
+        before_compute()
+
+    pipe = r.pipeline()
+    for bucket, gen in misses.items():
+        calendars[bucket] = computes[bucket]()
+        _store_if_current(
+            keys=[calendar_key(role, owner_id, bucket)],
+            args=[gen, json.dumps(calendars[bucket]), CALENDAR_TTL],
+            client=pipe
+        )
+    pipe.execute()
+
+    return calendars
+
+
+def invalidate_calendars(tutor_ids, student_ids, times):
+    """ Invaliduoja nurodytų laikų savaites ir mėnesius visiems savininkams. """
+    buckets = set()
+    for time in times:
+        buckets.add(week_bucket(time))
+        buckets.add(month_bucket(time.year, time.month))
+
+    owners = [(TUTOR_CALENDAR, str(tutor_id)) for tutor_id in set(tutor_ids)]
+    owners += [(STUDENT_CALENDAR, str(student_id)) for student_id in set(student_ids)]
+
+    try:
+        pipe = r.pipeline()
+        for role, owner_id in owners:
+            for bucket in buckets:
+                key = calendar_key(role, owner_id, bucket)
+                pipe.hincrby(key, 'gen', 1)
+                pipe.hdel(key, 'v')
+                pipe.expire(key, CALENDAR_TTL)
+        pipe.execute()
+
+    except Exception as e:
+        # Pamoka jau irasyta - kesas bus pasenes iki CALENDAR_TTL
+        print(f"Nepavyko invaliduoti kalendoriaus kešo: {e}")
+
+
+def invalidate_lesson_calendars(lesson_doc: dict, times=(), student_ids=()):
+    """
+    Invaliduoja pamokos (jos korepetitoriaus ir mokinių) kalendorius:
+    pamokos laiką ir papildomus times (pvz. naują laiką), student_ids - mokiniai,
+    kurių dokumente dar nėra (pvz. ką tik pridėti).
+    """
+    invalidate_calendars(
+        [lesson_doc['tutor']['tutor_id']],
+        [student['student_id'] for student in lesson_doc['students']] + list(student_ids),
+        [lesson_doc['time'], *times]
+    )
+
+
+def forget_owner_calendars(role: str, owner_id):
+    """ Ištrina visus savininko kalendorius (pvz. ištrynus korepetitorių). """
+    pipe = r.pipeline()
+    for key in r.scan_iter(match=calendar_key(role, owner_id, '*'), count=1000):
+        pipe.delete(key)
+    pipe.execute()
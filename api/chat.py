@@ -0,0 +1,175 @@
+"""
+Pokalbių istorija.
+
+Naujausios kiekvienos poros (korepetitorius, mokinys) žinutės laikomos ribotame
+Redis sąraše, todėl prisijungimas prie pokalbio - vienas Redis skaitymas.
+Senesnės žinutės skaitomos iš Cassandra puslapiais pagal message_id (timeuuid)
+žymeklį. Žinutės visada grąžinamos nuo naujausios.
+
+Naujos žinutės į Cassandra patenka per srautą CHAT_STREAM (api/chat_writer.py),
+todėl sąrašas užpildomas iš Cassandra ir poros dar neįrašytų žinučių hash'o
+(pending_messages_key) - viso srauto skaityti nereikia. Sąrašas turi
+CHAT_RECENT_TTL - net jei kokia žinutė į jį nepateko, jis bus perkurtas.
+"""
+
+import json
+from uuid import UUID
+
+from api.connection import get_redis
+from cassandra_db.statements import get_statement
+
+# Kiek naujausių žinučių laikome Redis sąraše
+CHAT_RECENT_LIMIT = 50
+# Kiek žinučių grąžinam vienam "rodyti senesnes" puslapiui
+CHAT_PAGE_SIZE = 50
+# Po kiek laiko sarasas perkuriamas is Cassandra (nepratesiamas siunciant)
+CHAT_RECENT_TTL = 3600
+# Dar neirasytos i Cassandra zinutes (api/chat_writer.py)
+CHAT_STREAM = "chat:persist"
+# Kiek laikomas poros neirasytu zinuciu hash'as (pratesiamas siunciant)
+CHAT_PENDING_TTL = 86400
+
+r = get_redis()
+
+# Perkuria sarasa (ARGV[3..] - zinutes nuo naujausios) ir prideda poros dar
+# neirasytas zinutes is KEYS[2]. Atomiskai: veliau atsiustas zinutes prides
+# LPUSHX siunciant
+_rebuild_recent = r.register_script("""
+local seen = {}
+redis.call('DEL', KEYS[1])
+for i = 3, #ARGV do
+    seen[cjson.decode(ARGV[i])['message_id']] = true
+    redis.call('RPUSH', KEYS[1], ARGV[i])
+end
+
+local pending = redis.call('HGETALL', KEYS[2])
+for i = 1, #pending, 2 do
+    if not seen[pending[i]] then
+        redis.call('LPUSH', KEYS[1], pending[i + 1])
+    end
+end
+
+redis.call('LTRIM', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return redis.call('LRANGE', KEYS[1], 0, -1)
+""")
+
+
+def recent_messages_key(tutor_id: str, student_id: str) -> str:
+    return f"chat:{tutor_id}:{student_id}:recent"
+
+
+def pending_messages_key(tutor_id: str, student_id: str) -> str:
+    # message_id -> zinute, kol rasytojas jos neirase i Cassandra
+    return f"chat:{tutor_id}:{student_id}:pending"
+
+
+def format_message(message_id, sender_role, message_text, sent_at) -> dict:
+    """ Žinutė tokiu pavidalu, kokiu ją gauna naršyklė. """
+    return {
+        "message_id": str(message_id),
+        "sender": sender_role,
+        "message": message_text,
+        "timestamp": sent_at.isoformat() if sent_at else ""
+    }
+
+
+def _message_order(message: dict):
+    # message_id - timeuuid, jo laikas rikiuoja zinutes
+    return UUID(message["message_id"]).time
+
+
+def _latest_unique(messages) -> list[dict]:
+    """ Be pasikartojimų, nuo naujausios, ne daugiau CHAT_RECENT_LIMIT. """
+    unique = {message["message_id"]: message for message in messages}
+    return sorted(unique.values(), key=_message_order, reverse=True)[:CHAT_RECENT_LIMIT]
+
+
+def cache_message(redis_client, tutor_id: str, student_id: str, message: dict):
+    """
+    Prideda naują žinutę į naujausių žinučių sąrašą.
+    Jei sąrašo dar nėra (niekas neprisijungė), nieko nedaro - jį užpildys get_recent_messages.
+    """
+    key = recent_messages_key(tutor_id, student_id)
+
+    pipe = redis_client.pipeline()
+    pipe.lpushx(key, json.dumps(message))
+    pipe.ltrim(key, 0, CHAT_RECENT_LIMIT - 1)
+    pipe.execute()
+
+
+def get_message_page(
+    cassandra_session,
+    tutor_id: str,
+    student_id: str,
+    before_message_id: str = None,
+    limit: int = CHAT_PAGE_SIZE
+) -> tuple[list[dict], str | None]:
+    """
+    Grąžina iki limit žinučių (nuo naujausios), senesnių nei before_message_id,
+    ir žymeklį kitam puslapiui (None, jei senesnių žinučių nebėra).
+    """
+    if before_message_id:
+        rows = cassandra_session.execute(
+            get_statement(cassandra_session, 'select_messages_by_pair_before'),
+            (tutor_id, student_id, UUID(before_message_id), limit)
+        )
+    else:
+        rows = cassandra_session.execute(
+            get_statement(cassandra_session, 'select_messages_by_pair_latest'),
+            (tutor_id, student_id, limit)
+        )
+
+    messages = [
+        format_message(row.message_id, row.sender_role, row.message_text, row.sent_at)
+        for row in rows
+    ]
+
+    next_cursor = messages[-1]["message_id"] if len(messages) == limit else None
+    return messages, next_cursor
+
+
+def get_recent_messages(
+    redis_client,
+    cassandra_session,
+    tutor_id: str,
+    student_id: str
+) -> tuple[list[dict], str | None]:
+    """
+    Grąžina naujausias žinutes iš Redis. Jei sąrašo nėra, paima jas iš Cassandra
+    ir užpildo sąrašą. Grąžina ir žymeklį senesnėms žinutėms.
+    """
+    key = recent_messages_key(tutor_id, student_id)
+
+    cached = redis_client.lrange(key, 0, CHAT_RECENT_LIMIT - 1)
+    if cached:
+        # Tarp užpildymo ir naujos žinutės ta pati žinutė gali patekti du kartus,
+        # o vėluojanti srauto žinutė - ne savo vietoje
+        messages = _latest_unique(json.loads(raw) for raw in cached)
+
+        next_cursor = messages[-1]["message_id"] if len(cached) == CHAT_RECENT_LIMIT else None
+        return messages, next_cursor
+
+    # Neirasytos zinutes skaitomos pries Cassandra: zinute, irasyta tarp siu
+    # skaitymu, bus arba cia, arba Cassandra
+    pending_key = pending_messages_key(tutor_id, student_id)
+    pending = redis_client.hvals(pending_key)
+    messages, _ = get_message_page(
+        cassandra_session, tutor_id, student_id, limit=CHAT_RECENT_LIMIT
+    )
+    messages = _latest_unique(messages + [json.loads(raw) for raw in pending])
+
+    # Vėliau atsiųstos žinutės pridedamos skripte, atomiškai su sąrašo perkūrimu
+    rebuilt = _rebuild_recent(
+        keys=[key, pending_key],
+        args=[
+            CHAT_RECENT_LIMIT,
+            CHAT_RECENT_TTL,
+            *[json.dumps(message) for message in messages]
+        ],
+        client=redis_client
+    )
+
+    messages = _latest_unique(json.loads(raw) for raw in rebuilt)
+    next_cursor = messages[-1]["message_id"] if len(messages) == CHAT_RECENT_LIMIT else None
+    return messages, next_cursor
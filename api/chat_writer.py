@@ -0,0 +1,215 @@
+"""
+Pokalbio žinučių įrašymas į Cassandra fone (write-behind).
+
+handle_send_message žinutę tik įdeda į Redis srautą (stream) CHAT_STREAM ir iš
+karto ją išsiunčia kambariui. Fono gija skaito srautą per vartotojų grupę,
+įrašo abi kopijas (by_pair ir by_sender) ir tik tada žinutę patvirtina (XACK).
+
+Jei procesas nukrenta, nepatvirtintos žinutės lieka grupės laukiančiųjų sąraše
+ir po CHAT_CLAIM_IDLE_MS jas perima bet kuris kitas (ar iš naujo paleistas)
+rašytojas. Įrašymai idempotentiški (tas pats message_id), todėl pakartotinis
+įrašymas nieko nesugadina.
+
+Jei srautas per ilgas (Cassandra nespėja), send_chat_message žinutę įrašo
+sinchroniškai - taip lėtėja siuntėjas, o ne auga eilė.
+
+Rašytojas paleidžiamas kartu su programa (app/app.py), o atskirai - taip:
+    python -m api.chat_writer
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+from datetime import datetime
+from uuid import UUID
+
+from redis.exceptions import ResponseError
+
+from api.chat import (
+    format_message,
+    recent_messages_key,
+    pending_messages_key,
+    CHAT_RECENT_LIMIT,
+    CHAT_PENDING_TTL,
+    CHAT_STREAM
+)
+from api.connection import get_cassandra_session
+from cassandra_db.statements import execute_writes
+
+CHAT_GROUP = "cassandra-writers"
+
+# Kiek neįrašytų žinučių leidžiame sraute, kol pereinam prie sinchroninio įrašymo
+CHAT_STREAM_MAX_PENDING = int(os.getenv('CHAT_STREAM_MAX_PENDING', 10000))
+# Kiek žinučių įrašom vienu kartu
+CHAT_WRITE_BATCH = 100
+CHAT_WRITE_RETRIES = 5
+CHAT_RETRY_BASE_DELAY = 0.2
+# Po kiek laiko kito rašytojo nepatvirtintos žinutės laikomos apleistomis
+CHAT_CLAIM_IDLE_MS = 30000
+CHAT_BLOCK_MS = 1000
+
+_writer = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+
+def _message_writes(entry: dict) -> list[tuple[str, tuple]]:
+    """ Srauto įrašas -> abiejų Cassandra lentelių įrašymai. """
+    message_id = UUID(entry["message_id"])
+    sent_at = datetime.fromisoformat(entry["sent_at"])
+
+    return [
+        ('insert_message_by_pair',
+         (entry["tutor_id"], entry["student_id"], message_id,
+          entry["sender_role"], entry["message_text"], sent_at)),
+        ('insert_message_by_sender',
+         (entry["sender_role"], entry["sender_id"], entry["tutor_id"], entry["student_id"],
+          message_id, entry["message_text"], sent_at)),
+    ]
+
+
+def send_chat_message(
+    redis_client,
+    tutor_id: str,
+    student_id: str,
+    sender_role: str,
+    message_id,
+    message_text: str,
+    sent_at: datetime
+) -> dict:
+    """
+    Įdeda žinutę į įrašymo srautą ir naujausių žinučių sąrašą (vienas Redis kreipinys).
+    Grąžina žinutę, paruoštą išsiuntimui kambariui.
+    """
+    sender_id = tutor_id if sender_role == "tutor" else student_id
+    entry = {
+        "tutor_id": tutor_id,
+        "student_id": student_id,
+        "sender_role": sender_role,
+        "sender_id": sender_id,
+        "message_id": str(message_id),
+        "message_text": message_text,
+        "sent_at": sent_at.isoformat(),
+    }
+    message = format_message(message_id, sender_role, message_text, sent_at)
+
+    # Tas pats kaip cache_message, tik kartu su XADD ir poros neirasytomis zinutemis
+    key = recent_messages_key(tutor_id, student_id)
+    pending_key = pending_messages_key(tutor_id, student_id)
+
+    pipe = redis_client.pipeline()
+    pipe.xlen(CHAT_STREAM)
+    pipe.xadd(CHAT_STREAM, entry)
+    pipe.hset(pending_key, entry["message_id"], json.dumps(message))
+    pipe.expire(pending_key, CHAT_PENDING_TTL)
+    pipe.lpushx(key, json.dumps(message))
+    pipe.ltrim(key, 0, CHAT_RECENT_LIMIT - 1)
+    pending, entry_id, *_ = pipe.execute()
+
+    if pending >= CHAT_STREAM_MAX_PENDING:
+        # Rašytojai nespėja - įrašom patys ir išimam iš srauto
+        execute_writes(get_cassandra_session(), _message_writes(entry))
+        pipe = redis_client.pipeline()
+        pipe.xdel(CHAT_STREAM, entry_id)
+        pipe.hdel(pending_key, entry["message_id"])
+        pipe.execute()
+
+    return message
+
+
+def _ensure_group(redis_client):
+    try:
+        redis_client.xgroup_create(CHAT_STREAM, CHAT_GROUP, id="0", mkstream=True)
+    except ResponseError as e:
+        # Grupė jau sukurta
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def _persist_batch(entries: list[tuple[str, dict]]) -> bool:
+    """ Įrašo žinučių paketą su pakartojimais. Grąžina, ar pavyko. """
+    writes = [write for _, entry in entries for write in _message_writes(entry)]
+
+    for attempt in range(CHAT_WRITE_RETRIES):
+        try:
+            execute_writes(get_cassandra_session(), writes)
+            return True
+        except Exception as e:
+            delay = CHAT_RETRY_BASE_DELAY * 2 ** attempt
+            print(f"Nepavyko įrašyti žinučių ({attempt + 1}/{CHAT_WRITE_RETRIES}): {e}")
+            time.sleep(delay)
+
+    return False
+
+
+def run_chat_writer(redis_client, consumer: str, stop_event: threading.Event = None):
+    """
+    Rašytojo ciklas: pirma perima apleistas žinutes, tada skaito naujas.
+    Nepavykusios žinutės lieka nepatvirtintos ir bus bandomos vėliau.
+    """
+    _ensure_group(redis_client)
+
+    while stop_event is None or not stop_event.is_set():
+        try:
+            _, entries, *_ = redis_client.xautoclaim(
+                CHAT_STREAM, CHAT_GROUP, consumer,
+                min_idle_time=CHAT_CLAIM_IDLE_MS, start_id="0-0", count=CHAT_WRITE_BATCH
+            )
+
+            if not entries:
+                response = redis_client.xreadgroup(
+                    CHAT_GROUP, consumer, {CHAT_STREAM: ">"},
+                    count=CHAT_WRITE_BATCH, block=CHAT_BLOCK_MS
+                )
+                entries = response[0][1] if response else []
+
+            # Ištrinti įrašai perimant grąžinami kaip (id, None)
+            entries = [(entry_id, entry) for entry_id, entry in entries if entry]
+            if not entries:
+                continue
+
+            if _persist_batch(entries):
+                ids = [entry_id for entry_id, _ in entries]
+                pipe = redis_client.pipeline()
+                pipe.xack(CHAT_STREAM, CHAT_GROUP, *ids)
+                pipe.xdel(CHAT_STREAM, *ids)
+                for _, entry in entries:
+                    pipe.hdel(
+                        pending_messages_key(entry["tutor_id"], entry["student_id"]),
+                        entry["message_id"]
+                    )
+                pipe.execute()
+
+        except Exception as e:
+            print(f"Žinučių rašytojo klaida: {e}")
+            time.sleep(CHAT_RETRY_BASE_DELAY)
+
+
+def start_chat_writer(redis_client):
+    """ Paleidžia rašytojo giją (vieną procesui; po fork() - iš naujo). """
+    global _writer, _writer_pid
+
+    if _writer is not None and _writer_pid == os.getpid() and _writer.is_alive():
+        return _writer
+
+    with _writer_lock:
+        if _writer is None or _writer_pid != os.getpid() or not _writer.is_alive():
+            consumer = f"{socket.gethostname()}-{os.getpid()}"
+            _writer = threading.Thread(
+                target=run_chat_writer,
+                args=(redis_client, consumer),
+                name="chat-writer",
+                daemon=True
+            )
+            _writer.start()
+            _writer_pid = os.getpid()
+
+    return _writer
+
+
+if __name__ == "__main__":
+    from api.connection import get_redis
+
+    run_chat_writer(get_redis(), f"{socket.gethostname()}-{os.getpid()}")
@@ -1,17 +1,19 @@
-import clickhouse_connect
 import pandas as pd
-from clickhouse.clickhouse_config import USERNAME, PASSWORD, HOST
+from api.connection import get_clickhouse_client
 from api.reviews import avg_rating_student_tutor
+from api.surrogate_keys import next_key
+from api.key_mapping import (
+    STUDENT_ENTITY,
+    TUTOR_ENTITY,
+    forget_sk,
+    record_sks,
+    resolve_sk,
+    resolve_sks
+)
 
 
-def get_clickhouse_client():
-    return clickhouse_connect.get_client(
-        host=HOST, user=USERNAME, password=PASSWORD, secure=True
-    )
-
-
-def add_student_clickhouse(client, first_name, last_name, class_num, school_name, date_of_birth):
-    """Prideda studentą į ClickHouse"""
+def add_student_clickhouse(client, first_name, last_name, class_num, school_name, date_of_birth, student_id=None):
+    """Prideda studentą į ClickHouse (su student_id - ir į _id -> student_sk atvaizdį)"""
 
     # Gauname school_sk pagal school_name
     school_result = client.query(f"SELECT school_sk FROM dim_schools WHERE name = '{school_name}'")
@@ -20,9 +22,8 @@ def add_student_clickhouse(client, first_name, last_name, class_num, school_name
 
     school_sk = school_result.result_set[0][0]
 
-    # Randame naują student_sk
-    result = client.query("SELECT MAX(student_sk) FROM dim_students")
-    next_student_sk = result.result_set[0][0] + 1 if result.result_set[0][0] is not None else 1
+    # Naujas student_sk is sekos (api/surrogate_keys.py), be MAX skenavimo
+    next_student_sk = next_key("dim_students", client)
 
     # Sukuriame naują studento įrašą
     new_student = pd.DataFrame(
@@ -38,14 +39,19 @@ def add_student_clickhouse(client, first_name, last_name, class_num, school_name
 
     # Įterpiame į dim_students
     client.insert_df("dim_students", new_student)
+
+    if student_id is not None:
+        record_sks(STUDENT_ENTITY, {student_id: next_student_sk}, client)
     return next_student_sk
 
 
-def delete_student_clickhouse(client, first_name, last_name):
+def delete_student_clickhouse(client, first_name, last_name, student_id=None):
     """
     Ištrina studentą iš ClickHouse pagal vardą, pavardę
     Grąžina True, jei studentas buvo rastas ir ištrintas, False – jei nerastas.
     """
+    if student_id is not None:
+        forget_sk(STUDENT_ENTITY, student_id, client)
 
     # Surandame student_sk
     query = f"SELECT student_sk FROM dim_students WHERE first_name = '{first_name}' AND last_name = '{last_name}'"
@@ -64,11 +70,11 @@ def delete_student_clickhouse(client, first_name, last_name):
     return True
 
 
-def add_tutor_clickhouse(client, first_name, last_name, date_of_birth):
-    """Prideda korepetitorių į clickhouse"""
+def add_tutor_clickhouse(client, first_name, last_name, date_of_birth, tutor_id=None):
+    """Prideda korepetitorių į clickhouse (su tutor_id - ir į _id -> tutor_sk atvaizdį)"""
 
-    result = client.query("SELECT MAX(tutor_sk) FROM dim_tutors")
-    next_tutor_sk = result.result_set[0][0] + 1
+    # Naujas tutor_sk is sekos (api/surrogate_keys.py), be MAX skenavimo
+    next_tutor_sk = next_key("dim_tutors", client)
 
     new_tutor = pd.DataFrame(
         {
@@ -80,14 +86,19 @@ def add_tutor_clickhouse(client, first_name, last_name, date_of_birth):
     )
 
     client.insert_df("dim_tutors", new_tutor)
+
+    if tutor_id is not None:
+        record_sks(TUTOR_ENTITY, {tutor_id: next_tutor_sk}, client)
     return next_tutor_sk
 
 
-def delete_tutor_clickhouse(client, first_name, last_name, date_of_birth=None):
+def delete_tutor_clickhouse(client, first_name, last_name, date_of_birth=None, tutor_id=None):
     """
     Ištrina korepetitorių iš ClickHouse pagal vardą, pavardę
     Grąžina True, jei korepetitorius buvo rastas ir ištrintas, False – jei nerastas.
     """
+    if tutor_id is not None:
+        forget_sk(TUTOR_ENTITY, tutor_id, client)
 
     # Surandame tutor_sk
     query = f"SELECT tutor_sk FROM dim_tutors WHERE first_name = '{first_name}' AND last_name = '{last_name}'"
@@ -106,64 +117,22 @@ def delete_tutor_clickhouse(client, first_name, last_name, date_of_birth=None):
     return True
 
 
-
-from bson import ObjectId
-
 def get_student_fk_clickhouse(client, student_id, db):
     """
     Pagal MongoDB student_id suranda student_fk (student_sk) ClickHouse dim_students.
     Grąžina student_sk, arba None, jei nerasta.
+    Raktas imamas iš _id -> student_sk atvaizdžio (api/key_mapping.py).
     """
-    # Gauname studentą iš MongoDB
-    student = db.student.find_one({"_id": ObjectId(student_id)})
-    if not student:
-        return None
-
-    first_name = student.get("first_name")
-    last_name = student.get("last_name")
-    date_of_birth = student.get("date_of_birth")
-    class_num = student.get("class")
-
-    # Surandame student_sk ClickHouse pagal first_name, last_name
-    query = f"SELECT student_sk FROM dim_students WHERE first_name = '{first_name}' AND last_name = '{last_name}'"
-    if date_of_birth:
-        dob_str = pd.to_datetime(date_of_birth).date()
-        query += f" AND date_of_birth = '{dob_str}'"
-    if class_num:
-        query += f" AND class = {class_num}"
-
-    result = client.query(query)
-    if not result.result_set or not result.result_set[0]:
-        return None
-
-    return result.result_set[0][0]
+    return resolve_sk(STUDENT_ENTITY, student_id, client, db)
 
 
 def get_tutor_fk_clickhouse(client, tutor_id, db):
     """
     Pagal MongoDB tutor_id suranda tutor_fk (tutor_sk) ClickHouse dim_tutors.
     Grąžina tutor_sk, arba None, jei nerasta.
+    Raktas imamas iš _id -> tutor_sk atvaizdžio (api/key_mapping.py).
     """
-    # Gauname korepetitorių iš MongoDB
-    tutor = db.tutor.find_one({"_id": ObjectId(tutor_id)})
-    if not tutor:
-        return None
-
-    first_name = tutor.get("first_name")
-    last_name = tutor.get("last_name")
-    date_of_birth = tutor.get("date_of_birth")
-
-    # Surandame tutor_sk ClickHouse pagal first_name
-    query = f"SELECT tutor_sk FROM dim_tutors WHERE first_name = '{first_name}' AND last_name = '{last_name}'"
-    if date_of_birth:
-        dob_str = pd.to_datetime(date_of_birth).date()
-        query += f" AND date_of_birth = '{dob_str}'"
-
-    result = client.query(query)
-    if not result.result_set or not result.result_set[0]:
-        return None
-
-    return result.result_set[0][0]
+    return resolve_sk(TUTOR_ENTITY, tutor_id, client, db)
 
 
 def get_subject_sk_clickhouse(client, subject_name):
@@ -309,6 +278,23 @@ def f_student_tutor_stat_add(client, student_id, tutor_id, subject_name, db, rat
     client.insert_df("f_student_tutor_stat", new_record)
     return True
 
+def has_student_tutor_stat(client, student_id, tutor_id, subject_name, db):
+    """
+    Ar f_student_tutor_stat jau yra įrašas (student, tutor, subject).
+    Naudojama, kad pakartotas outbox įvykis nesukurtų dublikato.
+    """
+    student_fk = get_student_fk_clickhouse(client, student_id, db)
+    tutor_fk = get_tutor_fk_clickhouse(client, tutor_id, db)
+    subject_sk = get_subject_sk_clickhouse(client, subject_name)
+    if student_fk is None or tutor_fk is None or subject_sk is None:
+        return False
+
+    result = client.query(f"""
+        SELECT count() FROM f_student_tutor_stat
+        WHERE student_fk = {student_fk} AND tutor_fk = {tutor_fk} AND subject_fk = {subject_sk}
+    """)
+    return result.result_set[0][0] > 0
+
 def update_studied_with_tutor_to(client, student_id, tutor_id, db):
     """
     Atnaujina studied_with_tutor_to į dabartinę datą ClickHouse lentelėje f_student_tutor_stat
@@ -355,37 +341,50 @@ def update_student_tutor_rating(clickhouse_client, student_id, tutor_id, mongo_d
     return True
 
 def update_student_tutor_lesson_count(ch, tutor_id : str, student_ids: list[str], db, lesson):
+    """
+    Prideda lesson pamokų visoms (student, tutor) poroms: raktai vienu kartu
+    (api/key_mapping.py), esamos poros - vienas SELECT ir vienas ALTER UPDATE,
+    naujos - vienas INSERT.
+    """
     tutor_fk = get_tutor_fk_clickhouse(ch, tutor_id, db)
     if tutor_fk is None:
         raise ValueError(f"Tutor ID {tutor_id} nerastas dim_tutors lentelėje")
 
+    student_fks = resolve_sks(STUDENT_ENTITY, student_ids, ch, db)
     for student_id in student_ids:
-
-        student_fk = get_student_fk_clickhouse(ch, student_id, db)
-        if student_fk is None:
+        if str(student_id) not in student_fks:
             print(f"⚠ Student ID {student_id} nerastas – praleidžiam")
-            continue
 
-        existing = ch.query(f"""
-            SELECT total_lessons FROM f_student_tutor_stat
-            WHERE student_fk = {student_fk} AND tutor_fk = {tutor_fk}
+    student_fks = sorted(set(student_fks.values()))
+    if not student_fks:
+        return
+
+    fk_list = ', '.join(str(student_fk) for student_fk in student_fks)
+    existing = {
+        row[0]
+        for row in ch.query(f"""
+            SELECT DISTINCT student_fk FROM f_student_tutor_stat
+            WHERE tutor_fk = {tutor_fk} AND student_fk IN ({fk_list})
         """).result_rows
+    }
 
-        if existing:
-            current = existing[0][0] + lesson
-            ch.query(f"""
-                ALTER TABLE f_student_tutor_stat
-                UPDATE total_lessons = {current}
-                WHERE student_fk = {student_fk} AND tutor_fk = {tutor_fk}
-            """)
-            print(f"🔄 Student {student_fk} + Tutor {tutor_fk} → total_lessons {current}")
-        else:
-            ch.insert(
-                "f_student_tutor_stat",
-                [[student_fk, tutor_fk, 1]],
-                column_names=["student_fk", "tutor_fk", "total_lessons"]
-            )
-            print(f"Sukurtas naujas įrašas Student {student_fk} + Tutor {tutor_fk}")
+    if existing:
+        ch.command(f"""
+            ALTER TABLE f_student_tutor_stat
+            UPDATE total_lessons = total_lessons + {lesson}
+            WHERE tutor_fk = {tutor_fk} AND student_fk IN ({', '.join(str(student_fk) for student_fk in sorted(existing))})
+        """)
+        print(f"🔄 Tutor {tutor_fk}: total_lessons {lesson:+} {len(existing)} mokiniams")
+
+    # Naujoms poroms irasa kuriam tik pridedant pamokas
+    new_fks = [student_fk for student_fk in student_fks if student_fk not in existing]
+    if new_fks and lesson > 0:
+        ch.insert(
+            "f_student_tutor_stat",
+            [[student_fk, tutor_fk, lesson] for student_fk in new_fks],
+            column_names=["student_fk", "tutor_fk", "total_lessons"]
+        )
+        print(f"Sukurti nauji įrašai Tutor {tutor_fk}: {len(new_fks)} mokiniams")
 
 
 
@@ -412,15 +411,10 @@ if __name__ == "__main__":
 
     # remove_tutor(client, tutor_id)
     """
-    from pymongo import MongoClient
-    import os
-    from dotenv import load_dotenv
-
-    load_dotenv()
+    from api.connection import get_db
 
     clickhouse_client = get_clickhouse_client()
-    mongo_client = MongoClient(os.getenv('MONGO_URI'))
-    mongo_db = mongo_client['mendel-tutor']
+    mongo_db = get_db()
 
     update_student_tutor_rating(
         clickhouse_client=clickhouse_client,
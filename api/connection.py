@@ -1,17 +1,155 @@
+"""
+Bendras prisijungimų registras visoms duomenų bazėms.
+
+Kiekvienas klientas (Mongo, Redis, Cassandra, Neo4j, ClickHouse) sukuriamas
+tik pirmo kreipimosi metu ir po to naudojamas pakartotinai visame procese,
+todėl jungčių telkiniai (angl. *connection pools*) nedubliuojami.
+
+Po fork() (pvz. gunicorn worker'iai) vaikiniame procese registras išvalomas ir
+klientai sukuriami iš naujo. Mongo klientas kuriamas su connect=False, o Redis
+ir Neo4j jungiasi tik pirmos užklausos metu, todėl juos galima laikyti modulio
+kintamuosiuose. Cassandra ir ClickHouse jungiasi iš karto - juos reikia gauti
+per get_cassandra_session() / get_clickhouse_client() ten, kur jie naudojami.
+
+Telkinių dydžiai nustatomi per aplinkos kintamuosius (žr. žemiau).
+"""
+
 import os
+import threading
 from dotenv import load_dotenv
 from pymongo import MongoClient
 from pymongo.server_api import ServerApi
 
 load_dotenv()
 
-def get_db():
-    uri = os.getenv('MONGO_URI')
+MONGO_DATABASE = 'mendel-tutor'
+
+MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', 50))
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', 50))
+REDIS_POOL_TIMEOUT = int(os.getenv('REDIS_POOL_TIMEOUT', 5))
+NEO4J_MAX_POOL_SIZE = int(os.getenv('NEO4J_MAX_POOL_SIZE', 50))
+CLICKHOUSE_POOL_SIZE = int(os.getenv('CLICKHOUSE_POOL_SIZE', 8))
+# Cassandra (protocol v3+) vienoje jungtyje multipleksuoja užklausas,
+# todėl reguliuojame tik callback'ų vykdymo gijų skaičių
+CASSANDRA_EXECUTOR_THREADS = int(os.getenv('CASSANDRA_EXECUTOR_THREADS', 4))
+
+_clients: dict = {}
+_lock = threading.Lock()
+_pid = os.getpid()
+
+
+def _reset_after_fork():
+    """ Vaikiniame procese pamirštami tėvo klientai (jų jungtys nesidalinamos). """
+    global _lock, _pid
+    _clients.clear()
+    _lock = threading.Lock()
+    _pid = os.getpid()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
 
-    cluster = MongoClient(
-        uri,
+
+def _get_or_create(name: str, factory):
+    """ Grąžina registre esantį klientą arba jį sukuria (vieną kartą procesui). """
+
+    # Atsarginis patikrinimas platformoms be register_at_fork
+    if os.getpid() != _pid:
+        _reset_after_fork()
+
+    client = _clients.get(name)
+    if client is not None:
+        return client
+
+    with _lock:
+        client = _clients.get(name)
+        if client is None:
+            client = factory()
+            _clients[name] = client
+
+    return client
+
+
+def _create_mongo_client() -> MongoClient:
+    return MongoClient(
+        os.getenv('MONGO_URI'),
         server_api=ServerApi(version='1', strict=True, deprecation_errors=True),
-        tls=True
+        tls=True,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        connect=False
+    )
+
+
+def _create_redis_client():
+    from redis_api.redis_client import create_redis_client
+    return create_redis_client(
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT
+    )
+
+
+def _create_cassandra_session():
+    from cassandra_db.cassandra_client import create_cassandra_session
+    return create_cassandra_session(executor_threads=CASSANDRA_EXECUTOR_THREADS)
+
+
+def _create_neo4j_driver():
+    from neo4j_db.neo4j_client import create_driver
+    return create_driver(max_connection_pool_size=NEO4J_MAX_POOL_SIZE)
+
+
+def _create_clickhouse_client():
+    import clickhouse_connect
+    from clickhouse_connect.driver import httputil
+    from clickhouse.clickhouse_config import USERNAME, PASSWORD, HOST
+
+    # Klientas dalinamas tarp giju, todel atskiru sesiju negeneruojam -
+    # ClickHouse neleidzia lygiagreciu uzklausu toje pacioje sesijoje
+    return clickhouse_connect.get_client(
+        host=HOST,
+        user=USERNAME,
+        password=PASSWORD,
+        secure=True,
+        autogenerate_session_id=False,
+        pool_mgr=httputil.get_pool_manager(maxsize=CLICKHOUSE_POOL_SIZE)
     )
 
-    return cluster['mendel-tutor']
+
+def get_mongo_client() -> MongoClient:
+    return _get_or_create('mongo', _create_mongo_client)
+
+
+def get_db():
+    return get_mongo_client()[MONGO_DATABASE]
+
+
+def get_redis():
+    return _get_or_create('redis', _create_redis_client)
+
+
+def get_cassandra_session():
+    return _get_or_create('cassandra', _create_cassandra_session)
+
+
+def get_neo4j_driver():
+    return _get_or_create('neo4j', _create_neo4j_driver)
+
+
+def get_clickhouse_client():
+    return _get_or_create('clickhouse', _create_clickhouse_client)
+
+
+def close_all():
+    """ Uždaro visus registre esančius klientus (pvz. išjungiant programą). """
+    with _lock:
+        clients = list(_clients.items())
+        _clients.clear()
+
+    for name, client in clients:
+        try:
+            if name == 'cassandra':
+                client.cluster.shutdown()
+            else:
+                client.close()
+        except Exception as e:
+            print(f"Nepavyko uždaryti {name} kliento: {e}")
@@ -0,0 +1,400 @@
+"""
+Neo4j grafo kopija proceso atmintyje (neprivaloma, GRAPH_SNAPSHOT=1).
+
+Student, Tutor ir School mazgai bei FRIENDS_WITH, REQUESTS_FRIENDSHIP,
+TEACHES ir ATTENDS ryšiai įkeliami į CSR gretimumo masyvus (NumPy):
+mazgo i kaimynai yra indices[indptr[i]:indptr[i + 1]]. Tada get_friends,
+draugystės prašymai, get_tutors_by_school ir rekomendacijų BFS
+(api/neo4j.py) skaičiuojami vietoje, be kreipinio į Aura.
+
+Šviežumas:
+    - api/neo4j.py rašymo funkcijos, sėkmingai įrašiusios į Neo4j, pritaiko tą
+      patį pakeitimą kopijai (apply_event). Pakeitimai laikomi perdengime
+      (pridėti/išimti ryšiai), CSR masyvai nekeičiami;
+    - kas GRAPH_SNAPSHOT_RELOAD_INTERVAL sekundžių kopija įkeliama iš naujo
+      fone (taip matomi ir kitų procesų pakeitimai), o įkėlimo metu įvykę
+      pakeitimai pritaikomi naujai kopijai.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from neo4j_db.neo4j_client import NEO4J_DATABASE
+
+GRAPH_SNAPSHOT_ENABLED = os.getenv('GRAPH_SNAPSHOT', '0') == '1'
+GRAPH_SNAPSHOT_RELOAD_INTERVAL = int(os.getenv('GRAPH_SNAPSHOT_RELOAD_INTERVAL', 300))
+
+STUDENT, TUTOR, SCHOOL = 'Student', 'Tutor', 'School'
+
+# ryšys -> (iš kokios etiketės, į kokią, užklausa (src, dst) poroms)
+RELATIONS = {
+    'friends': (STUDENT, STUDENT, """
+        MATCH (a:Student)-[:FRIENDS_WITH]-(b:Student)
+        RETURN elementId(a) AS src, elementId(b) AS dst
+    """),
+    'requests': (STUDENT, STUDENT, """
+        MATCH (a:Student)-[:REQUESTS_FRIENDSHIP]->(b:Student)
+        RETURN elementId(a) AS src, elementId(b) AS dst
+    """),
+    'teaches': (TUTOR, STUDENT, """
+        MATCH (t:Tutor)-[:TEACHES]->(s:Student)
+        RETURN elementId(t) AS src, elementId(s) AS dst
+    """),
+    'attends': (STUDENT, SCHOOL, """
+        MATCH (s:Student)-[:ATTENDS]->(school:School)
+        RETURN elementId(s) AS src, elementId(school) AS dst
+    """),
+}
+
+NODE_QUERIES = {
+    STUDENT: "MATCH (s:Student) RETURN elementId(s) AS id, [s.first_name, s.last_name] AS key",
+    TUTOR: """
+        MATCH (t:Tutor)
+        RETURN elementId(t) AS id, [t.first_name, t.last_name] AS key, t.subjects AS subjects
+    """,
+    SCHOOL: "MATCH (school:School) RETURN elementId(school) AS id, school.name AS key",
+}
+
+
+def build_csr(node_count: int, src: np.ndarray, dst: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """ (src, dst) poros -> (indptr, indices); dubliuoti ryšiai pašalinami. """
+    if len(src):
+        pairs = np.unique(np.stack([src, dst], axis=1), axis=0)
+        src, dst = pairs[:, 0], pairs[:, 1]
+
+    indptr = np.zeros(node_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=node_count), out=indptr[1:])
+
+    # np.unique jau surikiavo pagal src
+    return indptr, dst.astype(np.int32)
+
+
+class Adjacency:
+    """ CSR ryšiai su perdengimu (pridėti / išimti po įkėlimo). """
+
+    def __init__(self, indptr: np.ndarray, indices: np.ndarray):
+        self.indptr = indptr
+        self.indices = indices
+        self.added: dict = {}
+        self.removed: dict = {}
+
+    def neighbors(self, node: int) -> list[int]:
+        if node + 1 < len(self.indptr):
+            base = self.indices[self.indptr[node]:self.indptr[node + 1]].tolist()
+        else:
+            base = []  # mazgas sukurtas po ikelimo
+
+        removed = self.removed.get(node, ())
+        result = [other for other in base if other not in removed]
+        result += [other for other in self.added.get(node, ()) if other not in base]
+        return result
+
+    def add(self, src: int, dst: int):
+        self.removed.get(src, set()).discard(dst)
+        self.added.setdefault(src, set()).add(dst)
+
+    def remove(self, src: int, dst: int):
+        if src in self.added:
+            self.added[src].discard(dst)
+        self.removed.setdefault(src, set()).add(dst)
+
+
+class GraphSnapshot:
+    """ Viena grafo kopija: mazgų raktai ir ryšių CSR abiem kryptimis. """
+
+    def __init__(self, nodes: dict, tutor_ids: list, tutor_subjects: list, edges: dict):
+        # etiketė -> [raktas]; raktas - (vardas, pavardė) arba mokyklos pavadinimas
+        self.keys = {label: list(keys) for label, keys in nodes.items()}
+        self.index = {
+            label: {key: i for i, key in enumerate(keys)}
+            for label, keys in self.keys.items()
+        }
+        # Korepetitoriaus elementId - toks pat tutor_id, kaip grazina Cypher
+        self.tutor_ids = list(tutor_ids)
+        self.tutor_subjects = [set(subjects or []) for subjects in tutor_subjects]
+
+        # ryšys -> (pirmyn, atgal)
+        self.relations = {}
+        for name, (src, dst) in edges.items():
+            src_label, dst_label, _ = RELATIONS[name]
+            forward = build_csr(len(self.keys[src_label]), src, dst)
+            backward = build_csr(len(self.keys[dst_label]), dst, src)
+            self.relations[name] = (Adjacency(*forward), Adjacency(*backward))
+
+        self.lock = threading.Lock()
+
+    def _node(self, label: str, key, create: bool = False):
+        node = self.index[label].get(key)
+        if node is None and create:
+            node = len(self.keys[label])
+            self.keys[label].append(key)
+            self.index[label][key] = node
+            if label == TUTOR:
+                self.tutor_ids.append("")
+                self.tutor_subjects.append(set())
+        return node
+
+    def _neighbors(self, relation: str, node, backward: bool = False) -> list[int]:
+        if node is None:
+            return []
+        return self.relations[relation][1 if backward else 0].neighbors(node)
+
+    # -------- Rasymo ivykiai (api/neo4j.py) --------
+
+    def apply_event(self, event: tuple):
+        """
+        ('student', (vardas, pavardė))
+        ('link', ryšys, src raktas, dst raktas, True - pridėti / False - išimti)
+        """
+        with self.lock:
+            if event[0] == 'student':
+                self._node(STUDENT, tuple(event[1]), create=True)
+                return
+
+            _, relation, src_key, dst_key, add = event
+            src_label, dst_label, _ = RELATIONS[relation]
+            src = self._node(src_label, _key(src_key))
+            dst = self._node(dst_label, _key(dst_key))
+            if src is None or dst is None:
+                return  # Neo4j MATCH irgi nieko nerado
+
+            forward, backward = self.relations[relation]
+            pairs = [(src, dst)]
+            if relation == 'friends':
+                pairs.append((dst, src))  # draugyste abikrypte
+
+            for a, b in pairs:
+                if add:
+                    forward.add(a, b)
+                    backward.add(b, a)
+                else:
+                    forward.remove(a, b)
+                    backward.remove(b, a)
+
+    # -------- Skaitymas --------
+
+    def _names(self, label: str, nodes) -> list[dict]:
+        return [
+            {"first_name": str(self.keys[label][node][0]), "last_name": str(self.keys[label][node][1])}
+            for node in nodes
+        ]
+
+    def friends(self, first_name, last_name) -> list[dict]:
+        with self.lock:
+            student = self.index[STUDENT].get((first_name, last_name))
+            return self._names(STUDENT, self._neighbors('friends', student))
+
+    def pending_requests(self, first_name, last_name) -> list[dict]:
+        with self.lock:
+            student = self.index[STUDENT].get((first_name, last_name))
+            return self._names(STUDENT, self._neighbors('requests', student, backward=True))
+
+    def sent_requests(self, first_name, last_name) -> list[dict]:
+        with self.lock:
+            student = self.index[STUDENT].get((first_name, last_name))
+            return self._names(STUDENT, self._neighbors('requests', student))
+
+    def tutors_by_school(self, school_name) -> list[dict]:
+        with self.lock:
+            school = self.index[SCHOOL].get(school_name)
+
+            tutors = {}  # DISTINCT, islaikant tvarka
+            for student in self._neighbors('attends', school, backward=True):
+                for tutor in self._neighbors('teaches', student, backward=True):
+                    tutors[tutor] = None
+
+            return self._names(TUTOR, tutors)
+
+    def recommend_tutors(
+        self,
+        first_name,
+        last_name,
+        subject,
+        max_path_length: int,
+        existing_tutors: list,
+        limit: int
+    ) -> list[dict]:
+        """
+        BFS per draugus iki max_path_length: kiekvienas mokinys aplankomas
+        vieną kartą, o korepetitorius įrašomas pirmą kartą jį radus
+        (trumpiausias kelias). Rezultatas - kaip api/neo4j rekomendacijų.
+        """
+        with self.lock:
+            return self._recommend_tutors(
+                first_name, last_name, subject, max_path_length, existing_tutors, limit
+            )
+
+    def _recommend_tutors(self, first_name, last_name, subject, max_path_length, existing_tutors, limit):
+        start = self.index[STUDENT].get((first_name, last_name))
+        if start is None:
+            return []
+
+        existing = set(existing_tutors or [])
+        parent = {start: None}
+        frontier = [start]
+        found = {}
+
+        for level in range(1, max_path_length + 1):
+            next_frontier = []
+            for student in frontier:
+                for friend in self._neighbors('friends', student):
+                    if friend in parent:
+                        continue
+                    parent[friend] = student
+                    next_frontier.append(friend)
+
+            for friend in next_frontier:
+                for tutor in self._neighbors('teaches', friend, backward=True):
+                    if tutor in found or subject not in self.tutor_subjects[tutor]:
+                        continue
+
+                    tutor_first, tutor_last = self.keys[TUTOR][tutor]
+                    if f"{tutor_first} {tutor_last}" in existing:
+                        continue
+
+                    found[tutor] = (level + 1, friend)
+
+            # Tolimesni lygiai duotu tik ilgesnius kelius
+            frontier = next_frontier
+            if not frontier or len(found) >= limit:
+                break
+
+        tutors = []
+        for tutor, (path_length, friend) in found.items():
+            path, node = [], friend
+            while node is not None:
+                path.append(' '.join(str(part) for part in self.keys[STUDENT][node]))
+                node = parent[node]
+
+            tutor_first, tutor_last = self.keys[TUTOR][tutor]
+            tutors.append({
+                "tutor_id": self.tutor_ids[tutor],
+                "first_name": str(tutor_first),
+                "last_name": str(tutor_last),
+                "path_length": path_length,
+                "path": path[::-1] + [f"{tutor_first} {tutor_last}"],
+            })
+
+        tutors.sort(key=lambda t: (t["path_length"], t["first_name"], t["last_name"]))
+        return tutors[:limit]
+
+
+def _key(key):
+    # Mokykla - pavadinimas, mokinys ir korepetitorius - (vardas, pavarde)
+    return tuple(key) if isinstance(key, (list, tuple)) else key
+
+
+def load_snapshot(driver) -> GraphSnapshot:
+    """ Įkelia visą grafą iš Neo4j (keli skaitymai vienoje sesijoje). """
+    nodes, node_index, tutor_ids, tutor_subjects, edges = {}, {}, [], [], {}
+
+    with driver.session(database=NEO4J_DATABASE) as session:
+        for label, query in NODE_QUERIES.items():
+            records = [record.data() for record in session.run(query)]
+            nodes[label] = [_key(record["key"]) for record in records]
+            node_index[label] = {record["id"]: i for i, record in enumerate(records)}
+            if label == TUTOR:
+                tutor_ids = [record["id"] for record in records]
+                tutor_subjects = [record.get("subjects") for record in records]
+
+        for name, (src_label, dst_label, query) in RELATIONS.items():
+            src, dst = [], []
+            for record in session.run(query):
+                src_node = node_index[src_label].get(record["src"])
+                dst_node = node_index[dst_label].get(record["dst"])
+                # Mazgas sukurtas jau perskaicius mazgus - bus kitame ikelime
+                if src_node is None or dst_node is None:
+                    continue
+                src.append(src_node)
+                dst.append(dst_node)
+
+            edges[name] = (np.array(src, dtype=np.int32), np.array(dst, dtype=np.int32))
+
+    return GraphSnapshot(nodes, tutor_ids, tutor_subjects, edges)
+
+
+_snapshot = None
+# Ivykiai nuo paskutinio ikelimo pradzios (ne senesni - ribotas dydis)
+_journal = deque()
+_journal_lock = threading.Lock()
+_loader = None
+_loader_pid = None
+
+
+def get_snapshot():
+    """ Dabartinė kopija arba None (išjungta ar dar neįkelta). """
+    return _snapshot if GRAPH_SNAPSHOT_ENABLED else None
+
+
+def apply_event(event: tuple):
+    """ Pritaiko įvykį dabartinei kopijai ir įsimena jį kitam įkėlimui. """
+    if not GRAPH_SNAPSHOT_ENABLED:
+        return
+
+    with _journal_lock:
+        _journal.append(event)
+        snapshot = _snapshot
+
+    if snapshot is not None:
+        snapshot.apply_event(event)
+
+
+def reload_snapshot(driver):
+    global _snapshot
+
+    with _journal_lock:
+        # Ankstesni ivykiai jau Neo4j, todel pateks i nauja kopija. Valoma ir
+        # tada, kai ikelimas nepavyksta - zurnalas neauga, kol Neo4j nepasiekiamas
+        _journal.clear()
+
+    snapshot = load_snapshot(driver)
+
+    with _journal_lock:
+        # Ivykiai, ivyke ikeliant, galejo nepatekti i nauja kopija
+        for event in _journal:
+            snapshot.apply_event(event)
+
+        _journal.clear()
+        _snapshot = snapshot
+
+
+def _reload_loop(driver):
+    while True:
+        try:
+            reload_snapshot(driver)
+        except Exception as e:
+            # Lieka sena kopija; jei jos nera - skaitoma is Neo4j
+            print(f"Nepavyko įkelti grafo kopijos: {e}")
+
+        time.sleep(GRAPH_SNAPSHOT_RELOAD_INTERVAL)
+
+
+def start_snapshot_loader(driver):
+    """ Paleidžia periodinio įkėlimo giją (vieną procesui; po fork() - iš naujo). """
+    global _loader, _loader_pid, _snapshot
+
+    if not GRAPH_SNAPSHOT_ENABLED:
+        return None
+
+    if _loader is not None and _loader_pid == os.getpid():
+        return _loader
+
+    with _journal_lock:
+        if _loader is None or _loader_pid != os.getpid():
+            _snapshot = None
+            _journal.clear()
+
+            _loader = threading.Thread(
+                target=_reload_loop,
+                args=(driver,),
+                name="graph-snapshot",
+                daemon=True
+            )
+            _loader.start()
+            _loader_pid = os.getpid()
+
+    return _loader
@@ -0,0 +1,143 @@
+"""
+Patikrintų JWT tokenų kešas proceso atmintyje.
+
+Patikrintas tokenas (jo payload) laikomas JWT_CACHE_TTL sekundžių pagal tokeno
+SHA-256 maišą, todėl kiekvienam puslapiui nebereikia eiti į Redis
+(jwt:user:{id}). Atsijungus ar prisijungus iš naujo, vartotojo id paskelbiamas
+Redis kanale JWT_REVOKE_CHANNEL ir visi procesai iš karto pamiršta jo tokenus.
+
+Kol prenumerata neveikia (pvz. nutrūko jungtis), kešas nenaudojamas, o
+prisijungus iš naujo - išvalomas, nes galėjome praleisti atšaukimus.
+"""
+
+import hashlib
+import os
+import threading
+import time
+
+JWT_CACHE_TTL = int(os.getenv('JWT_CACHE_TTL', 30))
+JWT_CACHE_MAX_SIZE = 10000
+JWT_REVOKE_CHANNEL = "jwt:revoked"
+
+# tokeno maiša -> (galioja iki (monotonic), vartotojo id, payload)
+_tokens: dict = {}
+# vartotojo id -> jo tokenų maišos
+_user_tokens: dict = {}
+_lock = threading.Lock()
+
+_listener = None
+_listener_pid = None
+_listening = threading.Event()
+
+
+def _token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def clear_cache():
+    with _lock:
+        _tokens.clear()
+        _user_tokens.clear()
+
+
+def forget_user(user_id: str):
+    """ Pamiršta visus vartotojo tokenus šiame procese. """
+    with _lock:
+        for token_hash in _user_tokens.pop(user_id, ()):
+            _tokens.pop(token_hash, None)
+
+
+def get_cached_payload(token: str):
+    """ Grąžina kešuotą payload arba None. """
+    if not _listening.is_set():
+        return None
+
+    token_hash = _token_hash(token)
+    cached = _tokens.get(token_hash)
+    if cached is None:
+        return None
+
+    expires_at, user_id, payload = cached
+    if expires_at <= time.monotonic():
+        with _lock:
+            _tokens.pop(token_hash, None)
+            _user_tokens.get(user_id, set()).discard(token_hash)
+        return None
+
+    return payload
+
+
+def cache_payload(token: str, payload: dict):
+    """ Įsimena patikrintą tokeną, bet ne ilgiau nei jis galioja. """
+    if not _listening.is_set():
+        return
+
+    ttl = min(JWT_CACHE_TTL, payload.get('exp', 0) - time.time())
+    if ttl <= 0:
+        return
+
+    token_hash = _token_hash(token)
+    user_id = str(payload.get('user_id'))
+
+    with _lock:
+        if len(_tokens) >= JWT_CACHE_MAX_SIZE:
+            _tokens.clear()
+            _user_tokens.clear()
+
+        _tokens[token_hash] = (time.monotonic() + ttl, user_id, payload)
+        _user_tokens.setdefault(user_id, set()).add(token_hash)
+
+
+def publish_revocation(redis_client, user_id: str):
+    """ Praneša visiems procesams, kad vartotojo tokenai nebegalioja. """
+    forget_user(str(user_id))
+    redis_client.publish(JWT_REVOKE_CHANNEL, str(user_id))
+
+
+def _listen(redis_client):
+    while True:
+        pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(JWT_REVOKE_CHANNEL)
+            # Kol nebuvom prisijungę, atšaukimus galėjom praleisti
+            clear_cache()
+            _listening.set()
+
+            for message in pubsub.listen():
+                if message['type'] == 'message':
+                    forget_user(message['data'])
+
+        except Exception as e:
+            print(f"JWT atšaukimų prenumeratos klaida: {e}")
+
+        finally:
+            _listening.clear()
+            pubsub.close()
+
+        time.sleep(1)
+
+
+def start_revocation_listener(redis_client):
+    """ Paleidžia atšaukimų prenumeratos giją (vieną procesui; po fork() - iš naujo). """
+    global _listener, _listener_pid
+
+    if _listener is not None and _listener_pid == os.getpid():
+        return _listener
+
+    with _lock:
+        if _listener is None or _listener_pid != os.getpid():
+            # Po fork() tėvo kešas ir prenumerata vaikui negalioja
+            _tokens.clear()
+            _user_tokens.clear()
+            _listening.clear()
+
+            _listener = threading.Thread(
+                target=_listen,
+                args=(redis_client,),
+                name="jwt-revocations",
+                daemon=True
+            )
+            _listener.start()
+            _listener_pid = os.getpid()
+
+    return _listener
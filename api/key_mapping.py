@@ -0,0 +1,309 @@
+"""
+Mongo _id -> ClickHouse surogatinio rakto (student_sk, tutor_sk) atvaizdis.
+
+Anksčiau kiekvienam raktui reikėjo Mongo dokumento ir ClickHouse paieškos
+pagal vardą ir pavardę. Dabar atvaizdis ieškomas sluoksniais:
+    1. proceso LRU (SK_MAP_LRU_SIZE įrašų);
+    2. Redis hash skmap:<entity> (HMGET - visi id vienu kreipiniu);
+    3. ClickHouse lentelė map_mongo_sk (vienas SELECT ... IN);
+    4. seni įrašai be atvaizdžio - vienas Mongo $in ir vienas ClickHouse
+       SELECT pagal (vardas, pavardė); rasti raktai įrašomi į visus sluoksnius.
+
+Nauji raktai įrašomi iškart juos sukūrus (add_*_clickhouse, DataWarehouseInitializer).
+
+    python -m api.key_mapping init   # lentelė + visų mokinių/korepetitorių atvaizdis
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from api.connection import get_db, get_redis, get_clickhouse_client
+
+SK_MAP_TABLE = 'map_mongo_sk'
+SK_MAP_LRU_SIZE = int(os.getenv('SK_MAP_LRU_SIZE', 10000))
+# Kiek id vienoje ClickHouse IN uzklausoje
+SK_MAP_QUERY_CHUNK = 1000
+
+# sk, zymintis istrinta atvaizdi (tikri raktai prasideda nuo 1, zr. api/surrogate_keys.py)
+SK_TOMBSTONE = 0
+
+STUDENT_ENTITY = 'student'
+TUTOR_ENTITY = 'tutor'
+
+# entity -> Mongo kolekcija, dimensiju lentele, rakto stulpelis, papildomi atitikimo laukai
+ENTITIES = {
+    STUDENT_ENTITY: {
+        'collection': 'student',
+        'table': 'dim_students',
+        'column': 'student_sk',
+        'match': ['date_of_birth', 'class'],
+    },
+    TUTOR_ENTITY: {
+        'collection': 'tutor',
+        'table': 'dim_tutors',
+        'column': 'tutor_sk',
+        'match': ['date_of_birth'],
+    },
+}
+
+CREATE_MAP_TABLE = f"""
+CREATE TABLE IF NOT EXISTS {SK_MAP_TABLE} (
+    entity LowCardinality(String),
+    mongo_id String,
+    sk UInt64,
+    updated_at DateTime64(3) DEFAULT now64(3)
+)
+ENGINE = ReplacingMergeTree(updated_at)
+ORDER BY (entity, mongo_id)
+"""
+
+r = get_redis()
+
+_lru = OrderedDict()
+_lru_lock = threading.Lock()
+_table_ready = False
+
+
+def redis_map_key(entity: str) -> str:
+    return f"skmap:{entity}"
+
+
+def _lru_get(entity: str, mongo_id: str):
+    with _lru_lock:
+        sk = _lru.get((entity, mongo_id))
+        if sk is not None:
+            _lru.move_to_end((entity, mongo_id))
+        return sk
+
+
+def _lru_put(entity: str, mapping: dict):
+    with _lru_lock:
+        for mongo_id, sk in mapping.items():
+            _lru[(entity, mongo_id)] = sk
+            _lru.move_to_end((entity, mongo_id))
+
+        while len(_lru) > SK_MAP_LRU_SIZE:
+            _lru.popitem(last=False)
+
+
+def _quote(value) -> str:
+    return "'" + str(value).replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+
+def ensure_map_table(client=None):
+    """ Sukuria map_mongo_sk lentelę (vieną kartą procesui). """
+    global _table_ready
+
+    if not _table_ready:
+        (client or get_clickhouse_client()).command(CREATE_MAP_TABLE)
+        _table_ready = True
+
+
+def _chunks(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _from_redis(entity: str, mongo_ids: list[str]) -> dict:
+    try:
+        values = r.hmget(redis_map_key(entity), mongo_ids)
+    except Exception as e:
+        print(f"Redis skmap klaida: {e}")
+        return {}
+
+    return {mongo_id: int(sk) for mongo_id, sk in zip(mongo_ids, values) if sk is not None}
+
+
+def _to_redis(entity: str, mapping: dict):
+    if not mapping:
+        return
+
+    try:
+        r.hset(redis_map_key(entity), mapping=mapping)
+    except Exception as e:
+        print(f"Redis skmap klaida: {e}")
+
+
+def _from_map_table(entity: str, mongo_ids: list[str], client) -> dict:
+    ensure_map_table(client)
+
+    found = {}
+    for chunk in _chunks(mongo_ids, SK_MAP_QUERY_CHUNK):
+        rows = client.query(f"""
+            SELECT mongo_id, argMax(sk, updated_at) AS current_sk
+            FROM {SK_MAP_TABLE}
+            WHERE entity = {_quote(entity)} AND mongo_id IN ({', '.join(map(_quote, chunk))})
+            GROUP BY mongo_id
+            HAVING current_sk != {SK_TOMBSTONE}
+        """).result_rows
+        found.update({mongo_id: int(sk) for mongo_id, sk in rows})
+
+    return found
+
+
+def _same_value(mongo_value, clickhouse_value, field: str) -> bool:
+    if field == 'date_of_birth':
+        return pd.to_datetime(mongo_value).date() == pd.to_datetime(clickhouse_value).date()
+    return mongo_value == clickhouse_value
+
+
+def _from_names(entity: str, mongo_ids: list[str], client, db) -> dict:
+    """
+    Seni įrašai: raktas pagal vardą, pavardę (ir gimimo datą, klasę, jei jos
+    Mongo dokumente yra) - vienas Mongo ir vienas ClickHouse kreipinys.
+    """
+    spec = ENTITIES[entity]
+
+    object_ids = []
+    for mongo_id in mongo_ids:
+        try:
+            object_ids.append(ObjectId(mongo_id))
+        except (InvalidId, TypeError):
+            continue
+
+    projection = {'first_name': 1, 'last_name': 1, **{field: 1 for field in spec['match']}}
+    docs = list(db[spec['collection']].find({'_id': {'$in': object_ids}}, projection))
+    if not docs:
+        return {}
+
+    first_names = {doc.get('first_name') for doc in docs}
+    last_names = {doc.get('last_name') for doc in docs}
+    columns = ', '.join([spec['column'], 'first_name', 'last_name', *spec['match']])
+
+    # Vardai ir pavardes atskirai (plačiau nei reikia) - poros tikrinamos zemiau
+    candidates = {}
+    for row in client.query(f"""
+        SELECT {columns} FROM {spec['table']}
+        WHERE first_name IN ({', '.join(map(_quote, first_names))})
+          AND last_name IN ({', '.join(map(_quote, last_names))})
+    """).result_rows:
+        sk, first_name, last_name, *values = row
+        candidates.setdefault((first_name, last_name), []).append((sk, dict(zip(spec['match'], values))))
+
+    found = {}
+    for doc in docs:
+        for sk, values in candidates.get((doc.get('first_name'), doc.get('last_name')), []):
+            if all(
+                not doc.get(field) or _same_value(doc[field], values[field], field)
+                for field in spec['match']
+            ):
+                found[str(doc['_id'])] = int(sk)
+                break
+
+    return found
+
+
+def record_sks(entity: str, mapping: dict, client=None):
+    """ Įrašo {mongo_id: sk} į visus sluoksnius (ClickHouse, Redis, LRU). """
+    if not mapping:
+        return
+
+    client = client or get_clickhouse_client()
+    ensure_map_table(client)
+
+    mapping = {str(mongo_id): int(sk) for mongo_id, sk in mapping.items()}
+    client.insert(
+        SK_MAP_TABLE,
+        [[entity, mongo_id, sk] for mongo_id, sk in mapping.items()],
+        column_names=['entity', 'mongo_id', 'sk']
+    )
+    _to_redis(entity, mapping)
+    _lru_put(entity, mapping)
+
+
+def forget_sk(entity: str, mongo_id, client=None):
+    """
+    Pašalina atvaizdį (įrašas ištrintas iš dimensijų lentelės).
+    ClickHouse įterpiamas SK_TOMBSTONE įrašas - be sinchroninės ALTER ... DELETE mutacijos.
+    """
+    mongo_id = str(mongo_id)
+
+    with _lru_lock:
+        _lru.pop((entity, mongo_id), None)
+
+    try:
+        r.hdel(redis_map_key(entity), mongo_id)
+    except Exception as e:
+        print(f"Redis skmap klaida: {e}")
+
+    client = client or get_clickhouse_client()
+    ensure_map_table(client)
+    client.insert(
+        SK_MAP_TABLE,
+        [[entity, mongo_id, SK_TOMBSTONE]],
+        column_names=['entity', 'mongo_id', 'sk']
+    )
+
+
+def resolve_sks(entity: str, mongo_ids, client=None, db=None) -> dict:
+    """
+    {mongo_id: sk} visiems rastiems id (nerasti praleidžiami).
+    Kiekvienas sluoksnis kreipiamas tik dėl ankstesniame nerastų id, vienu kartu visiems.
+    """
+    if entity not in ENTITIES:
+        raise KeyError(f"Nežinomas entity: {entity}")
+
+    mongo_ids = list(dict.fromkeys(str(mongo_id) for mongo_id in mongo_ids))
+
+    found = {}
+    for mongo_id in mongo_ids:
+        sk = _lru_get(entity, mongo_id)
+        if sk is not None:
+            found[mongo_id] = sk
+
+    missing = [mongo_id for mongo_id in mongo_ids if mongo_id not in found]
+    if not missing:
+        return found
+
+    from_redis = _from_redis(entity, missing)
+    _lru_put(entity, from_redis)
+    found.update(from_redis)
+
+    missing = [mongo_id for mongo_id in missing if mongo_id not in found]
+    if not missing:
+        return found
+
+    client = client or get_clickhouse_client()
+    from_table = _from_map_table(entity, missing, client)
+    _to_redis(entity, from_table)
+    _lru_put(entity, from_table)
+    found.update(from_table)
+
+    missing = [mongo_id for mongo_id in missing if mongo_id not in found]
+    if not missing:
+        return found
+
+    from_names = _from_names(entity, missing, client, db if db is not None else get_db())
+    record_sks(entity, from_names, client)
+    found.update(from_names)
+
+    return found
+
+
+def resolve_sk(entity: str, mongo_id, client=None, db=None):
+    """ Vieno id raktas arba None. """
+    return resolve_sks(entity, [mongo_id], client, db).get(str(mongo_id))
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 2 or sys.argv[1] != 'init':
+        print("Naudojimas: python -m api.key_mapping init")
+        sys.exit(1)
+
+    mongo_db = get_db()
+    clickhouse_client = get_clickhouse_client()
+    ensure_map_table(clickhouse_client)
+
+    for entity, spec in ENTITIES.items():
+        ids = [str(doc['_id']) for doc in mongo_db[spec['collection']].find({}, {'_id': 1})]
+        resolved = {}
+        for chunk in _chunks(ids, SK_MAP_QUERY_CHUNK):
+            resolved.update(resolve_sks(entity, chunk, clickhouse_client, mongo_db))
+        print(f"{entity}: {len(resolved)} iš {len(ids)}")
@@ -3,52 +3,89 @@ from api.utils import (
     generate_lesson_id_link
 )
 from api.connection import get_db
-from pymongo.results import InsertOneResult
+from pymongo.results import InsertOneResult, InsertManyResult
 from bson import ObjectId, Decimal128
 from datetime import timedelta, datetime
 from decimal import Decimal
 
-from redis_api.redis_client import get_redis
+from api.connection import get_redis
+from api.lesson_conflicts import (
+    LESSON_DURATION_MINUTES,
+    check_lesson_conflicts,
+    check_series_conflicts,
+    find_lesson_conflicts,
+    lesson_duration,
+    validate_duration
+)
+from api.calendar_cache import (
+    TUTOR_CALENDAR,
+    STUDENT_CALENDAR,
+    get_calendars,
+    invalidate_calendars,
+    invalidate_lesson_calendars,
+    month_bucket,
+    week_bucket
+)
+from functools import partial
 redis_client = get_redis()
 
-def create_lesson(
-    lesson_collection, 
+# Daugiausia pamokų vienoje serijoje (~ mokslo metai)
+LESSON_SERIES_MAX = 52
+
+LESSON_TIME_FORMAT = '%Y-%m-%d %H:%M'
+
+# Laukai, kuriu reikia kalendoriaus sarasams
+LIST_PROJECTION = {
+    'time': 1,
+    'students.first_name': 1,
+    'students.last_name': 1,
+    'tutor.first_name': 1,
+    'tutor.last_name': 1,
+    'link': 1,
+    'subject': 1,
+    'class': 1,
+    'type': 1
+}
+
+def _build_lesson(
     tutor_collection,
     student_collection,
-    lesson_info: dict
-) -> InsertOneResult:
-    """ Create a new lesson. """
+    lesson_info: dict,
+    required_arguments: list[str]
+) -> dict:
+    """
+    Patikrina korepetitorių ir mokinius (vieną kartą) ir grąžina pamokos
+    šabloną be laiko: tutor, students, subject, class, duration, student_ids.
+    """
     lesson: dict = {}
 
     # Tikriname privalomus laukus
-    required_arguments = ['time', 'tutor_id', 'student_ids', 'subject']
     for field in required_arguments:
         if field not in lesson_info:
             raise KeyError(f'Truksta {field}')
         lesson[field] = lesson_info[field]
 
-    # Paversti lesson time i datetime
-    lesson['time'] = parse_time_of_lesson(lesson['time'])
+    lesson['duration'] = validate_duration(
+        lesson_info.get('duration', LESSON_DURATION_MINUTES)
+    )
 
     # Tikrinama, ar korepetitorius ir mokiniai yra koleckijose
     tutor = tutor_collection.find_one({'_id': ObjectId(lesson['tutor_id']) })
     if not tutor:
         raise ValueError('Korepetitoriaus el. paštas neegizstuoja')
 
-    # Tikriname, ar mokytojas neturi pamokos tokiu laiku
-    lessons_of_tutor_at_time = lesson_collection.find_one({
-        'tutor.tutor_id': tutor['_id'],
-        'time': lesson['time']
-    })
-    if lessons_of_tutor_at_time:
-        raise ValueError('Laikas persidengia korepetitoriui')
+    # Visi mokiniai viena uzklausa
+    student_oids = [ObjectId(student_id) for student_id in lesson_info['student_ids']]
+    students_by_id = {
+        student['_id']: student
+        for student in student_collection.find({'_id': {'$in': student_oids}})
+    }
 
     lesson['students'] = []
-    for student_id in lesson_info['student_ids']:
+    for student_id in student_oids:
 
         # Patikrinti ar egzistuoja
-        student_id = ObjectId(student_id)
-        student = student_collection.find_one({'_id': student_id})
+        student = students_by_id.get(student_id)
 
         if not student:
             raise ValueError(f'Studentas {student_id} neegzistuoja')
@@ -89,31 +126,154 @@ def create_lesson(
             raise ValueError(f'Vienas is mokiniu nepriklauso korepetitoriui')
 
         # Patikrinti, ar korepetitorius mokina mokini sito dalyko
-        student_of_tutor = student_ids_tutor[student_id]
-        print(student_of_tutor)
+        student_of_tutor = student_ids_tutor[str(student_id)]
         if student_of_tutor != lesson_info['subject']:
+            student = students_by_id[ObjectId(student_id)]
             raise ValueError(f'Mokinio {student["first_name"]} {student["last_name"]} korepetitorius(-ė) {lesson_info["subject"]} nemokina')
 
-    # Tikriname, ar mokiniai neturi pamokos tokiu laiku
-    for student_id in lesson['student_ids']:
-        # Find lesson with student and time
-        query = {
-            "students.student_id": student_id,
-            "time": lesson_info['time']
-        }
+    lesson['student_ids'] = student_oids
+    return lesson
 
-        if lesson_collection.find_one(query):
-            raise ValueError(f"Mokinys {student['first_name']} {student['last_name']} turi pamoką tuo laiku")
+
+def _finish_lesson(lesson: dict, time: datetime) -> dict:
+    """ Paruošia pamokos dokumentą įrašymui. """
+    lesson_doc = {
+        key: value for key, value in lesson.items()
+        if key not in ('student_ids', 'tutor_id', 'time')
+    }
+    lesson_doc['time'] = time
 
     # Generuoti pamokos id
-    lesson['link'] = generate_lesson_id_link()
-    lesson['type'] = 'ACTIVE'
+    lesson_doc['link'] = generate_lesson_id_link()
+    lesson_doc['type'] = 'ACTIVE'
+
+    return lesson_doc
+
+
+def create_lesson(
+    lesson_collection, 
+    tutor_collection,
+    student_collection,
+    lesson_info: dict
+) -> InsertOneResult:
+    """ Create a new lesson. """
 
-    # Trinti nereikalingu
-    del lesson['student_ids']
-    del lesson['tutor_id']
+    lesson = _build_lesson(
+        tutor_collection,
+        student_collection,
+        lesson_info,
+        ['time', 'tutor_id', 'student_ids', 'subject']
+    )
 
-    return lesson_collection.insert_one(lesson)
+    # Paversti lesson time i datetime
+    time = parse_time_of_lesson(lesson['time'])
+
+    # Tikriname, ar korepetitorius ir mokiniai neturi persidengianciu pamoku (viena uzklausa)
+    check_lesson_conflicts(
+        lesson_collection,
+        lesson['tutor']['tutor_id'],
+        lesson['student_ids'],
+        time,
+        lesson['duration']
+    )
+
+    lesson_doc = _finish_lesson(lesson, time)
+    result = lesson_collection.insert_one(lesson_doc)
+
+    invalidate_lesson_calendars(lesson_doc)
+    return result
+
+
+def lesson_recurrence(
+    first_time: datetime,
+    count: int = None,
+    until: datetime = None,
+    interval_weeks: int = 1
+) -> list[datetime]:
+    """
+    Savaitinė pamokų serija nuo first_time: count kartų arba iki until (imtinai).
+    """
+    if count is None and until is None:
+        raise ValueError('Nurodykite pamokų skaičių arba datą, iki kurios kartoti')
+
+    if interval_weeks < 1:
+        raise ValueError('Intervalas turi būti bent 1 savaitė')
+
+    times = []
+    time = first_time
+    while (count is None or len(times) < count) and (until is None or time <= until):
+        times.append(time)
+        if len(times) > LESSON_SERIES_MAX:
+            raise ValueError(f'Vienu kartu galima sukurti iki {LESSON_SERIES_MAX} pamokų')
+
+        time += timedelta(weeks=interval_weeks)
+
+    if not times:
+        raise ValueError('Serijoje nėra nei vienos pamokos')
+
+    return times
+
+
+def create_lessons_bulk(
+    lesson_collection,
+    tutor_collection,
+    student_collection,
+    lesson_info: dict
+) -> InsertManyResult:
+    """
+    Sukuria savaitinę pamokų seriją.
+    lesson_info - kaip create_lesson (time - pirmoji pamoka) ir:
+        count - kiek pamokų, arba until - 'YYYY-MM-DD' (paskutinė data)
+        interval_weeks - kas kiek savaičių (numatyta 1)
+
+    Korepetitorius ir mokiniai tikrinami vieną kartą, visos serijos
+    persidengimai - viena užklausa, įrašoma per insert_many.
+    """
+    lesson = _build_lesson(
+        tutor_collection,
+        student_collection,
+        lesson_info,
+        ['time', 'tutor_id', 'student_ids', 'subject']
+    )
+
+    first_time = parse_time_of_lesson(lesson['time'])
+
+    until = None
+    if lesson_info.get('until'):
+        try:
+            # Paskutine diena imtinai
+            until = datetime.strptime(lesson_info['until'], '%Y-%m-%d') + timedelta(days=1, microseconds=-1)
+        except ValueError:
+            raise ValueError(f"Datos formatas netinkamas: {lesson_info['until']} turi buti YYYY-MM-DD")
+
+    count = int(lesson_info['count']) if lesson_info.get('count') else None
+
+    times = lesson_recurrence(
+        first_time,
+        count=count,
+        until=until,
+        interval_weeks=int(lesson_info.get('interval_weeks', 1))
+    )
+
+    # Persidengimai su esamomis pamokomis (serijos pamokos tarpusavyje nepersidengia)
+    check_series_conflicts(
+        lesson_collection,
+        lesson['tutor']['tutor_id'],
+        lesson['student_ids'],
+        times,
+        lesson['duration']
+    )
+
+    result = lesson_collection.insert_many(
+        [_finish_lesson(lesson, time) for time in times]
+    )
+
+    invalidate_calendars(
+        [lesson['tutor']['tutor_id']],
+        lesson['student_ids'],
+        times
+    )
+    return result
 
 
 def add_student_to_lesson_wo_lock(
@@ -148,11 +308,14 @@ def add_student_to_lesson_wo_lock(
         'moved': False
     }
 
-    return lesson_collection.find_one_and_update(
+    result = lesson_collection.find_one_and_update(
         {'_id': ObjectId(lesson_id)},
         {'$push': {'students': student_info}}
     )
 
+    invalidate_lesson_calendars(lesson, student_ids=[student['_id']])
+    return result
+
 
 def add_student_to_lesson(
     lesson_collection,
@@ -184,28 +347,24 @@ def change_lesson_date_wo_lock(
     lesson_doc = lesson_collection.find_one({'_id': ObjectId(lesson_id)})
 
     # Patikrinti, ar pamokos tuo metu nera korepetitoriui ar vienam is mokiniu
-    tutor_lesson_same_time = lesson_collection.find_one({
-        'tutor_id': ObjectId(lesson_doc['tutor']['tutor_id']),
-        'time': time_parsed
-    })
-
-    if tutor_lesson_same_time:
-        raise ValueError('Korepetitorius tuo metu turi pamoka')
-
-    for student in lesson_doc['students']:
-        student_lesson_same_time = lesson_collection.find_one({
-            'students.student_id': ObjectId(student['student_id']),
-            'time': time_parsed
-        })
-
-        if student_lesson_same_time:
-            raise ValueError(f'Mokinys {student["first_name"]} {student["last_name"]} turi pamoka tuo metu')
+    check_lesson_conflicts(
+        lesson_collection,
+        lesson_doc['tutor']['tutor_id'],
+        [student['student_id'] for student in lesson_doc['students']],
+        time_parsed,
+        lesson_duration(lesson_doc),
+        exclude_lesson_id=lesson_doc['_id']
+    )
 
-    return lesson_collection.find_one_and_update(
+    result = lesson_collection.find_one_and_update(
         {'_id': ObjectId(lesson_id)},
         { "$set": {'time': time_parsed} }
     )
 
+    # Senas ir naujas laikas
+    invalidate_lesson_calendars(lesson_doc, times=[time_parsed])
+    return result
+
 
 def change_lesson_date(
     lesson_collection,
@@ -238,11 +397,14 @@ def delete_lesson_wo_lock(
         if lesson['type'] == 'DELETED':
             return
 
-    return lesson_collection.find_one_and_update(
+    result = lesson_collection.find_one_and_update(
         { "_id": ObjectId(lesson_id) },
         { "$set": {"type": "DELETED"} }
     )
 
+    invalidate_lesson_calendars(lesson)
+    return result
+
 
 def delete_lesson(
     lesson_collection,
@@ -259,53 +421,135 @@ def delete_lesson(
         )
 
 
-def list_lessons_tutor_week(
-    lesson_collection,
-    tutor_collection,
-    tutor_id: str
-) -> list[dict]:
-    """ List tutor's lessons. """
+def _check_owner(collection, owner_id: ObjectId, message: str):
+    if not collection.find_one({'_id': owner_id}, {'_id': 1}):
+        raise ValueError(message)
+
 
-    # Patikrinti, ar toks korepetitoriaus id yra
-    if not tutor_collection.find_one({'_id': ObjectId(tutor_id)}):
-        raise ValueError('Specified tutor could not be found')
+def _parse_year_month(year: str, month: str) -> tuple[int, int]:
+    try:
+        year = int(year)
+        month = int(month)
+    except ValueError:
+        raise ValueError('Could not convert year or month (arguments 2 and 3) to int')
 
-    # Grazinti informacija
-    lessons = []
+    if not 1 <= month <= 12:
+        raise ValueError('Month must be between 1 and 12')
 
-    query = {
-        'tutor.tutor_id': ObjectId(tutor_id),
-        'time': {
-            "$gt": datetime.now(),
-            "$lt": datetime.now() + timedelta(weeks=1)
-        },
-        # Jei "type" neegzistuoja - pamoka aktyvi, jei "type" != "DELETED" irgi aktyvi.
-        "$or": [
-            {"type": {"exists": False}},
-            {"type": {"$ne": "DELETED"}}
-        ]
+    return year, month
+
+
+def _month_range(year: int, month: int) -> tuple[datetime, datetime]:
+    # Nustatom pabaigos datą
+    if month == 12:
+        return datetime(year, month, 1), datetime(year + 1, 1, 1)
+
+    return datetime(year, month, 1), datetime(year, month + 1, 1)
+
+
+def _week_ranges(now: datetime) -> dict:
+    """
+    Savaitė nuo dabar visada patenka į dvi ISO savaites:
+    {bucket: (savaitės pradžia, pabaiga)}.
+    """
+    ranges = {}
+    for time in (now, now + timedelta(weeks=1)):
+        year, week, _ = time.isocalendar()
+        start = datetime.fromisocalendar(year, week, 1)
+        ranges[week_bucket(time)] = (start, start + timedelta(weeks=1))
+
+    return ranges
+
+
+def _students_names(lesson_doc: dict) -> list[dict]:
+    return [
+        {'first_name': stud['first_name'], 'last_name': stud['last_name']}
+        for stud in lesson_doc['students']
+    ]
+
+
+def _tutor_lesson_entry(lesson_doc: dict) -> dict:
+    return {
+        '_id': str(lesson_doc['_id']),
+        'time': lesson_doc['time'].strftime(LESSON_TIME_FORMAT),
+        'students': _students_names(lesson_doc),
+        'link': lesson_doc.get('link'),
+        'subject': lesson_doc.get('subject'),
+        'class': lesson_doc.get('class')
     }
 
-    for lesson_doc in lesson_collection.find(query):
-        students = [
-            {'first_name': stud['first_name'], 'last_name': stud['last_name']}
-            for stud in lesson_doc['students']
-        ]
 
-        lessons.append({
-            '_id': str(lesson_doc['_id']),
-            'time': lesson_doc['time'].strftime('%Y-%m-%d %H:%M'),
-            'students': students,
-            'link': lesson_doc['link'],
-            "subject": lesson_doc['subject'],
-            'class': lesson_doc['class']
-        })
+def _student_lesson_entry(lesson_doc: dict) -> dict:
+    return {
+        '_id': str(lesson_doc['_id']),
+        'tutor_first_name': lesson_doc['tutor']['first_name'],
+        'tutor_last_name': lesson_doc['tutor']['last_name'],
+        'time': lesson_doc['time'].strftime(LESSON_TIME_FORMAT),
+        'students': _students_names(lesson_doc),
+        'link': lesson_doc.get('link')
+    }
+
+
+def _student_month_entry(lesson_doc: dict) -> dict:
+    # Menesio sarase rodomos ir istrintos pamokos, todel reikia "type"
+    if 'type' in lesson_doc:
+        return _student_lesson_entry(lesson_doc) | {'type': lesson_doc['type']}
+
+    return _student_lesson_entry(lesson_doc)
+
+
+def _find_lessons(lesson_collection, query: dict, start: datetime, end: datetime, format_lesson) -> list[dict]:
+    """ Suformatuotos [start, end) pamokos, surikiuotos pagal laiką. """
+    lesson_docs = lesson_collection.find(
+        query | {'time': {'$gte': start, '$lt': end}},
+        LIST_PROJECTION
+    ).sort('time', 1)
 
+    return [format_lesson(lesson_doc) for lesson_doc in lesson_docs]
 
-    lesson_list = sorted(lessons,
-        key=lambda x: datetime.strptime(x['time'], '%Y-%m-%d %H:%M'))
 
-    return lesson_list
+def _lessons_next_week(calendars: dict, now: datetime) -> list[dict]:
+    """ Sujungia dviejų ISO savaičių sąrašus ir palieka pamokas (now, now + 1 sav.). """
+    end = now + timedelta(weeks=1)
+    lessons = [
+        lesson
+        for bucket_lessons in calendars.values()
+        for lesson in bucket_lessons
+        if now < datetime.strptime(lesson['time'], LESSON_TIME_FORMAT) < end
+    ]
+
+    return sorted(lessons, key=lambda x: x['time'])
+
+
+def list_lessons_tutor_week(
+    lesson_collection,
+    tutor_collection,
+    tutor_id: str
+) -> list[dict]:
+    """
+    List tutor's lessons for the next week.
+    Sudaroma iš dviejų ISO savaičių kalendorių (api/calendar_cache.py).
+    """
+    tutor_oid = ObjectId(tutor_id)
+    now = datetime.now()
+
+    # Aktyvios pamokos (be "type" arba "type" != "DELETED")
+    query = {'tutor.tutor_id': tutor_oid, 'type': {'$ne': 'DELETED'}}
+
+    calendars = get_calendars(
+        TUTOR_CALENDAR,
+        tutor_oid,
+        {
+            bucket: partial(_find_lessons, lesson_collection, query, start, end, _tutor_lesson_entry)
+            for bucket, (start, end) in _week_ranges(now).items()
+        },
+        # Patikrinti, ar toks korepetitoriaus id yra (tik jei reikia skaiciuoti)
+        before_compute=partial(
+            _check_owner, tutor_collection, tutor_oid, 'Specified tutor could not be found'
+        )
+    )
+
+    return _lessons_next_week(calendars, now)
 
 
 def list_lessons_tutor_month(
@@ -315,53 +559,32 @@ def list_lessons_tutor_month(
     year: str,
     month: str 
 ) -> list[dict]:
-    """ List tutor's lessons. """
-
-    if not tutor_collection.find_one({'_id': ObjectId(tutor_id)}):
-        raise ValueError('Specified tutor could not be found')
-
-    try:
-        year = int(year)
-        month = int(month)
-    except ValueError:
-        raise ValueError('Could not convert year or month (arguments 2 and 3) to int')
-
-    # Nustatom pabaigos datą
-    if month == 12:
-        next_month = datetime(year + 1, 1, 1)
-    else:
-        next_month = datetime(year, month + 1, 1)
+    """ List tutor's lessons (cached per month, api/calendar_cache.py). """
 
-    lessons = []
+    tutor_oid = ObjectId(tutor_id)
+    year, month = _parse_year_month(year, month)
+    start, end = _month_range(year, month)
 
+    # Tik aktyvios pamokos
     query = {
-        'tutor.tutor_id': ObjectId(tutor_id),
-        'time': {
-            "$gte": datetime(year, month, 1),
-            "$lt": next_month
-        }
-    }
-
-    for lesson_doc in lesson_collection.find(query):
-        students = [
-            {'first_name': stud['first_name'], 'last_name': stud['last_name']}
-            for stud in lesson_doc['students']
+        'tutor.tutor_id': tutor_oid,
+        '$or': [
+            {'type': {'$exists': False}},
+            {'type': 'ACTIVE'}
         ]
+    }
 
-        if 'type' in lesson_doc and lesson_doc['type'] != 'ACTIVE':
-            continue
-
-        lessons.append({
-            '_id': str(lesson_doc['_id']),
-            'time': lesson_doc['time'].strftime('%Y-%m-%d %H:%M'),
-            'students': students,
-            'link': lesson_doc.get('link'),
-            'subject': lesson_doc.get('subject'),
-            'class': lesson_doc.get('class')
-        })
+    bucket = month_bucket(year, month)
+    calendars = get_calendars(
+        TUTOR_CALENDAR,
+        tutor_oid,
+        {bucket: partial(_find_lessons, lesson_collection, query, start, end, _tutor_lesson_entry)},
+        before_compute=partial(
+            _check_owner, tutor_collection, tutor_oid, 'Specified tutor could not be found'
+        )
+    )
 
-    lesson_list = sorted(lessons, key=lambda x: datetime.strptime(x['time'], '%Y-%m-%d %H:%M'))
-    return lesson_list
+    return calendars[bucket]
 
 
 def list_lessons_student_week(
@@ -369,47 +592,28 @@ def list_lessons_student_week(
     student_collection,
     student_id: str
 ):
-    """ List student's lesson """
-
-    # Patikrinti, ar toks korepetitoriaus id yra
-    if not student_collection.find_one({'_id': ObjectId(student_id)}):
-        raise ValueError('Specified student could not be found')
+    """
+    List student's lessons for the next week.
+    Sudaroma iš dviejų ISO savaičių kalendorių (api/calendar_cache.py).
+    """
+    student_oid = ObjectId(student_id)
+    now = datetime.now()
 
-    # Grazinti informacija
-    lessons = []
+    query = {'students.student_id': student_oid, 'type': {'$ne': 'DELETED'}}
 
-    query = {
-        'students.student_id': ObjectId(student_id),
-        'time': {
-            "$gt": datetime.now(),
-            "$lt": datetime.now() + timedelta(weeks=1)
+    calendars = get_calendars(
+        STUDENT_CALENDAR,
+        student_oid,
+        {
+            bucket: partial(_find_lessons, lesson_collection, query, start, end, _student_lesson_entry)
+            for bucket, (start, end) in _week_ranges(now).items()
         },
-        # Jei "type" neegzistuoja - pamoka aktyvi, jei "type" != "DELETED" irgi aktyvi.
-        "$or": [
-            {"type": {"exists": False}},
-            {"type": {"$ne": "DELETED"}}
-        ]
-    }
-
-    for lesson_doc in lesson_collection.find(query):
-        students = [
-            {'first_name': stud['first_name'], 'last_name': stud['last_name']}
-            for stud in lesson_doc['students']
-        ]
-
-        lessons.append({
-            '_id': str(lesson_doc['_id']),
-            'tutor_first_name': lesson_doc['tutor']['first_name'],
-            'tutor_last_name': lesson_doc['tutor']['last_name'],
-            'time': lesson_doc['time'].strftime('%Y-%m-%d %H:%M'),
-            'students': students,
-            'link': lesson_doc['link']
-        })
-
-    lesson_list = sorted(lessons,
-        key=lambda x: datetime.strptime(x['time'], '%Y-%m-%d %H:%M'))
+        before_compute=partial(
+            _check_owner, student_collection, student_oid, 'Specified student could not be found'
+        )
+    )
 
-    return lesson_list
+    return _lessons_next_week(calendars, now)
 
 
 def list_lesson_student_month(
@@ -419,50 +623,32 @@ def list_lesson_student_month(
     year: str,
     month: str 
 ):
-    """ List student's lesson """
-
-    # Patikrinti, ar toks korepetitoriaus id yra
-    if not student_collection.find_one({'_id': ObjectId(student_id)}):
-        raise ValueError('Specified student could not be found')
-
-    try:
-        year = int(year)
-        month = int(month)
-    except ValueError:
-        raise ValueError('Could not convert year or month (arguments 2 and 3) to int')
-
-    # Grazinti informacija
-    lessons = []
-
-    query = {
-        'students.student_id': ObjectId(student_id),
-        'time': {
-            "$gte": datetime(year, month, 1),
-            "$lt": datetime(year, month+1, 1)
-        }
-    }
-    for lesson_doc in lesson_collection.find(query):
-        students = [
-            {'first_name': stud['first_name'], 'last_name': stud['last_name']}
-            for stud in lesson_doc['students']
-        ]
-
-        lessons.append({
-            '_id': str(lesson_doc['_id']),
-            'tutor_first_name': lesson_doc['tutor']['first_name'],
-            'tutor_last_name': lesson_doc['tutor']['last_name'],
-            'time': lesson_doc['time'].strftime('%Y-%m-%d %H:%M'),
-            'students': students,
-            'link': lesson_doc['link']
-        })
-
-        if 'type' in lesson_doc:
-            lessons[-1] = lessons[-1] | {"type": lesson_doc["type"]}
-
-    lesson_list = sorted(lessons,
-        key=lambda x: datetime.strptime(x['time'], '%Y-%m-%d %H:%M'))
+    """ List student's lessons, su ištrintomis (cached per month, api/calendar_cache.py). """
+
+    student_oid = ObjectId(student_id)
+    year, month = _parse_year_month(year, month)
+    start, end = _month_range(year, month)
+
+    bucket = month_bucket(year, month)
+    calendars = get_calendars(
+        STUDENT_CALENDAR,
+        student_oid,
+        {
+            bucket: partial(
+                _find_lessons,
+                lesson_collection,
+                {'students.student_id': student_oid},
+                start,
+                end,
+                _student_month_entry
+            )
+        },
+        before_compute=partial(
+            _check_owner, student_collection, student_oid, 'Specified student could not be found'
+        )
+    )
 
-    return lesson_list
+    return calendars[bucket]
 
 
 def change_lesson_price_student_wo_lock(
@@ -493,7 +679,7 @@ def change_lesson_price_student_wo_lock(
 
         students.append( student )
 
-    # Update
+    # Update (kaina kalendoriuje nerodoma - kalendoriaus keso invaliduoti nereikia)
     return lesson_collection.find_one_and_update(
         {'_id': ObjectId(lesson_id)},
         {'$set': {'students': students}}
@@ -538,11 +724,14 @@ def delete_student_from_lesson(
     if len(student_list) == 0:
         delete_lesson(lesson_collection, lesson_id)
 
-    return lesson_collection.find_one_and_update(
+    result = lesson_collection.find_one_and_update(
         {"_id": ObjectId(lesson_id)},
         { "$set": {"students": student_list} }
     )
 
+    invalidate_lesson_calendars(lesson_doc)
+    return result
+
 
 def change_lesson_time_student_wo_lock(
     lesson_collection,
@@ -591,11 +780,26 @@ def change_lesson_time_student_wo_lock(
 
     student = student_collection.find_one({"_id": ObjectId( lesson_info["student_id"] )})
 
-    # Patikrinti, ar pamoka tokiu laiku egzistuoja korepetitoriui
-    lesson_same_time_tutor = lesson_collection.find_one({
-        "tutor.tutor_id": lesson_doc["tutor"]["tutor_id"],
-        "time": time
-    })
+    # Visos korepetitoriaus ir mokinio pamokos, persidengiancios su nauju laiku
+    conflicts = find_lesson_conflicts(
+        lesson_collection,
+        lesson_doc["tutor"]["tutor_id"],
+        [student['_id']],
+        time,
+        lesson_duration(lesson_doc),
+        exclude_lesson_id=lesson_doc['_id']
+    )
+
+    lesson_same_time_tutor = None
+    for conflict in conflicts:
+        if any(stud['student_id'] == student['_id'] for stud in conflict['students']):
+            raise ValueError(f"Mokinys {student['first_name']} {student['last_name']} turi pamoką tuo laiku")
+
+        # Tik lygiai tuo paciu metu prasidedancia pamoka galima sujungti
+        if conflict['time'] != time or lesson_duration(conflict) != lesson_duration(lesson_doc):
+            raise ValueError("Korepetitorius tuo metu turi kitą pamoką")
+
+        lesson_same_time_tutor = conflict
 
     # Jei korepetitorius tuo metu turi suderinama pamoka, prideti mokini
     if lesson_same_time_tutor:
@@ -620,7 +824,7 @@ def change_lesson_time_student_wo_lock(
         return add_student_to_lesson(
             lesson_collection, 
             student_collection, 
-            str(lesson_doc['_id']),
+            str(lesson_same_time_tutor['_id']),
             str(student['_id'])
         )
 
@@ -630,7 +834,8 @@ def change_lesson_time_student_wo_lock(
             'time': lesson_info['time'],
             'tutor_id': str( lesson_doc['tutor']['tutor_id'] ),
             'student_ids': [student['_id']],
-            'subject': lesson_doc['subject']
+            'subject': lesson_doc['subject'],
+            'duration': lesson_duration(lesson_doc)
         }
 
         return create_lesson(
@@ -655,18 +860,17 @@ if __name__ == "__main__":
         'subject'
     ]
 
-    for i in range(13, 30, 7):
-
-        create_lesson(
-            db['lesson'],
-            db['tutor'],
-            db['student'],
-            lesson_info={
-                'time': f'2025-10-{i} 15:00',
-                'tutor_id': '68e3cedf7249569216674679',
-                'student_ids': [
-                    '68dfe5e166fb223bfcdd8807'
-                ],
-                'subject': 'Matematika'
-            }
-        )
+    create_lessons_bulk(
+        db['lesson'],
+        db['tutor'],
+        db['student'],
+        lesson_info={
+            'time': '2025-10-13 15:00',
+            'count': 3,
+            'tutor_id': '68e3cedf7249569216674679',
+            'student_ids': [
+                '68dfe5e166fb223bfcdd8807'
+            ],
+            'subject': 'Matematika'
+        }
+    )
@@ -0,0 +1,154 @@
+"""
+Pamokų persidengimo tikrinimas.
+
+Pamoka - laiko intervalas [time, time + duration). Korepetitoriaus ir visų
+mokinių pamokos, kurios gali persidengti su nauju intervalu (ar visa pamokų
+serija), randamos viena užklausa per indeksus tutor_time ir students_time
+(žr. model/indexes.py).
+Kadangi pamoka negali būti ilgesnė nei MAX_LESSON_DURATION_MINUTES, pakanka
+ieškoti pamokų, prasidedančių (start - MAX_LESSON_DURATION, end) intervale.
+"""
+
+from datetime import datetime, timedelta
+from bson import ObjectId
+
+# Senos pamokos neturi "duration" lauko - laikome, kad jos trunka valandą
+LESSON_DURATION_MINUTES = 60
+MAX_LESSON_DURATION_MINUTES = 180
+
+CONFLICT_PROJECTION = {
+    'time': 1,
+    'duration': 1,
+    'subject': 1,
+    'class': 1,
+    'tutor.tutor_id': 1,
+    'students.student_id': 1,
+    'students.first_name': 1,
+    'students.last_name': 1
+}
+
+
+def lesson_duration(lesson_doc: dict) -> int:
+    return lesson_doc.get('duration') or LESSON_DURATION_MINUTES
+
+
+def validate_duration(duration) -> int:
+    duration = int(duration)
+    if not 0 < duration <= MAX_LESSON_DURATION_MINUTES:
+        raise ValueError(f'Pamokos trukmė turi būti nuo 1 iki {MAX_LESSON_DURATION_MINUTES} min.')
+
+    return duration
+
+
+def lesson_interval(lesson_doc: dict) -> tuple[datetime, datetime]:
+    start = lesson_doc['time']
+    return start, start + timedelta(minutes=lesson_duration(lesson_doc))
+
+
+def find_series_conflicts(
+    lesson_collection,
+    tutor_id,
+    student_ids: list,
+    starts: list[datetime],
+    duration: int = LESSON_DURATION_MINUTES,
+    exclude_lesson_id=None
+) -> list[tuple[datetime, dict]]:
+    """
+    Grąžina (pradžia, pamoka) poras: aktyvias pamokas, kurių intervalas
+    persidengia su kuriuo nors [start, start + duration) korepetitoriui arba
+    bent vienam mokiniui. Visiems intervalams - viena užklausa.
+    """
+    if not starts:
+        return []
+
+    starts = sorted(starts)
+    time_range = {
+        '$gt': starts[0] - timedelta(minutes=MAX_LESSON_DURATION_MINUTES),
+        '$lt': starts[-1] + timedelta(minutes=duration)
+    }
+
+    # Laikas kartojamas kiekvienoje $or šakoje, kad abi naudotų savo indeksą
+    branches = [{'tutor.tutor_id': ObjectId(tutor_id), 'time': time_range}]
+    if student_ids:
+        branches.append({
+            'students.student_id': {'$in': [ObjectId(student_id) for student_id in student_ids]},
+            'time': time_range
+        })
+
+    query = {'$or': branches, 'type': {'$ne': 'DELETED'}}
+    if exclude_lesson_id is not None:
+        query['_id'] = {'$ne': ObjectId(exclude_lesson_id)}
+
+    candidates = [
+        (*lesson_interval(lesson_doc), lesson_doc)
+        for lesson_doc in lesson_collection.find(query, CONFLICT_PROJECTION)
+    ]
+
+    conflicts = []
+    for start in starts:
+        end = start + timedelta(minutes=duration)
+        for lesson_start, lesson_end, lesson_doc in candidates:
+            if lesson_start < end and lesson_end > start:
+                conflicts.append((start, lesson_doc))
+
+    return conflicts
+
+
+def find_lesson_conflicts(
+    lesson_collection,
+    tutor_id,
+    student_ids: list,
+    start: datetime,
+    duration: int = LESSON_DURATION_MINUTES,
+    exclude_lesson_id=None
+) -> list[dict]:
+    """ Kaip find_series_conflicts, vienam intervalui. """
+    return [
+        lesson_doc for _, lesson_doc in find_series_conflicts(
+            lesson_collection, tutor_id, student_ids, [start], duration, exclude_lesson_id
+        )
+    ]
+
+
+def check_series_conflicts(
+    lesson_collection,
+    tutor_id,
+    student_ids: list,
+    starts: list[datetime],
+    duration: int = LESSON_DURATION_MINUTES,
+    exclude_lesson_id=None
+):
+    """ Meta ValueError, jei korepetitorius ar kuris nors mokinys kuriuo nors metu užimtas. """
+    conflicts = find_series_conflicts(
+        lesson_collection, tutor_id, student_ids, starts, duration, exclude_lesson_id
+    )
+
+    tutor_oid = ObjectId(tutor_id)
+    student_oids = {ObjectId(student_id) for student_id in student_ids}
+
+    for start, lesson_doc in conflicts:
+        # Serijai nurodome, kuri pamoka persidengia
+        when = f" ({start.strftime('%Y-%m-%d %H:%M')})" if len(starts) > 1 else ""
+
+        if lesson_doc['tutor']['tutor_id'] == tutor_oid:
+            raise ValueError(f'Laikas persidengia korepetitoriui{when}')
+
+        for student in lesson_doc['students']:
+            if student['student_id'] in student_oids:
+                raise ValueError(
+                    f"Mokinys {student['first_name']} {student['last_name']} turi pamoką tuo laiku{when}"
+                )
+
+
+def check_lesson_conflicts(
+    lesson_collection,
+    tutor_id,
+    student_ids: list,
+    start: datetime,
+    duration: int = LESSON_DURATION_MINUTES,
+    exclude_lesson_id=None
+):
+    """ Meta ValueError, jei korepetitorius ar kuris nors mokinys tuo metu užimtas. """
+    check_series_conflicts(
+        lesson_collection, tutor_id, student_ids, [start], duration, exclude_lesson_id
+    )
@@ -3,11 +3,12 @@ from bson.errors import InvalidId
 
 
 from connection import get_db
+from utils import serialize_doc
 import traceback
 
 from tutor import (
     create_new_tutor,
-    get_all_tutors,
+    list_tutors_page,
     get_tutor_by_id,
     get_tutors_by_name,
     assign_student_to_tutor,
@@ -18,13 +19,14 @@ from tutor import (
 )
 from student import (
     create_new_student,
-    get_all_students,
+    list_students_page,
     get_student_by_id,
     get_students_by_name,
     delete_student
 )
 from lesson import (
     create_lesson,
+    create_lessons_bulk,
     add_student_to_lesson,
     change_lesson_date,
     delete_lesson,
@@ -45,6 +47,22 @@ from reviews import (
 db = get_db()
 app = Flask(__name__)
 
+
+def page_response(page: dict, msg: dict = None, status: int = 200):
+    """
+    Puslapio įrašai grąžinami kaip sąrašas (kaip anksčiau), o kito puslapio
+    žymeklis ir apytikslis viso sąrašo dydis - antraštėse.
+    """
+    items = [serialize_doc(doc) | (msg or {}) for doc in page['items']]
+
+    response = jsonify(items)
+    response.status_code = status
+    response.headers['X-Total-Count-Estimate'] = str(page['total_estimate'])
+    if page['next']:
+        response.headers['X-Next-After'] = page['next']
+
+    return response
+
 #--------------TUTOR API--------------------------------------
 @app.route('/tutor/', methods = ['POST'])
 def add_new_tutor():
@@ -144,9 +162,10 @@ def api_get_tutor(tutor_id):
 @app.route("/tutors", methods=["GET"])
 def api_get_tutors():
     """
-    API endpointas gauti visus korepetitorius arba ieškoti pagal vardą ir pavardę.
+    API endpointas gauti korepetitorių sąrašą (puslapiais) arba ieškoti pagal vardą ir pavardę.
     Parametrai per query string:
         ?first_name=Jonas&last_name=Kazlauskas
+        ?page_size=50&after=<X-Next-After reikšmė iš ankstesnio puslapio>
     """
     first_name = request.args.get("first_name")
     last_name = request.args.get("last_name")
@@ -155,8 +174,17 @@ def api_get_tutors():
         tutors = get_tutors_by_name(db["tutor"], first_name, last_name)
         return jsonify(tutors), 200
 
-    # Jei nenurodyti abu parametrai, gražiname visus
-    return jsonify(get_all_tutors(db["tutor"])), 200
+    # Jei nenurodyti abu parametrai, gražiname sarasa puslapiais
+    try:
+        page = list_tutors_page(
+            db["tutor"],
+            request.args.get("page_size"),
+            request.args.get("after")
+        )
+    except ValueError as e:
+        return jsonify({"server_response": str(e)}), 400
+
+    return page_response(page)
 
 @app.route("/tutors/search", methods=["GET"])
 def search_tutors():
@@ -246,7 +274,10 @@ def api_get_student(student_id):
 
 @app.route("/students", methods=["GET"])
 def api_get_students():
-    """API endpointas gauti visus studentus arba ieškoti pagal vardą/pavardę."""
+    """
+    API endpointas gauti studentų sąrašą (puslapiais) arba ieškoti pagal vardą/pavardę.
+    Puslapiavimas: ?page_size=50&after=<X-Next-After reikšmė iš ankstesnio puslapio>
+    """
 
     first_name = request.args.get("first_name")
     last_name = request.args.get("last_name")
@@ -254,23 +285,26 @@ def api_get_students():
     if first_name and last_name:
         return jsonify(get_students_by_name(db["student"], first_name, last_name)), 200
 
+    try:
+        page = list_students_page(
+            db["student"],
+            request.args.get("page_size"),
+            request.args.get("after")
+        )
+    except ValueError as e:
+        return jsonify({"server_response": str(e)}), 400
+
     # Jei pateiktas first_name, bet ne last_name
-    elif first_name:
-        all_students = get_all_students(db["student"])
+    if first_name:
         msg = {'server_msg': 'Pateikete full_name, reikia ir last_name'}
-
-        all_students = [student | msg for student in all_students]
-        return jsonify(all_students), 206
+        return page_response(page, msg, 206)
 
     # Jei pateiktas last_name, bet ne first_name
     elif last_name:
-        all_students = get_all_students(db["student"])
         msg = {'server_msg': 'Pateikete last_name, reikia ir first_name'}
+        return page_response(page, msg, 206)
 
-        all_students = [student | msg for student in all_students]
-        return jsonify(all_students), 206
-
-    return jsonify(get_all_students(db["student"])), 200
+    return page_response(page)
 
 @app.route("/student/<student_id>", methods=["DELETE"])
 def remove_student(student_id: str):
@@ -314,6 +348,37 @@ def add_new_lesson():
         return output, 400
 
 
+@app.route("/lesson/series", methods=["POST"])
+def add_new_lesson_series():
+    """ Savaitine pamoku serija: kaip /lesson/ + count arba until, interval_weeks. """
+    try:
+        insert_result = create_lessons_bulk(
+            lesson_collection=db['lesson'],
+            tutor_collection=db['tutor'],
+            student_collection=db['student'],
+            lesson_info=request.get_json()
+        )
+    except ValueError as err:
+        return jsonify({'server_response': f'{err}'}), 400
+    except KeyError as err:
+        return jsonify({'server_response': f'{err}'}), 400
+    except Exception as err:
+        return jsonify({'server_response': f'Serverio klaida: {err}'}), 500
+
+    if insert_result.acknowledged:
+        output = jsonify({
+            'server_response': 'pavyko',
+            'lesson_ids': [str(lesson_id) for lesson_id in insert_result.inserted_ids]
+        })
+
+        return output, 200
+
+    else:
+        output = jsonify({'server_response': 'nepavyko'})
+
+        return output, 400
+
+
 @app.route("/lesson/delete_lesson/<lesson_id>", methods=["DELETE"])
 def delete_lesson_by_id(lesson_id):
     """ Delete lesson -> pakeisti tipa i pakeista, kadangi isimti pilnai nenorim del ateities konfliktu. """
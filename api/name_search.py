@@ -0,0 +1,189 @@
+"""
+Mokinių ir korepetitorių paieška pagal vardą ir pavardę.
+
+Kiekviename student/tutor dokumente laikomas normalizuotas vardas
+(mažosios raidės, be lietuviškų diakritikų - "Šarūnas" -> "sarunas"):
+    name_search: {'first': ..., 'last': ..., 'trigrams': [...]}
+
+Paieška:
+    1. prefiksas - inkaruotas ^... regex normalizuotame lauke naudoja indeksą;
+    2. jei rezultatų per mažai - poeilutė per trigramų (multikey) indeksą,
+      kandidatai patikrinami Python'e;
+    3. rezultatai rikiuojami: tikslus atitikimas, prefiksas, poeilutė.
+
+Seniems dokumentams laukas užpildomas: python -m api.name_search
+"""
+
+import os
+import re
+import unicodedata
+
+from pymongo import UpdateOne
+
+NAME_SEARCH_FIELD = 'name_search'
+NAME_SEARCH_LIMIT = 50
+# Poeilutes paieska per trigramas (galima isjungti, jei indekso nenorim)
+NAME_SEARCH_SUBSTRING = os.getenv('NAME_SEARCH_SUBSTRING', '1') != '0'
+
+BACKFILL_BATCH_SIZE = 1000
+
+# Atitikimo svoriai rikiavimui (maziau - geriau)
+EXACT, PREFIX, SUBSTRING = 0, 1, 2
+
+
+def fold_name(text) -> str:
+    """ 'Žemaitė  Ąžuolė' -> 'zemaite azuole' """
+    if not text:
+        return ''
+
+    decomposed = unicodedata.normalize('NFKD', str(text))
+    folded = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(folded.casefold().split())
+
+
+def name_trigrams(*names: str) -> list[str]:
+    trigrams = set()
+    for name in names:
+        trigrams.update(name[i:i + 3] for i in range(len(name) - 2))
+
+    return sorted(trigrams)
+
+
+def name_search_doc(first_name, last_name) -> dict:
+    """ name_search lauko reikšmė dokumentui. """
+    first, last = fold_name(first_name), fold_name(last_name)
+    return {'first': first, 'last': last, 'trigrams': name_trigrams(first, last)}
+
+
+def _match_rank(value: str, query: str):
+    if not query:
+        return EXACT
+    if value == query:
+        return EXACT
+    if value.startswith(query):
+        return PREFIX
+    if query in value:
+        return SUBSTRING
+    return None
+
+
+def _rank(doc: dict, first: str, last: str):
+    """ Atitikimo svoris arba None, jei dokumentas neatitinka. """
+    names = doc.get(NAME_SEARCH_FIELD) or {}
+    first_rank = _match_rank(names.get('first', ''), first)
+    last_rank = _match_rank(names.get('last', ''), last)
+
+    if first_rank is None or last_rank is None:
+        return None
+
+    return first_rank + last_rank
+
+
+def _prefix_query(first: str, last: str) -> dict:
+    query = {}
+    if first:
+        query[f'{NAME_SEARCH_FIELD}.first'] = {'$regex': f'^{re.escape(first)}'}
+    if last:
+        query[f'{NAME_SEARCH_FIELD}.last'] = {'$regex': f'^{re.escape(last)}'}
+
+    return query
+
+
+def _substring_query(first: str, last: str):
+    """ Trigramų užklausa arba None, jei ieškomas tekstas per trumpas trigramoms. """
+    trigrams = name_trigrams(first, last)
+    if not trigrams:
+        return None
+
+    query = {f'{NAME_SEARCH_FIELD}.trigrams': {'$all': trigrams}}
+
+    # Per trumpa dalis (< 3 raides) - tik prefiksas
+    if first and len(first) < 3:
+        query.update(_prefix_query(first, ''))
+    if last and len(last) < 3:
+        query.update(_prefix_query('', last))
+
+    return query
+
+
+def search_by_name(
+    collection,
+    first_name: str = '',
+    last_name: str = '',
+    projection: dict = None,
+    limit: int = NAME_SEARCH_LIMIT
+) -> list[dict]:
+    """
+    Randa dokumentus, kurių vardas ir pavardė atitinka first_name ir last_name
+    (abu neprivalomi, bet bent vienas turi būti). Grąžina iki limit dokumentų,
+    surikiuotų pagal atitikimą.
+    """
+    first, last = fold_name(first_name), fold_name(last_name)
+    if not first and not last:
+        return []
+
+    if projection is not None:
+        projection = projection | {NAME_SEARCH_FIELD: 1}
+
+    found = {
+        doc['_id']: doc
+        for doc in collection.find(_prefix_query(first, last), projection).limit(limit)
+    }
+
+    substring_query = _substring_query(first, last) if NAME_SEARCH_SUBSTRING else None
+    if substring_query is not None and len(found) < limit:
+        substring_query['_id'] = {'$nin': list(found)}
+
+        # Trigramos gali sutapti ir ne is eiles - kandidatus tikrinam
+        for doc in collection.find(substring_query, projection).limit(limit * 2):
+            if len(found) >= limit:
+                break
+            if _rank(doc, first, last) is not None:
+                found[doc['_id']] = doc
+
+    results = sorted(
+        found.values(),
+        key=lambda doc: (
+            _rank(doc, first, last),
+            (doc.get(NAME_SEARCH_FIELD) or {}).get('last', ''),
+            (doc.get(NAME_SEARCH_FIELD) or {}).get('first', '')
+        )
+    )
+
+    for doc in results:
+        doc.pop(NAME_SEARCH_FIELD, None)
+
+    return results
+
+
+def backfill_name_search(collection, force: bool = False) -> int:
+    """
+    Užpildo name_search dokumentams, kurie jo neturi (force - visiems).
+    Grąžina atnaujintų dokumentų skaičių.
+    """
+    query = {} if force else {NAME_SEARCH_FIELD: {'$exists': False}}
+    cursor = collection.find(query, {'first_name': 1, 'last_name': 1}).batch_size(BACKFILL_BATCH_SIZE)
+
+    updated, operations = 0, []
+    for doc in cursor:
+        operations.append(UpdateOne(
+            {'_id': doc['_id']},
+            {'$set': {NAME_SEARCH_FIELD: name_search_doc(doc.get('first_name'), doc.get('last_name'))}}
+        ))
+
+        if len(operations) == BACKFILL_BATCH_SIZE:
+            updated += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+
+    if operations:
+        updated += collection.bulk_write(operations, ordered=False).modified_count
+
+    return updated
+
+
+if __name__ == "__main__":
+    from api.connection import get_db
+    db = get_db()
+
+    for collection_name in ('student', 'tutor'):
+        print(f"{collection_name}: atnaujinta {backfill_name_search(db[collection_name])}")
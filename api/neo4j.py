@@ -1,96 +1,310 @@
+import json
+import re
+
 from neo4j_db.neo4j_client import get_driver, NEO4J_DATABASE
+from neo4j_db.schema import STUDENT_NAME_FULLTEXT_INDEX
+from api.connection import get_redis
+from api.name_search import fold_name
+from api.graph_snapshot import apply_event, get_snapshot, start_snapshot_loader
 
+redis_client = get_redis()
 
-def get_schools(driver):
-    """Grąžina visas mokyklas"""
-    query = """
-    MATCH (school:School)
-    RETURN school.name AS school_name
-    ORDER BY school.name
+SEARCH_LIMIT = 25
+# Kiek laikom paieskos rezultatus (paieska vykdoma kiekvienam klaviso paspaudimui)
+SEARCH_CACHE_TTL = 30
+SEARCH_FUZZY_MIN_LENGTH = 4
+
+
+def _snapshot(driver):
+    """ Grafo kopija atmintyje (api/graph_snapshot.py) arba None - tada skaitom is Neo4j. """
+    start_snapshot_loader(driver)
+    return get_snapshot()
+
+
+def _fetch(tx, query, params):
+    # Rezultata butina perskaityti transakcijos viduje
+    return [record.data() for record in tx.run(query, params)]
+
+
+def _read(driver, query, **params) -> list[dict]:
+    """
+    Skaitymo transakcija (execute_read): klasteryje nukreipiama į skaitymo
+    replikas, laikinos klaidos (ryšys, lyderio keitimas) pakartojamos.
     """
+    with driver.session(database=NEO4J_DATABASE) as session:
+        return session.execute_read(_fetch, query, params)
 
-    schools = []
+
+def _write(driver, query, **params) -> list[dict]:
+    """ Rašymo transakcija (execute_write) - viena užklausa, vienas kreipinys į Aura. """
     with driver.session(database=NEO4J_DATABASE) as session:
-        result = session.run(query)
-        for record in result:
-            data = record.data()
-            schools.append(str(data.get("school_name", "")))
+        return session.execute_write(_fetch, query, params)
 
-    return schools
 
+def _names(rows) -> list[dict]:
+    return [
+        {
+            "first_name": str(row.get("first_name", "")),
+            "last_name": str(row.get("last_name", "")),
+        }
+        for row in rows
+    ]
 
-def get_tutors_by_school(driver, school_name):
-    """Grąžina korepetitorius, kurie mokina tam tikros mokyklos mokinius"""
-    query = """
+
+# Rekomendacijos per draugu tinkla
+RECOMMENDATION_MAX_PATH_LENGTH = 4
+RECOMMENDATION_LIMIT = 10
+LUCENE_SPECIAL = re.compile(r'[+\-&|!(){}\[\]^"~*?:\\/]')
+
+# Cypher uzklausos - modulio konstantos, kad neo4j_db/schema.py check
+# tikrintu (EXPLAIN) butent tai, ka vykdo programa
+
+SCHOOLS_QUERY = """
+    MATCH (school:School)
+    RETURN school.name AS school_name
+    ORDER BY school.name
+"""
+
+TUTORS_BY_SCHOOL_QUERY = """
     MATCH (t:Tutor)-[:TEACHES]->(s:Student)
     MATCH (s)-[:ATTENDS]->(school:School {name: $school_name})
     RETURN DISTINCT t.first_name AS first_name,
                     t.last_name AS last_name,
                     school.name AS school_name
-    """
+"""
 
-    tutors = []
-    with driver.session(database=NEO4J_DATABASE) as session:
-        result = session.run(query, school_name=school_name)
-        for record in result:
-            data = record.data()
-            tutors.append(
-                {
-                    "first_name": str(data.get("first_name", "")),
-                    "last_name": str(data.get("last_name", "")),
-                }
-            )
-
-    return tutors
+SET_STUDENT_SCHOOL_QUERY = """
+    MATCH (s:Student {first_name: $student_first_name, last_name: $student_last_name})
+    MATCH (school:School {name: $school_name})
+    MERGE (s)-[:ATTENDS]->(school)
+    RETURN count(*) AS linked
+"""
 
-def create_student(driver, student_first_name, student_last_name, class_num=None):
-    """Sukuria mokinį neo4j duomenų bazėje"""
-    query = """
+SET_STUDENT_TUTOR_QUERY = """
+    MATCH (s:Student {first_name: $student_first_name, last_name: $student_last_name})
+    MATCH (t:Tutor {first_name: $tutor_first_name, last_name: $tutor_last_name})
+    MERGE (t)-[:TEACHES]->(s)
+    RETURN count(*) AS linked
+"""
+
+REGISTER_STUDENT_QUERY = """
     MERGE (s:Student {first_name: $student_first_name, last_name: $student_last_name})
     ON CREATE SET s.class_num = $class_num
-    RETURN s
-    """
+    WITH s
+    OPTIONAL MATCH (school:School {name: $school_name})
+    FOREACH (_ IN CASE WHEN school IS NULL THEN [] ELSE [1] END |
+        MERGE (s)-[:ATTENDS]->(school)
+    )
+    WITH s, school
+    CALL {
+        WITH s
+        UNWIND $tutors AS tutor
+        MATCH (t:Tutor {first_name: tutor[0], last_name: tutor[1]})
+        MERGE (t)-[:TEACHES]->(s)
+        RETURN collect([t.first_name, t.last_name]) AS tutors
+    }
+    RETURN school.name AS school_name, tutors
+"""
+
+# Patikrinimas ir rasymas vienoje uzklausoje: jei b jau prase a - draugyste
+# patvirtinama is karto, jei nieko nera - sukuriamas prasymas
+SEND_FRIEND_REQUEST_QUERY = """
+    MATCH (a:Student {first_name: $from_student_first_name, last_name: $from_student_last_name})
+    MATCH (b:Student {first_name: $to_student_first_name, last_name: $to_student_last_name})
 
-    with driver.session(database=NEO4J_DATABASE) as session:
-        session.run(
-            query,
-            student_first_name=student_first_name,
-            student_last_name=student_last_name,
-            class_num=class_num,
-        )
+    // Uzrakinam abu mazgus - lygiagretus a->b ir b->a prasymai vykdomi paeiliui
+    // (deadlock atveju execute_write transakcija pakartoja)
+    SET a._lock = true, b._lock = true
+    REMOVE a._lock, b._lock
+    WITH a, b
+
+    OPTIONAL MATCH (b)-[reverse_req:REQUESTS_FRIENDSHIP]->(a)
+    WITH a, b, reverse_req
+    LIMIT 1
+
+    WITH a, b, reverse_req,
+        CASE
+            WHEN EXISTS { (a)-[:FRIENDS_WITH]-(b) } THEN 'ALREADY_FRIENDS'
+            WHEN EXISTS { (a)-[:REQUESTS_FRIENDSHIP]->(b) } THEN 'REQUEST_ALREADY_SENT'
+            WHEN reverse_req IS NOT NULL THEN 'REVERSE_REQUEST_PENDING'
+            ELSE 'PROCEED_WITH_REQUEST'
+        END AS status
+
+    FOREACH (_ IN CASE WHEN status = 'PROCEED_WITH_REQUEST' THEN [1] ELSE [] END |
+        MERGE (a)-[:REQUESTS_FRIENDSHIP]->(b)
+    )
+    FOREACH (_ IN CASE WHEN status = 'REVERSE_REQUEST_PENDING' THEN [1] ELSE [] END |
+        DELETE reverse_req
+        MERGE (a)-[:FRIENDS_WITH]->(b)
+        MERGE (b)-[:FRIENDS_WITH]->(a)
+    )
+
+    RETURN status AS Status
+"""
+
+ACCEPT_FRIEND_REQUEST_QUERY = """
+    MATCH (sender:Student {first_name: $from_student_first_name, last_name: $from_student_last_name})
+    MATCH (receiver:Student {first_name: $to_student_first_name, last_name: $to_student_last_name})
+    MATCH (sender)-[r:REQUESTS_FRIENDSHIP]->(receiver)
+    DELETE r
+    MERGE (sender)-[:FRIENDS_WITH]->(receiver)
+    MERGE (receiver)-[:FRIENDS_WITH]->(sender)
+    RETURN count(*) AS accepted
+"""
+
+DELETE_FRIEND_REQUEST_QUERY = """
+    MATCH (sender:Student {first_name: $from_student_first_name, last_name: $from_student_last_name})
+    MATCH (receiver:Student {first_name: $to_student_first_name, last_name: $to_student_last_name})
+    MATCH (sender)-[r:REQUESTS_FRIENDSHIP]->(receiver)
+    DELETE r
+    RETURN count(*) AS deleted
+"""
+
+PENDING_FRIEND_REQUESTS_QUERY = """
+    MATCH (sender:Student)-[:REQUESTS_FRIENDSHIP]->(receiver:Student {first_name: $student_first_name, last_name: $student_last_name})
+    RETURN sender.first_name AS first_name, sender.last_name AS last_name
+"""
+
+FRIENDS_QUERY = """
+    MATCH (student:Student {first_name: $student_first_name, last_name: $student_last_name})-[:FRIENDS_WITH]-(friend:Student)
+    RETURN DISTINCT friend.first_name AS first_name, friend.last_name AS last_name
+"""
+
+REMOVE_FRIEND_QUERY = """
+    MATCH (a:Student {first_name: $student1_first_name, last_name: $student1_last_name})
+    MATCH (b:Student {first_name: $student2_first_name, last_name: $student2_last_name})
+    MATCH (a)-[f:FRIENDS_WITH]-(b)
+    DELETE f
+    RETURN count(*) AS deleted
+"""
+
+SENT_FRIEND_REQUESTS_QUERY = """
+    MATCH (sender:Student {first_name: $student_first_name, last_name: $student_last_name})-[:REQUESTS_FRIENDSHIP]->(receiver:Student)
+    RETURN receiver.first_name AS first_name, receiver.last_name AS last_name
+"""
+
+RECOMMEND_TUTORS_QUERY = """
+    MATCH (student:Student {first_name: $student_first_name, last_name: $student_last_name})
+    CALL apoc.path.spanningTree(student, {
+        relationshipFilter: 'FRIENDS_WITH',
+        labelFilter: '+Student',
+        minLevel: 1,
+        maxLevel: $max_path_length,
+        bfs: true
+    }) YIELD path
+    WITH last(nodes(path)) AS friend, path
+    MATCH (tutor:Tutor)-[:TEACHES]->(friend)
+    WHERE $subject IN tutor.subjects
+      AND NOT tutor.first_name + ' ' + tutor.last_name IN $existing_tutors
+    WITH tutor, path
+    ORDER BY length(path)
+    WITH tutor, head(collect(path)) AS path
+    RETURN elementId(tutor) AS tutor_id,
+           tutor.first_name AS first_name,
+           tutor.last_name AS last_name,
+           length(path) + 1 AS min_path_length,
+           [node IN nodes(path) | node.first_name + ' ' + node.last_name]
+               + [tutor.first_name + ' ' + tutor.last_name] AS example_path
+    ORDER BY min_path_length, first_name, last_name
+    LIMIT $limit
+"""
+
+SEARCH_STUDENTS_QUERY = """
+    CALL db.index.fulltext.queryNodes($index, $q, {limit: $limit})
+    YIELD node AS s, score
+    RETURN elementId(s) AS id,
+           s.first_name AS first_name,
+           s.last_name AS last_name,
+           s.class_num AS class_num,
+           s.school AS school
+    ORDER BY score DESC
+"""
+
+
+def get_schools(driver):
+    """Grąžina visas mokyklas"""
+    return [str(row.get("school_name", "")) for row in _read(driver, SCHOOLS_QUERY)]
+
+
+def get_tutors_by_school(driver, school_name):
+    """Grąžina korepetitorius, kurie mokina tam tikros mokyklos mokinius"""
+    snapshot = _snapshot(driver)
+    if snapshot is not None:
+        return snapshot.tutors_by_school(school_name)
+
+    return _names(_read(driver, TUTORS_BY_SCHOOL_QUERY, school_name=school_name))
+
+def create_student(driver, student_first_name, student_last_name, class_num=None):
+    """Sukuria mokinį neo4j duomenų bazėje"""
+    return register_student(driver, student_first_name, student_last_name, class_num)
 
 def set_student_school(driver, student_first_name, student_last_name, school_name):
     """Prideda mokinį prie mokyklos"""
-    query = """
-    MATCH (s:Student {first_name: $student_first_name, last_name: $student_last_name})
-    MATCH (school:School {name: $school_name})
-    MERGE (s)-[:ATTENDS]->(school)
-    """
+    rows = _write(
+        driver,
+        SET_STUDENT_SCHOOL_QUERY,
+        student_first_name=student_first_name,
+        student_last_name=student_last_name,
+        school_name=school_name,
+    )
 
-    with driver.session(database=NEO4J_DATABASE) as session:
-        session.run(
-            query,
-            student_first_name=student_first_name,
-            student_last_name=student_last_name,
-            school_name=school_name,
-        ) 
+    if rows and rows[0]["linked"]:
+        apply_event(('link', 'attends', (student_first_name, student_last_name), school_name, True))
 
 def set_student_tutor(driver, student_first_name, student_last_name, tutor_first_name, tutor_last_name):
     """Prideda mokinį prie korepetitoriaus"""
-    query = """
-    MATCH (s:Student {first_name: $student_first_name, last_name: $student_last_name})
-    MATCH (t:Tutor {first_name: $tutor_first_name, last_name: $tutor_last_name})
-    MERGE (t)-[:TEACHES]->(s)
+    rows = _write(
+        driver,
+        SET_STUDENT_TUTOR_QUERY,
+        student_first_name=student_first_name,
+        student_last_name=student_last_name,
+        tutor_first_name=tutor_first_name,
+        tutor_last_name=tutor_last_name,
+    )
+
+    if rows and rows[0]["linked"]:
+        apply_event((
+            'link', 'teaches',
+            (tutor_first_name, tutor_last_name),
+            (student_first_name, student_last_name),
+            True
+        ))
+
+def register_student(
+    driver,
+    student_first_name,
+    student_last_name,
+    class_num=None,
+    school_name=None,
+    tutors=()
+):
+    """
+    Sukuria mokinį, priskiria mokyklai ir korepetitoriams (tutors - (vardas, pavardė)
+    poros) vienoje transakcijoje: arba viskas, arba nieko.
+    Grąžina {'school_name': ... arba None, 'tutors': [(vardas, pavardė), ...]} - kas priskirta.
     """
+    rows = _write(
+        driver,
+        REGISTER_STUDENT_QUERY,
+        student_first_name=student_first_name,
+        student_last_name=student_last_name,
+        class_num=class_num,
+        school_name=school_name,
+        tutors=[list(tutor) for tutor in tutors],
+    )
+    row = rows[0]
+    student_key = (student_first_name, student_last_name)
 
-    with driver.session(database=NEO4J_DATABASE) as session:
-        session.run(
-            query,
-            student_first_name=student_first_name,
-            student_last_name=student_last_name,
-            tutor_first_name=tutor_first_name,
-            tutor_last_name=tutor_last_name,
-        ) 
+    apply_event(('student', student_key))
+    if row["school_name"] is not None:
+        apply_event(('link', 'attends', student_key, row["school_name"], True))
+    for tutor_first_name, tutor_last_name in row["tutors"]:
+        apply_event(('link', 'teaches', (tutor_first_name, tutor_last_name), student_key, True))
+
+    return {
+        "school_name": row["school_name"],
+        "tutors": [tuple(tutor) for tutor in row["tutors"]],
+    }
 
 def send_friend_request(
     driver,
@@ -106,65 +320,33 @@ def send_friend_request(
     ):
         return "Cannot send request to yourself."
 
-    query = """
-    MATCH (a:Student {first_name: $from_student_first_name, last_name: $from_student_last_name})
-    MATCH (b:Student {first_name: $to_student_first_name, last_name: $to_student_last_name})
-
-    OPTIONAL MATCH (a)-[f:FRIENDS_WITH]-(b)
-    OPTIONAL MATCH (a)-[existing_req:REQUESTS_FRIENDSHIP]->(b)
-    OPTIONAL MATCH (b)-[reverse_req:REQUESTS_FRIENDSHIP]->(a)
-    LIMIT 1
-
-    RETURN 
-        CASE 
-            WHEN f IS NOT NULL THEN 'ALREADY_FRIENDS'
-            WHEN existing_req IS NOT NULL THEN 'REQUEST_ALREADY_SENT'
-            WHEN reverse_req IS NOT NULL THEN 'REVERSE_REQUEST_PENDING'
-            ELSE 'PROCEED_WITH_REQUEST'
-        END AS Status
-    """
+    rows = _write(
+        driver,
+        SEND_FRIEND_REQUEST_QUERY,
+        from_student_first_name=from_student_first_name,
+        from_student_last_name=from_student_last_name,
+        to_student_first_name=to_student_first_name,
+        to_student_last_name=to_student_last_name,
+    )
 
-    with driver.session(database=NEO4J_DATABASE) as session:
-        result = session.run(
-            query,
-            from_student_first_name=from_student_first_name,
-            from_student_last_name=from_student_last_name,
-            to_student_first_name=to_student_first_name,
-            to_student_last_name=to_student_last_name,
-        ).single()
-
-        if not result:
-            return "Studentas nerastas."
-
-        status = result.data().get("Status")
-
-        if status == "ALREADY_FRIENDS":
-            return "Tokia draugystė jau egzistuoja."
-        elif status == "REQUEST_ALREADY_SENT":
-            return "Draugystės prašymas jau išsiųstas."
-        elif status == "REVERSE_REQUEST_PENDING":
-            accept_friend_request(
-                driver,
-                from_student_first_name=to_student_first_name,
-                from_student_last_name=to_student_last_name,
-                to_student_first_name=from_student_first_name,
-                to_student_last_name=from_student_last_name,
-            )
-            return "Kadangi šis studentas jau išsiuntė jums draugystės prašymą, draugystė buvo automatiškai patvirtinta."
-        else:
-            query = """
-            MATCH (sender:Student {first_name: $from_student_first_name, last_name: $from_student_last_name})
-            MATCH (receiver:Student {first_name: $to_student_first_name, last_name: $to_student_last_name})
-            MERGE (sender)-[:REQUESTS_FRIENDSHIP]->(receiver)
-            """
-            session.run(
-                query,
-                from_student_first_name=from_student_first_name,
-                from_student_last_name=from_student_last_name,
-                to_student_first_name=to_student_first_name,
-                to_student_last_name=to_student_last_name,
-            )
-            return "Draugystės prašymas išsiųstas."
+    if not rows:
+        return "Studentas nerastas."
+
+    status = rows[0].get("Status")
+    sender = (from_student_first_name, from_student_last_name)
+    receiver = (to_student_first_name, to_student_last_name)
+
+    if status == "ALREADY_FRIENDS":
+        return "Tokia draugystė jau egzistuoja."
+    elif status == "REQUEST_ALREADY_SENT":
+        return "Draugystės prašymas jau išsiųstas."
+    elif status == "REVERSE_REQUEST_PENDING":
+        apply_event(('link', 'requests', receiver, sender, False))
+        apply_event(('link', 'friends', receiver, sender, True))
+        return "Kadangi šis studentas jau išsiuntė jums draugystės prašymą, draugystė buvo automatiškai patvirtinta."
+    else:
+        apply_event(('link', 'requests', sender, receiver, True))
+        return "Draugystės prašymas išsiųstas."
 
 
 def accept_friend_request(
@@ -174,23 +356,32 @@ def accept_friend_request(
     to_student_first_name,
     to_student_last_name,
 ):
-    query = """
-    MATCH (sender:Student {first_name: $from_student_first_name, last_name: $from_student_last_name})
-    MATCH (receiver:Student {first_name: $to_student_first_name, last_name: $to_student_last_name})
-    MATCH (sender)-[r:REQUESTS_FRIENDSHIP]->(receiver)
-    DELETE r
-    MERGE (sender)-[:FRIENDS_WITH]->(receiver)
-    MERGE (receiver)-[:FRIENDS_WITH]->(sender)
-    """
 
-    with driver.session(database=NEO4J_DATABASE) as session:
-        session.run(
-            query,
-            from_student_first_name=from_student_first_name,
-            from_student_last_name=from_student_last_name,
-            to_student_first_name=to_student_first_name,
-            to_student_last_name=to_student_last_name,
-        )
+    rows = _write(
+        driver,
+        ACCEPT_FRIEND_REQUEST_QUERY,
+        from_student_first_name=from_student_first_name,
+        from_student_last_name=from_student_last_name,
+        to_student_first_name=to_student_first_name,
+        to_student_last_name=to_student_last_name,
+    )
+
+    # Jei prasymo nebuvo, niekas nepasikeite
+    if not rows or not rows[0]["accepted"]:
+        return
+
+    apply_event((
+        'link', 'requests',
+        (from_student_first_name, from_student_last_name),
+        (to_student_first_name, to_student_last_name),
+        False
+    ))
+    apply_event((
+        'link', 'friends',
+        (from_student_first_name, from_student_last_name),
+        (to_student_first_name, to_student_last_name),
+        True
+    ))
 
 
 def decline_friend_request(
@@ -200,71 +391,65 @@ def decline_friend_request(
     to_student_first_name,
     to_student_last_name,
 ):
-    query = """
-    MATCH (sender:Student {first_name: $from_student_first_name, last_name: $from_student_last_name})
-    MATCH (receiver:Student {first_name: $to_student_first_name, last_name: $to_student_last_name})
-    MATCH (sender)-[r:REQUESTS_FRIENDSHIP]->(receiver)
-    DELETE r
-    """
+    _delete_friend_request(
+        driver,
+        from_student_first_name,
+        from_student_last_name,
+        to_student_first_name,
+        to_student_last_name,
+    )
 
-    with driver.session(database=NEO4J_DATABASE) as session:
-        session.run(
-            query,
-            from_student_first_name=from_student_first_name,
-            from_student_last_name=from_student_last_name,
-            to_student_first_name=to_student_first_name,
-            to_student_last_name=to_student_last_name,
-        )
 
+def _delete_friend_request(
+    driver,
+    from_student_first_name,
+    from_student_last_name,
+    to_student_first_name,
+    to_student_last_name,
+):
+    """ Atmetimas ir atšaukimas - ta pati užklausa. """
+    rows = _write(
+        driver,
+        DELETE_FRIEND_REQUEST_QUERY,
+        from_student_first_name=from_student_first_name,
+        from_student_last_name=from_student_last_name,
+        to_student_first_name=to_student_first_name,
+        to_student_last_name=to_student_last_name,
+    )
 
-def get_pending_friend_requests(driver, student_first_name, student_last_name):
-    query = """
-    MATCH (sender:Student)-[:REQUESTS_FRIENDSHIP]->(receiver:Student {first_name: $student_first_name, last_name: $student_last_name})
-    RETURN sender.first_name AS first_name, sender.last_name AS last_name
-    """
+    if rows and rows[0]["deleted"]:
+        apply_event((
+            'link', 'requests',
+            (from_student_first_name, from_student_last_name),
+            (to_student_first_name, to_student_last_name),
+            False
+        ))
 
-    requests = []
-    with driver.session(database=NEO4J_DATABASE) as session:
-        result = session.run(
-            query,
-            student_first_name=student_first_name,
-            student_last_name=student_last_name,
-        )
-        for record in result:
-            data = record.data()
-            requests.append(
-                {
-                    "first_name": str(data.get("first_name", "")),
-                    "last_name": str(data.get("last_name", "")),
-                }
-            )
 
-    return requests
+def get_pending_friend_requests(driver, student_first_name, student_last_name):
+    snapshot = _snapshot(driver)
+    if snapshot is not None:
+        return snapshot.pending_requests(student_first_name, student_last_name)
 
+    return _names(_read(
+        driver,
+        PENDING_FRIEND_REQUESTS_QUERY,
+        student_first_name=student_first_name,
+        student_last_name=student_last_name,
+    ))
 
-def get_friends(driver, student_first_name, student_last_name):
-    query = """
-    MATCH (student:Student {first_name: $student_first_name, last_name: $student_last_name})-[:FRIENDS_WITH]-(friend:Student)
-    RETURN DISTINCT friend.first_name AS first_name, friend.last_name AS last_name
-    """
 
-    friends = []
-    with driver.session(database=NEO4J_DATABASE) as session:
-        result = session.run(
-            query,
-            student_first_name=student_first_name,
-            student_last_name=student_last_name,
-        )
-        for record in result:
-            data = record.data()
-            friends.append(
-                {
-                    "first_name": str(data.get("first_name", "")),
-                    "last_name": str(data.get("last_name", "")),
-                }
-            )
+def get_friends(driver, student_first_name, student_last_name):
+    snapshot = _snapshot(driver)
+    if snapshot is not None:
+        return snapshot.friends(student_first_name, student_last_name)
 
-    return friends
+    return _names(_read(
+        driver,
+        FRIENDS_QUERY,
+        student_first_name=student_first_name,
+        student_last_name=student_last_name,
+    ))
 
 
 def remove_friend(
@@ -274,21 +459,23 @@ def remove_friend(
     student2_first_name,
     student2_last_name,
 ):
-    query = """
-    MATCH (a:Student {first_name: $student1_first_name, last_name: $student1_last_name})
-    MATCH (b:Student {first_name: $student2_first_name, last_name: $student2_last_name})
-    MATCH (a)-[f:FRIENDS_WITH]-(b)
-    DELETE f
-    """
 
-    with driver.session(database=NEO4J_DATABASE) as session:
-        session.run(
-            query,
-            student1_first_name=student1_first_name,
-            student1_last_name=student1_last_name,
-            student2_first_name=student2_first_name,
-            student2_last_name=student2_last_name,
-        )
+    rows = _write(
+        driver,
+        REMOVE_FRIEND_QUERY,
+        student1_first_name=student1_first_name,
+        student1_last_name=student1_last_name,
+        student2_first_name=student2_first_name,
+        student2_last_name=student2_last_name,
+    )
+
+    if rows and rows[0]["deleted"]:
+        apply_event((
+            'link', 'friends',
+            (student1_first_name, student1_last_name),
+            (student2_first_name, student2_last_name),
+            False
+        ))
 
 
 def cancel_friend_request(
@@ -298,138 +485,138 @@ def cancel_friend_request(
     to_student_first_name,
     to_student_last_name,
 ):
-    query = """
-    MATCH (sender:Student {first_name: $from_student_first_name, last_name: $from_student_last_name})
-    MATCH (receiver:Student {first_name: $to_student_first_name, last_name: $to_student_last_name})
-    MATCH (sender)-[r:REQUESTS_FRIENDSHIP]->(receiver)
-    DELETE r
-    """
-
-    with driver.session(database=NEO4J_DATABASE) as session:
-        session.run(
-            query,
-            from_student_first_name=from_student_first_name,
-            from_student_last_name=from_student_last_name,
-            to_student_first_name=to_student_first_name,
-            to_student_last_name=to_student_last_name,
-        )
+    _delete_friend_request(
+        driver,
+        from_student_first_name,
+        from_student_last_name,
+        to_student_first_name,
+        to_student_last_name,
+    )
 
 
 def get_sent_friend_requests(driver, student_first_name, student_last_name):
-    query = """
-    MATCH (sender:Student {first_name: $student_first_name, last_name: $student_last_name})-[:REQUESTS_FRIENDSHIP]->(receiver:Student)
-    RETURN receiver.first_name AS first_name, receiver.last_name AS last_name
-    """
-
-    requests = []
-    with driver.session(database=NEO4J_DATABASE) as session:
-        result = session.run(
-            query,
-            student_first_name=student_first_name,
-            student_last_name=student_last_name,
-        )
-        for record in result:
-            data = record.data()
-            requests.append(
-                {
-                    "first_name": str(data.get("first_name", "")),
-                    "last_name": str(data.get("last_name", "")),
-                }
-            )
+    snapshot = _snapshot(driver)
+    if snapshot is not None:
+        return snapshot.sent_requests(student_first_name, student_last_name)
 
-    return requests
+    return _names(_read(
+        driver,
+        SENT_FRIEND_REQUESTS_QUERY,
+        student_first_name=student_first_name,
+        student_last_name=student_last_name,
+    ))
 
 
 def get_subject_tutors_by_student_friends_path_length_to_that_tutor(
-    driver, student_first_name, student_last_name, subject, max_path_length, existing_tutors
+    driver,
+    student_first_name,
+    student_last_name,
+    subject,
+    max_path_length=RECOMMENDATION_MAX_PATH_LENGTH,
+    existing_tutors=None,
+    limit=RECOMMENDATION_LIMIT
 ):
     """
     Grąžina korepetitorius draugų tinkle, kurie dar nėra priskirti studentui.
     existing_tutors: list of "FirstName LastName" korepetitorių, kuriuos studentas jau turi
-    """
-    friends = get_friends(driver, student_first_name, student_last_name)
-    if not friends:
-        return None
 
-    query = f"""
-    MATCH (student:Student {{first_name: $student_first_name, last_name: $student_last_name}})
-    MATCH path = (student)-[:FRIENDS_WITH*1..{max_path_length}]-(friend:Student)-[teaches:TEACHES]-(tutor:Tutor)
-    WHERE $subject IN tutor.subjects
-      AND ALL(n IN nodes(path) WHERE single(x IN nodes(path) WHERE x = n))
-      AND NOT tutor.first_name + ' ' + tutor.last_name IN $existing_tutors
-    WITH tutor, 
-         path,
-         LENGTH(path) AS path_length,
-         tutor.first_name AS first_name,
-         tutor.last_name AS last_name,
-         [node IN nodes(path) | node.first_name + ' ' + node.last_name] AS path_names
-    WITH tutor, first_name, last_name,
-         MIN(path_length) AS min_path_length,
-         COLLECT(path_names)[0] AS example_path
-    RETURN ID(tutor) AS tutor_id,
-           first_name,
-           last_name,
-           min_path_length,
-           example_path
-    ORDER BY min_path_length, first_name, last_name
+    Draugų tinklas apeinamas platyn (BFS) iki max_path_length žingsnių: kiekvienas
+    mokinys aplankomas vieną kartą, trumpiausiu keliu (apoc.path.spanningTree),
+    todėl kelių nebeišvardijama. Kiekvienam korepetitoriui - trumpiausias kelias.
+    Viena užklausa (arba BFS grafo kopijoje atmintyje, jei ji įjungta).
     """
-
-    tutors = []
-    with driver.session(database=NEO4J_DATABASE) as session:
-        result = session.run(
-            query,
-            student_first_name=student_first_name,
-            student_last_name=student_last_name,
-            subject=subject,
-            existing_tutors=existing_tutors  # !!! perduodame parametrą
+    snapshot = _snapshot(driver)
+    if snapshot is not None:
+        tutors = snapshot.recommend_tutors(
+            student_first_name,
+            student_last_name,
+            subject,
+            max_path_length,
+            existing_tutors,
+            limit
         )
+        return tutors if tutors else None
+
+    rows = _read(
+        driver,
+        RECOMMEND_TUTORS_QUERY,
+        student_first_name=student_first_name,
+        student_last_name=student_last_name,
+        subject=subject,
+        max_path_length=max_path_length,
+        existing_tutors=existing_tutors or [],
+        limit=limit
+    )
 
-        for record in result:
-            data = record.data()
-            tutors.append(
-                {
-                    "tutor_id": str(data.get("tutor_id", "")),
-                    "first_name": str(data.get("first_name", "")),
-                    "last_name": str(data.get("last_name", "")),
-                    "path_length": data.get("min_path_length", 0),
-                    "path": data.get("example_path", []),
-                }
-            )
+    tutors = [
+        {
+            "tutor_id": str(data.get("tutor_id", "")),
+            "first_name": str(data.get("first_name", "")),
+            "last_name": str(data.get("last_name", "")),
+            "path_length": data.get("min_path_length", 0),
+            "path": data.get("example_path", []),
+        }
+        for data in rows
+    ]
     return tutors if tutors else None
 
-def search_students(driver, query_text, exclude_element_id=None):
-    query = """
-    MATCH (s:Student)
-    WHERE toLower(s.first_name) CONTAINS toLower($q)
-       OR toLower(s.last_name)  CONTAINS toLower($q)
-    {exclude_clause}
-    RETURN elementId(s) AS id,
-           s.first_name AS first_name,
-           s.last_name AS last_name,
-           s.class_num AS class_num,
-           s.school AS school
-    LIMIT 25
+def _fulltext_query(query_text: str) -> str:
+    """
+    Vartotojo tekstas -> Lucene užklausa: kiekvienas žodis kaip prefiksas
+    (jon*), o ilgesni - ir su viena klaida (jonas~1).
     """
+    terms = []
+    for term in fold_name(query_text).split():
+        term = LUCENE_SPECIAL.sub(r"\\\g<0>", term)
 
-    exclude_clause = ""
-    params = {"q": query_text}
+        if len(term) >= SEARCH_FUZZY_MIN_LENGTH:
+            terms.append(f"({term}* OR {term}~1)")
+        else:
+            terms.append(f"{term}*")
 
-    if exclude_element_id:
-        exclude_clause = "AND elementId(s) <> $exclude_id"
-        params["exclude_id"] = exclude_element_id
+    return " AND ".join(terms)
 
-    query = query.format(exclude_clause=exclude_clause)
 
-    results = []
-    with driver.session(database=NEO4J_DATABASE) as session:
-        data = session.run(query, **params)
-        for row in data:
-            row = row.data()
-            results.append(row)
+def _search_students_index(driver, query_text: str) -> list[dict]:
+    """ Paieška per full-text indeksą; rezultatai kešuojami trumpam (bendri visiems). """
+    lucene_query = _fulltext_query(query_text)
+    if not lucene_query:
+        return []
+
+    cache_key = f"search:students:{lucene_query}"
+    cached = redis_client.get(cache_key)
+    if cached is not None:
+        return json.loads(cached)
 
+    results = _read(
+        driver,
+        SEARCH_STUDENTS_QUERY,
+        index=STUDENT_NAME_FULLTEXT_INDEX,
+        q=lucene_query,
+        # Vienu daugiau - jei tarp ju bus pats ieskantysis
+        limit=SEARCH_LIMIT + 1
+    )
+
+    redis_client.set(cache_key, json.dumps(results), ex=SEARCH_CACHE_TTL)
     return results
 
 
+def search_students(driver, query_text, exclude_name=None):
+    """
+    Mokinių paieška pagal vardą/pavardę (prefiksas, be diakritikų, su klaida).
+    exclude_name ("Vardas Pavardė", kaip session['user_name']) - pats ieškantysis
+    mokinys, išmetamas jau po paieškos indekse (todėl kešas bendras).
+    """
+    results = []
+    for row in _search_students_index(driver, query_text):
+        if exclude_name and f"{row['first_name']} {row['last_name']}" == exclude_name:
+            continue
+
+        results.append(row)
+
+    return results[:SEARCH_LIMIT]
+
+
 if __name__ == "__main__":
     # python -m api.neo4j
     import os
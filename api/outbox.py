@@ -0,0 +1,490 @@
+"""
+Outbox: ClickHouse ir Neo4j sinchronizavimas fone.
+
+Maršrutas įrašo pagrindinį dokumentą į Mongo ir iškart po jo - įvykius į
+outbox kolekciją (publish_events), todėl vartotojas laukia tik Mongo.
+Fono darbuotojai (po vieną kiekvienai paskirčiai: clickhouse, neo4j) ima
+įvykius paketais _id tvarka, pritaiko juos ir pažymi atliktais.
+
+- Idempotentiškumas: įvykio raktas (key) unikalus, todėl tas pats įvykis
+  dukart neįdedamas; doroklės tikrina, ar įrašas jau yra (ClickHouse), arba
+  naudoja MERGE (Neo4j), todėl dar kartą pritaikytas įvykis (darbuotojas
+  nukrito prieš pažymėdamas) nieko nesugadina.
+- Pakartojimai: nepavykęs įvykis atidedamas (eksponentiškai), po
+  OUTBOX_MAX_ATTEMPTS lieka 'failed' (python -m api.outbox retry).
+- Tvarka: įvykis turi esybių sąrašą (entities, pvz. 'student:<id>'). Kol tos
+  pačios esybės ankstesnis įvykis neatliktas (laukia, vykdomas ar 'failed'),
+  vėlesni nepaimami - pvz. student_deleted nepralenks student_created.
+- Nuoma: paimtas įvykis kitiems procesams nematomas iki lease_until, nukritusio
+  darbuotojo įvykius po to perima kitas.
+- Vėlavimas: outbox_stats - laukiančių skaičius ir seniausio amžius.
+
+Darbuotojai paleidžiami kartu su programa (app/app.py), todėl po perkrovimo
+laukiantys įvykiai apdorojami iš karto. Atskirai:
+
+Naudojimas:
+    python -m api.outbox stats
+    python -m api.outbox run      # darbuotojai atskirame procese
+    python -m api.outbox retry    # 'failed' -> vėl 'pending'
+"""
+
+import argparse
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from pymongo import UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from api.connection import get_db, get_clickhouse_client, get_neo4j_driver
+from api.clickhouse_api import (
+    add_student_clickhouse,
+    add_tutor_clickhouse,
+    delete_student_clickhouse,
+    delete_tutor_clickhouse,
+    f_student_tutor_stat_add,
+    get_student_fk_clickhouse,
+    get_tutor_fk_clickhouse,
+    has_student_tutor_stat,
+    update_studied_with_tutor_to
+)
+from api.neo4j import register_student, set_student_tutor
+
+OUTBOX_COLLECTION = 'outbox'
+
+CLICKHOUSE_TARGET = 'clickhouse'
+NEO4J_TARGET = 'neo4j'
+TARGETS = (CLICKHOUSE_TARGET, NEO4J_TARGET)
+
+PENDING = 'pending'
+PROCESSING = 'processing'
+DONE = 'done'
+FAILED = 'failed'
+
+OUTBOX_BATCH = 50
+# Kiek paimamu ivykiu perziurim, ieskodami neuzblokuotu ankstesniu tos pacios esybes ivykiu
+OUTBOX_SCAN_LIMIT = 500
+OUTBOX_MAX_ATTEMPTS = 10
+OUTBOX_RETRY_BASE_DELAY = 2
+OUTBOX_RETRY_MAX_DELAY = 600
+OUTBOX_LEASE_SECONDS = 60
+OUTBOX_POLL_INTERVAL = 1
+# Jei seniausias apdorotas ivykis laukė ilgiau - rasom i zurnala
+OUTBOX_LAG_WARNING_SECONDS = 60
+
+_workers = {}
+_workers_pid = None
+_workers_lock = threading.Lock()
+
+# paskirtis -> {'processed', 'failed', 'last_batch_at', 'lag_seconds'} (tik sio proceso)
+_metrics = {target: {'processed': 0, 'failed': 0, 'last_batch_at': None, 'lag_seconds': None}
+            for target in TARGETS}
+
+
+# -------- Įvykių įdėjimas --------
+
+def _event_entities(event_type: str, payload: dict) -> list[str]:
+    """
+    Esybės, kurių įvykiai taikomi paeiliui: 'student:<id>', 'tutor:<id>'
+    (Neo4j įvykiai be id - pagal vardą ir pavardę).
+    """
+    entities = []
+    for role in ('student', 'tutor'):
+        if payload.get(f'{role}_id'):
+            entities.append(f"{role}:{payload[f'{role}_id']}")
+        elif payload.get(f'{role}_first_name'):
+            entities.append(f"{role}:{payload[f'{role}_first_name']} {payload[f'{role}_last_name']}")
+
+    # pvz. student_registered: {'first_name', 'last_name', ...}
+    if not entities and payload.get('first_name'):
+        role = event_type.split('_', 1)[0]
+        entities.append(f"{role}:{payload['first_name']} {payload['last_name']}")
+
+    return entities
+
+
+def outbox_event(target: str, event_type: str, payload: dict, key: str = None) -> dict:
+    """
+    Outbox dokumentas. key - idempotentiškumo raktas (pvz. 'student_created:<id>');
+    jei nenurodytas, kiekvienas įvykis laikomas atskiru.
+    """
+    if target not in TARGETS:
+        raise ValueError(f"Nežinoma outbox paskirtis: {target}")
+
+    now = datetime.utcnow()
+    return {
+        'key': f"{target}:{key or f'{event_type}:{uuid4()}'}",
+        'target': target,
+        'type': event_type,
+        'payload': payload,
+        'entities': _event_entities(event_type, payload),
+        'status': PENDING,
+        'attempts': 0,
+        'created_at': now,
+        'available_at': now,
+    }
+
+
+def publish_events(outbox_collection, events: list[dict]) -> int:
+    """ Įdeda įvykius (vienas kreipinys). Jau įdėti (tas pats key) praleidžiami. """
+    if not events:
+        return 0
+
+    try:
+        return len(outbox_collection.insert_many(events, ordered=False).inserted_ids)
+    except BulkWriteError as e:
+        # 11000 - toks key jau yra, tai ne klaida
+        if any(error['code'] != 11000 for error in e.details['writeErrors']):
+            raise
+        return e.details['nInserted']
+
+
+# -------- Doroklės --------
+
+def _student_created(payload: dict):
+    client = get_clickhouse_client()
+    if get_student_fk_clickhouse(client, payload['student_id'], get_db()) is not None:
+        return
+
+    add_student_clickhouse(
+        client,
+        payload['first_name'],
+        payload['last_name'],
+        payload['class'],
+        payload['school'],
+        payload['date_of_birth'],
+        student_id=payload['student_id']
+    )
+
+
+def _tutor_created(payload: dict):
+    client = get_clickhouse_client()
+    if get_tutor_fk_clickhouse(client, payload['tutor_id'], get_db()) is not None:
+        return
+
+    add_tutor_clickhouse(
+        client,
+        payload['first_name'],
+        payload['last_name'],
+        payload['date_of_birth'],
+        tutor_id=payload['tutor_id']
+    )
+
+
+def _student_deleted(payload: dict):
+    delete_student_clickhouse(
+        get_clickhouse_client(),
+        payload['first_name'],
+        payload['last_name'],
+        student_id=payload.get('student_id')
+    )
+
+
+def _tutor_deleted(payload: dict):
+    delete_tutor_clickhouse(
+        get_clickhouse_client(),
+        payload['first_name'],
+        payload['last_name'],
+        tutor_id=payload.get('tutor_id')
+    )
+
+
+def _student_tutor_assigned(payload: dict):
+    client, db = get_clickhouse_client(), get_db()
+    if has_student_tutor_stat(client, payload['student_id'], payload['tutor_id'], payload['subject'], db):
+        return
+
+    f_student_tutor_stat_add(
+        client,
+        payload['student_id'],
+        payload['tutor_id'],
+        payload['subject'],
+        db=db,
+        rating=payload.get('rating'),
+        lessons=payload.get('lessons'),
+        date=payload.get('date')
+    )
+
+
+def _student_tutor_removed(payload: dict):
+    update_studied_with_tutor_to(get_clickhouse_client(), payload['student_id'], payload['tutor_id'], db=get_db())
+
+
+def _student_registered(payload: dict):
+    register_student(
+        get_neo4j_driver(),
+        payload['first_name'],
+        payload['last_name'],
+        payload.get('class'),
+        school_name=payload.get('school'),
+        tutors=payload.get('tutors', [])
+    )
+
+
+def _student_tutor_linked(payload: dict):
+    set_student_tutor(
+        get_neo4j_driver(),
+        payload['student_first_name'],
+        payload['student_last_name'],
+        payload['tutor_first_name'],
+        payload['tutor_last_name']
+    )
+
+
+# (paskirtis, tipas) -> doroklė(payload)
+HANDLERS = {
+    (CLICKHOUSE_TARGET, 'student_created'): _student_created,
+    (CLICKHOUSE_TARGET, 'tutor_created'): _tutor_created,
+    (CLICKHOUSE_TARGET, 'student_deleted'): _student_deleted,
+    (CLICKHOUSE_TARGET, 'tutor_deleted'): _tutor_deleted,
+    (CLICKHOUSE_TARGET, 'student_tutor_assigned'): _student_tutor_assigned,
+    (CLICKHOUSE_TARGET, 'student_tutor_removed'): _student_tutor_removed,
+    (NEO4J_TARGET, 'student_registered'): _student_registered,
+    (NEO4J_TARGET, 'student_tutor_linked'): _student_tutor_linked,
+}
+
+
+# -------- Darbuotojai --------
+
+def _claimable(target: str, now: datetime) -> dict:
+    return {
+        'target': target,
+        '$or': [
+            {'status': PENDING, 'available_at': {'$lte': now}},
+            # Nukritusio darbuotojo ivykiai
+            {'status': PROCESSING, 'lease_until': {'$lt': now}},
+        ]
+    }
+
+
+def _blocked_ids(outbox_collection, target: str, candidates: list[dict]) -> set:
+    """
+    Kandidatai, kurių esybė turi ankstesnį neatliktą įvykį (įskaitant kitus
+    kandidatus) - juos imti dar negalima.
+    """
+    entities = {entity for doc in candidates for entity in doc.get('entities', [])}
+    if not entities:
+        return set()
+
+    # esybe -> maziausias neatlikto ivykio _id
+    first_open = {}
+    for doc in outbox_collection.find(
+        {
+            'target': target,
+            'entities': {'$in': list(entities)},
+            'status': {'$in': [PENDING, PROCESSING, FAILED]},
+            '_id': {'$lte': candidates[-1]['_id']},
+        },
+        {'_id': 1, 'entities': 1}
+    ).sort('_id', 1):
+        for entity in doc['entities']:
+            first_open.setdefault(entity, doc['_id'])
+
+    return {
+        doc['_id'] for doc in candidates
+        if any(first_open.get(entity, doc['_id']) < doc['_id'] for entity in doc.get('entities', []))
+    }
+
+
+def claim_batch(outbox_collection, target: str, limit: int = OUTBOX_BATCH) -> list[dict]:
+    """
+    Paima iki limit įvykių (_id tvarka) šiam darbuotojui. Įvykiai, kurių esybė
+    turi ankstesnį neatliktą įvykį, praleidžiami. update_many sąlygą tikrina
+    kiekvienam dokumentui atomiškai, todėl kito jau paimti praleidžiami.
+    """
+    now = datetime.utcnow()
+    claimable = _claimable(target, now)
+
+    candidates = list(
+        outbox_collection.find(claimable, {'_id': 1, 'entities': 1})
+        .sort('_id', 1)
+        .limit(OUTBOX_SCAN_LIMIT)
+    )
+    if not candidates:
+        return []
+
+    blocked = _blocked_ids(outbox_collection, target, candidates)
+    ids = [doc['_id'] for doc in candidates if doc['_id'] not in blocked][:limit]
+    if not ids:
+        return []
+
+    lease = str(uuid4())
+    outbox_collection.update_many(
+        {'_id': {'$in': ids}, **claimable},
+        {'$set': {
+            'status': PROCESSING,
+            'lease': lease,
+            'lease_until': now + timedelta(seconds=OUTBOX_LEASE_SECONDS)
+        }}
+    )
+
+    return list(outbox_collection.find({'lease': lease}).sort('_id', 1))
+
+
+def _retry_delay(attempts: int) -> float:
+    return min(OUTBOX_RETRY_BASE_DELAY * 2 ** (attempts - 1), OUTBOX_RETRY_MAX_DELAY)
+
+
+def process_batch(outbox_collection, target: str, events: list[dict]) -> tuple[int, int]:
+    """
+    Pritaiko įvykius ir vienu bulk_write pažymi rezultatus.
+    Grąžina (pavyko, nepavyko).
+    """
+    now = datetime.utcnow()
+    done_ids, operations = [], []
+
+    for event in events:
+        try:
+            HANDLERS[(target, event['type'])](event['payload'])
+            done_ids.append(event['_id'])
+
+        except Exception as e:
+            attempts = event.get('attempts', 0) + 1
+            failed = attempts >= OUTBOX_MAX_ATTEMPTS
+            print(f"Outbox {target}/{event['type']} nepavyko ({attempts}/{OUTBOX_MAX_ATTEMPTS}): {e}")
+
+            operations.append(UpdateOne(
+                {'_id': event['_id'], 'lease': event['lease']},
+                {
+                    '$set': {
+                        'status': FAILED if failed else PENDING,
+                        'attempts': attempts,
+                        'available_at': datetime.utcnow() + timedelta(seconds=_retry_delay(attempts)),
+                        'last_error': str(e),
+                    },
+                    '$unset': {'lease': '', 'lease_until': ''}
+                }
+            ))
+
+    if done_ids:
+        operations.append(UpdateMany(
+            {'_id': {'$in': done_ids}},
+            {
+                '$set': {'status': DONE, 'processed_at': now},
+                '$unset': {'lease': '', 'lease_until': ''}
+            }
+        ))
+
+    if operations:
+        outbox_collection.bulk_write(operations, ordered=False)
+
+    metrics = _metrics[target]
+    metrics['processed'] += len(done_ids)
+    metrics['failed'] += len(events) - len(done_ids)
+    metrics['last_batch_at'] = now
+    metrics['lag_seconds'] = (now - min(event['created_at'] for event in events)).total_seconds()
+
+    if metrics['lag_seconds'] > OUTBOX_LAG_WARNING_SECONDS:
+        print(f"Outbox {target}: vėluojama {metrics['lag_seconds']:.0f} s")
+
+    return len(done_ids), len(events) - len(done_ids)
+
+
+def run_outbox_worker(outbox_collection, target: str, stop_event: threading.Event = None):
+    """ Darbuotojo ciklas: paketas po paketo, kol yra įvykių, tada laukia. """
+    while stop_event is None or not stop_event.is_set():
+        try:
+            events = claim_batch(outbox_collection, target)
+            if events:
+                process_batch(outbox_collection, target, events)
+                continue
+
+        except Exception as e:
+            print(f"Outbox {target} darbuotojo klaida: {e}")
+
+        time.sleep(OUTBOX_POLL_INTERVAL)
+
+
+def start_outbox_workers(outbox_collection) -> dict:
+    """ Paleidžia po vieną darbuotoją kiekvienai paskirčiai (vieną kartą procesui; po fork() - iš naujo). """
+    global _workers_pid
+
+    with _workers_lock:
+        if _workers_pid != os.getpid():
+            _workers.clear()
+            _workers_pid = os.getpid()
+
+        for target in TARGETS:
+            worker = _workers.get(target)
+            if worker is not None and worker.is_alive():
+                continue
+
+            worker = threading.Thread(
+                target=run_outbox_worker,
+                args=(outbox_collection, target),
+                name=f"outbox-{target}-{socket.gethostname()}",
+                daemon=True
+            )
+            worker.start()
+            _workers[target] = worker
+
+    return _workers
+
+
+# -------- Stebėjimas --------
+
+def outbox_stats(outbox_collection) -> dict:
+    """
+    {paskirtis: {'pending', 'processing', 'failed', 'lag_seconds' - seniausio
+    neapdoroto įvykio amžius, 'worker' - šio proceso darbuotojo skaitikliai}}
+    """
+    now = datetime.utcnow()
+    stats = {
+        target: {PENDING: 0, PROCESSING: 0, FAILED: 0, 'lag_seconds': 0, 'worker': dict(_metrics[target])}
+        for target in TARGETS
+    }
+
+    pipeline = [
+        {'$match': {'status': {'$in': [PENDING, PROCESSING, FAILED]}}},
+        {'$group': {
+            '_id': {'target': '$target', 'status': '$status'},
+            'count': {'$sum': 1},
+            'oldest': {'$min': '$created_at'}
+        }}
+    ]
+
+    for row in outbox_collection.aggregate(pipeline):
+        target_stats = stats.setdefault(row['_id']['target'], {})
+        target_stats[row['_id']['status']] = row['count']
+
+        if row['_id']['status'] != FAILED:
+            lag = (now - row['oldest']).total_seconds()
+            target_stats['lag_seconds'] = max(target_stats.get('lag_seconds', 0), lag)
+
+    return stats
+
+
+def retry_failed(outbox_collection, target: str = None) -> int:
+    """ 'failed' įvykius grąžina į eilę. Grąžina jų skaičių. """
+    query = {'status': FAILED}
+    if target:
+        query['target'] = target
+
+    result = outbox_collection.update_many(
+        query,
+        {'$set': {'status': PENDING, 'attempts': 0, 'available_at': datetime.utcnow()}}
+    )
+    return result.modified_count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Outbox (ClickHouse, Neo4j) valdymas")
+    parser.add_argument('command', nargs='?', default='stats', choices=['stats', 'run', 'retry'])
+    parser.add_argument('--target', choices=TARGETS)
+    args = parser.parse_args()
+
+    outbox = get_db()[OUTBOX_COLLECTION]
+
+    if args.command == 'stats':
+        for target, target_stats in outbox_stats(outbox).items():
+            print(f"{target}: {target_stats}")
+
+    elif args.command == 'retry':
+        print(f"Grąžinta į eilę: {retry_failed(outbox, args.target)}")
+
+    else:
+        for worker in start_outbox_workers(outbox).values():
+            worker.join()
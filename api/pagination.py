@@ -0,0 +1,83 @@
+"""
+Puslapiavimas pagal raktą (keyset): rikiuojama pagal (first_name, last_name, _id),
+o kitas puslapis prasideda po paskutinio grąžinto įrašo, todėl nereikia skip()
+ir kiekvienas puslapis kainuoja tiek pat, kiek pirmas (indeksas name,
+žr. model/indexes.py).
+
+Žymeklis (after) - paskutinio įrašo rakto JSON, užkoduotas base64.
+"""
+
+import base64
+import binascii
+import json
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+NAME_SORT = [('first_name', 1), ('last_name', 1), ('_id', 1)]
+
+
+def parse_page_size(page_size) -> int:
+    """ page_size iš užklausos -> skaičius [1, MAX_PAGE_SIZE]. """
+    if page_size in (None, ''):
+        return PAGE_SIZE
+
+    try:
+        page_size = int(page_size)
+    except (TypeError, ValueError):
+        raise ValueError('page_size turi būti skaičius')
+
+    return max(1, min(page_size, MAX_PAGE_SIZE))
+
+
+def encode_cursor(doc: dict) -> str:
+    key = [doc.get('first_name'), doc.get('last_name'), str(doc['_id'])]
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(after: str) -> tuple:
+    try:
+        first_name, last_name, doc_id = json.loads(base64.urlsafe_b64decode(after.encode('ascii')))
+        return first_name, last_name, ObjectId(doc_id)
+    except (ValueError, TypeError, InvalidId, binascii.Error):
+        raise ValueError('Netinkamas puslapio žymeklis (after)')
+
+
+def _after_query(after: str) -> dict:
+    """ Įrašai, esantys po žymeklio pagal NAME_SORT. """
+    first_name, last_name, doc_id = decode_cursor(after)
+
+    return {'$or': [
+        {'first_name': {'$gt': first_name}},
+        {'first_name': first_name, 'last_name': {'$gt': last_name}},
+        {'first_name': first_name, 'last_name': last_name, '_id': {'$gt': doc_id}}
+    ]}
+
+
+def list_page_by_name(collection, projection: dict, page_size=None, after: str = None) -> dict:
+    """
+    Grąžina {'items': [...], 'next': žymeklis arba None, 'total_estimate': n}.
+    Imamas vienas įrašas daugiau, kad žinotume, ar yra kitas puslapis.
+    """
+    page_size = parse_page_size(page_size)
+    query = _after_query(after) if after else {}
+
+    cursor = (
+        collection.find(query, projection)
+        .sort(NAME_SORT)
+        .limit(page_size + 1)
+        .batch_size(page_size + 1)
+    )
+
+    docs = list(cursor)
+    items = docs[:page_size]
+
+    return {
+        'items': items,
+        'next': encode_cursor(items[-1]) if len(docs) > page_size else None,
+        # Is metaduomenu, be kolekcijos skenavimo
+        'total_estimate': collection.estimated_document_count()
+    }
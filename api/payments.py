@@ -1,15 +1,23 @@
-from cassandra_db.cassandra_client import get_cassandra_session
 from cassandra.cluster import Session
+from cassandra_db.statements import PAYMENT_TABLES, get_statement, execute_writes
 
 import time
+from collections import deque
+from heapq import merge
 from datetime import datetime, timezone
 from uuid import uuid4
 from decimal import *
 getcontext().prec = 3 # Nustato precision decimal tipui
 
-from api.utils import get_student_name
-from api.tutor import get_tutor_by_id
-from api.connection import get_db
+from api.tutor import get_tutor_name_index
+from api.connection import get_db, get_cassandra_session
+
+UNKNOWN_TUTOR = "Neįvardytas/buvęs korepetitorius"
+UNKNOWN_STUDENT = "Neįvardytas/buvęs mokinys"
+
+# by_amount skaitymas: kiek particiju uzklausiama vienu metu ir eiluciu puslapio dydis
+PAYMENTS_MAX_IN_FLIGHT = 8
+PAYMENTS_FETCH_SIZE = 500
 
 def create_payment(
     cassandra_session: Session,
@@ -31,23 +39,16 @@ def create_payment(
     # Generate a new UUID for the id column
     payment_id = uuid4()
 
-    # Prepare the CQL insert statements with placeholders FOR EACH TABLE
-    tables = ['tutor_by_student_time', 'student_by_tutor_time', 'by_amount']
-    cql_inserts = [f"""INSERT INTO payments.{table} (
-            id, tutor_id, student_id, payment_group, payment, time_payment, is_complete
-        ) VALUES (%s, %s, %s, %s, %s, %s, %s)
-        """
-        for table in tables]
-
     # Bind values to parameters
     # payment_group reikalingas bucketing, nes viename is table turim tai kaip partition key 
     payment_group = int( float(payment) / 10 )
     payment = Decimal(payment).quantize(Decimal('0.001'))
     params = (payment_id, tutor_id, student_id, payment_group, payment, utc_time, True)
     
-    # Execute the query
-    for cql_insert in cql_inserts:
-        cassandra_session.execute(cql_insert, params)
+    # Visos trys kopijos rasomos lygiagreciai paruostomis uzklausomis
+    execute_writes(cassandra_session, [
+        (f'insert_payment_{table}', params) for table in PAYMENT_TABLES
+    ])
 
     # Invalidate cache
     invalidate_tutor_pay_cache(tutor_id)
@@ -63,23 +64,23 @@ def read_payments_to_tutor(
     Read all payments made to tutor, order by time and student_id by default.
     Converts from UTC to local time.
     """
-
-    # Read payments from query
-    query = f"""
-    SELECT * FROM payments.tutor_by_student_time WHERE tutor_id = '{tutor_id}';
-    """
+    # Stulpelis text - ObjectId paruosta uzklausa nepriima
+    tutor_id = str(tutor_id)
 
     # Get the payments
-    rows = cassandra_session.execute(query)
+    rows = cassandra_session.execute(
+        get_statement(cassandra_session, 'select_payments_to_tutor'), (tutor_id,)
+    )
 
+    rows = list(rows)
     if not rows:
         return []
 
     return_rows = []
-    tutor = get_tutor_by_id(tutor_collection, tutor_id)
+    _, student_names = get_tutor_name_index(tutor_collection, [tutor_id])
     for row in rows:
         # get student name from tutor info
-        student_name = get_student_name(tutor['students_subjects'], row.student_id)
+        student_name = student_names.get((tutor_id, row.student_id), UNKNOWN_STUDENT)
 
         # get payment info
         return_rows.append({
@@ -101,70 +102,110 @@ def read_payments_from_student(
     Read all payments made to tutor, order by time and student_id by default.
     Converts from UTC to local time.
     """
-
-    # Read payments from query
-    query = f"""
-    SELECT * FROM payments.student_by_tutor_time WHERE student_id = '{student_id}';
-    """
+    # Stulpelis text - ObjectId paruosta uzklausa nepriima
+    student_id = str(student_id)
 
     # Get the payments
-    rows = cassandra_session.execute(query)
+    rows = cassandra_session.execute(
+        get_statement(cassandra_session, 'select_payments_from_student'), (student_id,)
+    )
 
+    rows = list(rows)
     if not rows:
         return []
 
+    # Visi korepetitoriai paimami viena uzklausa
+    tutor_names, _ = get_tutor_name_index(
+        tutor_collection, [row.tutor_id for row in rows]
+    )
+
     return_rows = []
 
     for row in rows:
-        # get student name from tutor info
-        tutor = get_tutor_by_id(tutor_collection, row.tutor_id)
-
         # get payment info
         return_rows.append({
             'time_payment': row.time_payment,
             'payment': row.payment,
-            'tutor': f"{tutor['first_name']} {tutor['last_name']}" 
+            'tutor': tutor_names.get(row.tutor_id, UNKNOWN_TUTOR)
         })
 
     # Convert to local time
     return return_rows
 
 
+def iter_payment_partitions(
+    cassandra_session: Session,
+    payment_min: float,
+    payment_max: float,
+    max_in_flight: int = PAYMENTS_MAX_IN_FLIGHT
+):
+    """
+    Read payments.by_amount partitions between payment_min and payment_max concurrently.
+    At most max_in_flight partition queries run at once, each partition is paged.
+    Yields each partition's rows (newest first) as soon as the partition is read.
+    """
+
+    statement = get_statement(cassandra_session, 'select_payments_by_amount')
+
+    # Paruostai uzklausai decimal stulpelis turi gauti Decimal, ne float
+    payment_bounds = (Decimal(str(payment_min)), Decimal(str(payment_max)))
+
+    # Nustatom per kurias particijas praeiti
+    pay_groups = iter(range(int(payment_min / 10), int(payment_max / 10) + 1))
+    in_flight = deque()
+
+    def submit_next():
+        pay_group = next(pay_groups, None)
+        if pay_group is not None:
+            bound = statement.bind((pay_group, *payment_bounds))
+            bound.fetch_size = PAYMENTS_FETCH_SIZE
+            in_flight.append(cassandra_session.execute_async(bound))
+
+    for _ in range(max_in_flight):
+        submit_next()
+
+    while in_flight:
+        result = in_flight.popleft().result()
+
+        # Kol skaitom sios particijos puslapius, kita particija jau uzklausiama
+        submit_next()
+
+        rows = list(result.current_rows)
+        while result.has_more_pages:
+            result.fetch_next_page()
+            rows.extend(result.current_rows)
+
+        # by_amount particija rikiuota pagal suma, todel laiko tvarka sudarom patys
+        rows.sort(key=lambda row: row.time_payment, reverse=True)
+        yield rows
+
+
 def list_payments(
     cassandra_session: Session,
     tutor_collection,
     payment_min: float,
     payment_max: float
 ) -> list:
+    """ List payments between payment_min and payment_max, newest first. """
 
-    # Nustatom per kurias particijas praeiti
-    payment_partition_min = int(payment_min / 10)
-    payment_partition_max = int(payment_max / 10)
-
-    # Praeinam per particijas
-    all_rows = []
-    for pay_group in range(payment_partition_min, payment_partition_max+1):
-
-        query = f"""
-            SELECT * FROM payments.by_amount
-            WHERE payment_group = {pay_group} AND
-                payment > {payment_min} AND payment < {payment_max}
-        """
+    # Particijos jau surikiuotos, tad jas tik suliejam (k-way merge)
+    all_rows = list(merge(
+        *iter_payment_partitions(cassandra_session, payment_min, payment_max),
+        key=lambda row: row.time_payment,
+        reverse=True
+    ))
 
-        rows = cassandra_session.execute(query)
-        all_rows.extend( list(rows) )
+    # Vardus sujungiam atmintyje, o ne po viena Mongo uzklausa kiekvienai eilutei
+    tutor_names, student_names = get_tutor_name_index(
+        tutor_collection, [row.tutor_id for row in all_rows]
+    )
 
     all_rows_w_names = []
     for row in all_rows:
 
-        tutor = get_tutor_by_id(tutor_collection, row.tutor_id)
-        tutor_name = f"{tutor['first_name']} {tutor['last_name']}"
-
-        student_name = get_student_name(tutor['students_subjects'], row.student_id)
-
         new_row = {
-            'tutor_name': tutor_name,
-            'student_name': student_name,
+            'tutor_name': tutor_names.get(row.tutor_id, UNKNOWN_TUTOR),
+            'student_name': student_names.get((row.tutor_id, row.student_id), UNKNOWN_STUDENT),
             'time_payment': row.time_payment,
             'payment': row.payment
         }
@@ -0,0 +1,332 @@
+"""
+Atsiliepimų skaitliukai (atsiliepimų skaičius, įvertinimų suma ir kiekis).
+
+Skaitliukai keičiami kuriant ir atšaukiant atsiliepimą (create_review,
+revoke_review), todėl skaitant nieko nebereikia agreguoti:
+    - Mongo kolekcija review_stats - patvarus šešėlis ($inc), _id = "tutor:<id>"
+      arba "student:<id>"
+    - Redis hash review_stats:<role>:<id> - greitas skaitymas (HINCRBY)
+
+Redis hash'e skaitliukai didinami tik jei jie jau yra; jei jų nėra, jie
+užpildomi iš Mongo šešėlio skaitant. Kaip api/calendar_cache.py: kiekvienas
+pakeitimas padidina hash'o gen, o skaitytojas įrašo tik jei gen nepasikeitė
+nuo jo HGETALL - taip senas šešėlio skaitymas neperrašo naujesnio pakeitimo.
+Agregacija per visą review kolekciją vykdoma tik reconcile_review_stats
+(saugu ir veikiant programai): python -m api.review_stats
+Pirmą kartą šešėlis užpildomas model/model_init.py ir paleidžiant programą
+(backfill_review_stats - tik jei review_stats tuščia).
+"""
+
+from bson import ObjectId
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError
+
+from api.connection import get_redis
+
+REVIEW_STATS_COLLECTION = 'review_stats'
+REVIEW_STATS_TTL = 24 * 3600
+# Kiek kartu perskaiciuoti skaitliukus, pasikeitusius perskaiciavimo metu
+RECONCILE_PASSES = 3
+
+TUTOR_ROLE = 'tutor'
+STUDENT_ROLE = 'student'
+
+r = get_redis()
+
+STATS_FIELDS = ('count', 'rating_sum', 'rating_count')
+
+# Didinam tik jau esancius skaitliukus - kitaip trukstamas hash'as
+# prasidetu nuo 0 ir rodytu tik pokyti. gen didinamas visada - vykstantis
+# uzpildymas is Mongo savo (galbut seno) skaitymo nebeiras
+_increment_stats = r.register_script("""
+redis.call('HINCRBY', KEYS[1], 'gen', 1)
+if redis.call('HEXISTS', KEYS[1], 'count') == 1 then
+    redis.call('HINCRBY', KEYS[1], 'count', ARGV[1])
+    redis.call('HINCRBYFLOAT', KEYS[1], 'rating_sum', ARGV[2])
+    redis.call('HINCRBY', KEYS[1], 'rating_count', ARGV[3])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+""")
+
+# Irasom tik jei tarp skaitymo ir irasymo niekas nepakeite skaitliuku
+_store_if_current = r.register_script("""
+local gen = redis.call('HGET', KEYS[1], 'gen') or '0'
+if gen ~= ARGV[1] then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'count', ARGV[2], 'rating_sum', ARGV[3], 'rating_count', ARGV[4], 'gen', gen)
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return 1
+""")
+
+
+def review_stats_key(role: str, user_id: str) -> str:
+    return f"review_stats:{role}:{user_id}"
+
+
+def get_stats_collection(review_collection):
+    """ Šešėlio kolekcija toje pačioje duomenų bazėje kaip review. """
+    return review_collection.database[REVIEW_STATS_COLLECTION]
+
+
+def _review_subject(review_doc: dict) -> tuple[str, str]:
+    """ Kam skirtas atsiliepimas: for_tutor - dėstytojui, kitaip - mokiniui. """
+    if review_doc['for_tutor']:
+        return TUTOR_ROLE, str(review_doc['tutor']['tutor_id'])
+
+    return STUDENT_ROLE, str(review_doc['student']['student_id'])
+
+
+def _has_rating(review_doc: dict) -> bool:
+    rating = review_doc.get('rating')
+    return isinstance(rating, (int, float)) and not isinstance(rating, bool)
+
+
+def record_review_change(review_collection, review_doc: dict, sign: int):
+    """
+    Pakeičia skaitliukus: sign = 1 sukūrus atsiliepimą, -1 jį atšaukus.
+    Pirma atnaujinamas Mongo šešėlis, tada (jei yra) Redis hash'as.
+    """
+    role, user_id = _review_subject(review_doc)
+
+    rating_sum = review_doc['rating'] * sign if _has_rating(review_doc) else 0
+    rating_count = sign if _has_rating(review_doc) else 0
+
+    get_stats_collection(review_collection).update_one(
+        {'_id': f"{role}:{user_id}"},
+        {
+            '$inc': {'count': sign, 'rating_sum': rating_sum, 'rating_count': rating_count},
+            '$setOnInsert': {'role': role, 'user_id': user_id},
+            # reconcile_review_stats neperraso veliau pakeistu skaitliuku
+            '$currentDate': {'updated_at': True}
+        },
+        upsert=True
+    )
+
+    try:
+        _increment_stats(
+            keys=[review_stats_key(role, user_id)],
+            args=[sign, rating_sum, rating_count, REVIEW_STATS_TTL]
+        )
+    except Exception as e:
+        # Redis'e pasenusi reiksme - geriau ja ismesti ir perskaityti is Mongo
+        print(f"Nepavyko atnaujinti Redis skaitliuku {role} {user_id}: {e}")
+        forget_cached_stats(r, role, user_id)
+
+
+def forget_cached_stats(pipe, role: str, user_id: str):
+    """ Ištrina skaitliukus iš Redis, bet padidina gen (ne DEL - tada gen grįžtų į 0). """
+    key = review_stats_key(role, user_id)
+    pipe.hincrby(key, 'gen', 1)
+    pipe.hdel(key, *STATS_FIELDS)
+    pipe.expire(key, REVIEW_STATS_TTL)
+
+
+def parse_review_stats(stats: dict) -> dict:
+    """ Redis/Mongo reikšmės -> {'count', 'rating_sum', 'rating_count'}. """
+    return {
+        'count': int(stats.get('count', 0)),
+        'rating_sum': float(stats.get('rating_sum', 0)),
+        'rating_count': int(stats.get('rating_count', 0))
+    }
+
+
+def load_review_stats(review_collection, role: str, user_id: str) -> dict:
+    """ Skaitliukai iš Mongo šešėlio (jei dokumento nėra - atsiliepimų nėra). """
+    stats_doc = get_stats_collection(review_collection).find_one(
+        {'_id': f"{role}:{user_id}"}
+    )
+    return parse_review_stats(stats_doc or {})
+
+
+def cached_review_stats(cached: dict):
+    """ HGETALL rezultatas -> skaitliukai arba None, jei jų Redis'e nėra (gali būti tik gen). """
+    return parse_review_stats(cached) if 'count' in cached else None
+
+
+def cache_review_stats(pipe, role: str, user_id: str, stats: dict, gen: str):
+    """
+    Įdeda skaitliukus į Redis (pipeline arba klientas), jei gen - toks pat kaip
+    skaitant HGETALL (prieš load_review_stats).
+    """
+    _store_if_current(
+        keys=[review_stats_key(role, user_id)],
+        args=[gen, stats['count'], stats['rating_sum'], stats['rating_count'], REVIEW_STATS_TTL],
+        client=pipe
+    )
+
+
+def get_review_stats(review_collection, role: str, user_id: str) -> dict:
+    """ Skaitliukai iš Redis, o jei jų nėra - iš Mongo šešėlio. """
+    cached = r.hgetall(review_stats_key(role, user_id))
+    stats = cached_review_stats(cached)
+    if stats is not None:
+        return stats
+
+    stats = load_review_stats(review_collection, role, user_id)
+    cache_review_stats(r, role, user_id, stats, cached.get('gen', '0'))
+
+    return stats
+
+
+def average_rating(stats: dict):
+    """ Vidutinis įvertinimas arba None, jei įvertinimų nėra. """
+    if stats['rating_count'] <= 0:
+        return None
+
+    return stats['rating_sum'] / stats['rating_count']
+
+
+def _server_time(review_collection):
+    """ Mongo serverio laikas - tas pats laikrodis kaip $currentDate. """
+    return review_collection.database.command('hello')['localTime']
+
+
+def _reconcile_match(stats_ids) -> dict:
+    """ Galiojantys atsiliepimai; jei stats_ids nurodyti - tik tų skaitliukų. """
+    match = {
+        "$or": [
+            {"type": {"$exists": False}},
+            {"type": {"$ne": "REVOKED"}}
+        ]
+    }
+    if stats_ids is None:
+        return match
+
+    user_ids = {TUTOR_ROLE: [], STUDENT_ROLE: []}
+    for stats_id in stats_ids:
+        role, user_id = stats_id.split(':', 1)
+        user_ids[role].append(ObjectId(user_id))
+
+    return {
+        "$and": [
+            match,
+            {
+                "$or": [
+                    {"for_tutor": True, "tutor.tutor_id": {"$in": user_ids[TUTOR_ROLE]}},
+                    {"for_tutor": {"$ne": True}, "student.student_id": {"$in": user_ids[STUDENT_ROLE]}}
+                ]
+            }
+        ]
+    }
+
+
+def _reconcile_pass(review_collection, stats_ids=None) -> tuple[int, list]:
+    """
+    Vienas perskaičiavimas (visų arba tik stats_ids skaitliukų).
+    Perrašomi ir trinami tik dokumentai, nepakeisti nuo agregacijos pradžios -
+    lygiagretūs record_review_change $inc neperrašomi. Tokie id grąžinami
+    kaip praleisti, kad juos būtų galima perskaičiuoti dar kartą.
+    """
+    stats_collection = get_stats_collection(review_collection)
+    started = _server_time(review_collection)
+    unchanged = {
+        '$or': [
+            {'updated_at': {'$lt': started}},
+            {'updated_at': {'$exists': False}}
+        ]
+    }
+
+    aggregate_output_cursor = review_collection.aggregate([
+        {"$match": _reconcile_match(stats_ids)},
+        {
+            "$group": {
+                "_id": {
+                    "$cond": [
+                        "$for_tutor",
+                        {"$concat": ["tutor:", {"$toString": "$tutor.tutor_id"}]},
+                        {"$concat": ["student:", {"$toString": "$student.student_id"}]}
+                    ]
+                },
+                "count": {"$sum": 1},
+                # $sum praleidžia ne skaičius (pvz. rating = None)
+                "rating_sum": {"$sum": "$rating"},
+                "rating_count": {"$sum": {"$cond": [{"$isNumber": "$rating"}, 1, 0]}}
+            }
+        }
+    ])
+
+    operations, found_ids = [], []
+    for stats_doc in aggregate_output_cursor:
+        role, user_id = stats_doc['_id'].split(':', 1)
+        found_ids.append(stats_doc['_id'])
+        operations.append(ReplaceOne(
+            {'_id': stats_doc['_id'], **unchanged},
+            stats_doc | {'role': role, 'user_id': user_id, 'updated_at': started},
+            upsert=True
+        ))
+
+    skipped = set()
+    if operations:
+        try:
+            stats_collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # 11000 - dokumentas pasikeite po started, upsert bande iterpti ta pati _id
+            for error in e.details['writeErrors']:
+                if error['code'] != 11000:
+                    raise
+                skipped.add(found_ids[error['index']])
+
+    # Neliko nei vieno galiojancio atsiliepimo (tik jei skaitliukas nepasikeite)
+    scope = {'$nin': found_ids}
+    if stats_ids is not None:
+        scope['$in'] = list(stats_ids)
+
+    stats_collection.delete_many({'_id': scope, **unchanged})
+    skipped.update(
+        doc['_id'] for doc in stats_collection.find(
+            {'_id': scope, 'updated_at': {'$gte': started}}, {'_id': 1}
+        )
+    )
+
+    return len(operations) - len(skipped & set(found_ids)), sorted(skipped)
+
+
+def reconcile_review_stats(review_collection) -> int:
+    """
+    Perskaičiuoja skaitliukus iš review kolekcijos ir pataiso šešėlį.
+    Saugu vykdyti veikiant programai: skaitliukai, pakeisti perskaičiavimo
+    metu, perskaičiuojami dar kartą (iki RECONCILE_PASSES kartų).
+    Redis skaitliukai ištrinami (gen padidinamas) - bus užpildyti iš naujo skaitant.
+    Grąžina perrašytų dokumentų skaičių.
+    """
+    written, skipped = _reconcile_pass(review_collection)
+
+    for _ in range(RECONCILE_PASSES - 1):
+        if not skipped:
+            break
+        rewritten, skipped = _reconcile_pass(review_collection, skipped)
+        written += rewritten
+
+    if skipped:
+        print(f"Nepavyko perskaičiuoti {len(skipped)} skaitliukų (nuolat keičiami): {skipped}")
+
+    pipe = r.pipeline()
+    for key in r.scan_iter(match="review_stats:*", count=1000):
+        role, user_id = key.split(':', 2)[1:]
+        forget_cached_stats(pipe, role, user_id)
+    pipe.execute()
+
+    return written
+
+
+def backfill_review_stats(review_collection) -> bool:
+    """
+    Pirmas šešėlio užpildymas: jei review_stats tuščia, o atsiliepimų yra,
+    paleidžiamas reconcile_review_stats. Grąžina, ar užpildė.
+    """
+    if get_stats_collection(review_collection).find_one({}, {'_id': 1}) is not None:
+        return False
+    if review_collection.find_one({}, {'_id': 1}) is None:
+        return False
+
+    print(f"Užpildyti atsiliepimų skaitliukai: {reconcile_review_stats(review_collection)}")
+    return True
+
+
+if __name__ == "__main__":
+    from api.connection import get_db
+    db = get_db()
+
+    print(f"Perskaičiuota skaitliukų: {reconcile_review_stats(db['review'])}")
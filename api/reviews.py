@@ -1,6 +1,7 @@
 from pymongo.results import InsertOneResult
 from bson import ObjectId
 from api.utils import serialize_doc
+from api.review_stats import record_review_change
 from datetime import timedelta, datetime
 from dateutil.relativedelta import relativedelta
 
@@ -59,7 +60,12 @@ def create_review(
     del review['student_id']
 
     # Prideti prie duomenu bazes
-    return review_collection.insert_one(review)
+    insert_result = review_collection.insert_one(review)
+
+    # Atnaujinti atsiliepimu skaitliukus (nebereikia agreguoti skaitant)
+    record_review_change(review_collection, review, 1)
+
+    return insert_result
 
 
 def revoke_review(
@@ -69,11 +75,18 @@ def revoke_review(
     if not review_collection.find_one({'_id': ObjectId(review_id)}):
         raise ValueError('Tokio review nera')
 
-    return review_collection.find_one_and_update(
-        {'_id': ObjectId(review_id)},
+    # Skaitliukus mazinam tik ta karta, kai atsiliepimas is tikruju atsaukiamas
+    review = review_collection.find_one_and_update(
+        {'_id': ObjectId(review_id), 'type': {'$ne': 'REVOKED'}},
         {'$set': {'type': 'REVOKED'}}
     )
 
+    if not review:
+        return review_collection.find_one({'_id': ObjectId(review_id)})
+
+    record_review_change(review_collection, review, -1)
+    return review
+
 
 def get_single_review(
         review_collection,
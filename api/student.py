@@ -3,7 +3,10 @@ from api.utils import (
     parse_date_of_birth
 )
 from api.connection import get_db
-from redis_api.redis_client import get_redis
+from api.connection import get_redis
+from api.calendar_cache import STUDENT_CALENDAR, forget_owner_calendars
+from api.pagination import list_page_by_name
+from api.name_search import NAME_SEARCH_FIELD, name_search_doc, search_by_name
 from redis.exceptions import LockError
 
 redis_client = get_redis()
@@ -12,7 +15,6 @@ from pymongo.results import (
     UpdateResult,
     DeleteResult
 )
-import re
 from bson import ObjectId
 from datetime import timedelta
 import hashlib
@@ -79,6 +81,9 @@ def create_new_student(
         student['password_hashed'] = hash_algo.hexdigest()
         del student['password']
 
+        # Normalizuotas vardas paieskai
+        student[NAME_SEARCH_FIELD] = name_search_doc(student['first_name'], student['last_name'])
+
         # Įrašome į DB
         result = student_collection.insert_one(student)
         return result
@@ -101,15 +106,32 @@ def get_all_students(student_collection):
     return [serialize_doc(s) for s in students]
 
 
-def get_students_by_name(student_collection, first_name: str, last_name: str):
-    """Ieško studentų pagal vardą arba pavardę (case-insensitive)."""
-    regex_first = re.compile(first_name, re.IGNORECASE)
-    regex_last = re.compile(last_name, re.IGNORECASE)
+# Laukai, rodomi mokiniu sarase (be slaptazodzio ir kitu vidiniu lauku)
+STUDENT_LIST_PROJECTION = {
+    'first_name': 1,
+    'last_name': 1,
+    'class': 1,
+    'subjects': 1,
+    'parents_phone_numbers': 1
+}
 
-    students = student_collection.find({
-        "first_name": {"$regex": regex_first},
-        "last_name": {"$regex": regex_last}
-    })
+
+def list_students_page(student_collection, page_size=None, after: str = None) -> dict:
+    """
+    Vienas mokinių sąrašo puslapis, surikiuotas pagal vardą ir pavardę.
+    Grąžina {'items', 'next' (kito puslapio after), 'total_estimate'}.
+    """
+    return list_page_by_name(student_collection, STUDENT_LIST_PROJECTION, page_size, after)
+
+
+def get_students_by_name(student_collection, first_name: str, last_name: str):
+    """
+    Ieško studentų pagal vardą ir/ar pavardę (be didžiųjų raidžių ir
+    diakritikų, per indeksą - žr. api/name_search.py).
+    """
+    students = search_by_name(
+        student_collection, first_name, last_name, STUDENT_LIST_PROJECTION
+    )
 
     return [serialize_doc(s) for s in students]
 
@@ -132,6 +154,7 @@ def delete_student(student_collection, tutor_collection, student_id: str) -> dic
                 {},
                 {"$pull": {"students_subjects": {"student.student_id": student_id}}}
             )
+            forget_owner_calendars(STUDENT_CALENDAR, student_id)
             return {"deleted": True}
         else:
             return {"deleted": False}
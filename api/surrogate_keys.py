@@ -0,0 +1,102 @@
+"""
+Surogatiniai raktai ClickHouse dimensijų lentelėms (student_sk, tutor_sk, ...).
+
+Vietoj SELECT MAX(...) + 1 (skenuoja lentelę, o lygiagrečiai registruojantis
+du įrašai gauna tą patį raktą) raktai imami iš Redis sekos sk:<lentelė>.
+Procesas vienu INCRBY rezervuoja SK_BLOCK_SIZE raktų bloką ir dalina jį iš
+atminties. Seka inicializuojama iš ClickHouse MAX tik tada, kai jos Redis'e
+dar nėra (SET NX - laimi pirmas).
+
+Tarp blokų gali likti tarpų (pvz. procesui persikrovus) - surogatiniam
+raktui tai netrukdo, svarbu tik unikalumas.
+"""
+
+import os
+import threading
+
+from api.connection import get_redis, get_clickhouse_client
+
+SK_BLOCK_SIZE = int(os.getenv('SK_BLOCK_SIZE', 20))
+# Jei seka Redis'e prarasta, o lentele ne tuscia, kiti procesai gali tureti
+# isdalintu, bet dar neirasytu raktu - todel tesiam su atsarga
+SK_RESEED_MARGIN = 1000
+
+# lentele -> surogatinio rakto stulpelis
+DIMENSION_KEYS = {
+    'dim_students': 'student_sk',
+    'dim_tutors': 'tutor_sk',
+    'dim_schools': 'school_sk',
+    'dim_subjects': 'subject_sk',
+}
+
+r = get_redis()
+
+# INCRBY tik jei seka jau yra - kitaip Redis pradetu nuo 0 ir raktai kartotusi
+_incr_existing = r.register_script("""
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+return redis.call('INCRBY', KEYS[1], ARGV[1])
+""")
+
+_blocks = {}
+_blocks_pid = None
+_blocks_lock = threading.Lock()
+
+
+def sequence_key(table: str) -> str:
+    return f"sk:{table}"
+
+
+def seed_sequence(table: str, clickhouse_client=None) -> bool:
+    """ Sukuria seką iš ClickHouse MAX, jei jos dar nėra. Grąžina, ar sukūrė. """
+    clickhouse_client = clickhouse_client or get_clickhouse_client()
+    column = DIMENSION_KEYS[table]
+
+    result = clickhouse_client.query(f"SELECT max({column}) FROM {table}")
+    current = result.result_set[0][0] or 0
+    if current:
+        current += SK_RESEED_MARGIN
+
+    return bool(r.set(sequence_key(table), current, nx=True))
+
+
+def reserve_keys(table: str, count: int, clickhouse_client=None) -> range:
+    """ Rezervuoja count iš eilės einančių raktų (vienas Redis kreipinys). """
+    if table not in DIMENSION_KEYS:
+        raise KeyError(f"Nežinoma dimensijų lentelė: {table}")
+    if count < 1:
+        raise ValueError("count turi būti teigiamas")
+
+    last = _incr_existing(keys=[sequence_key(table)], args=[count])
+    if last is None:
+        seed_sequence(table, clickhouse_client)
+        last = _incr_existing(keys=[sequence_key(table)], args=[count])
+
+    last = int(last)
+    return range(last - count + 1, last + 1)
+
+
+def next_key(table: str, clickhouse_client=None) -> int:
+    """ Kitas raktas iš šio proceso bloko; blokui pasibaigus rezervuojamas naujas. """
+    global _blocks_pid
+
+    with _blocks_lock:
+        # Po fork() tevo blokas lieka ir vaike - raktai kartotusi
+        if _blocks_pid != os.getpid():
+            _blocks.clear()
+            _blocks_pid = os.getpid()
+
+        key = next(_blocks.get(table, iter(())), None)
+        if key is None:
+            _blocks[table] = iter(reserve_keys(table, SK_BLOCK_SIZE, clickhouse_client))
+            key = next(_blocks[table])
+
+        return key
+
+
+if __name__ == "__main__":
+    # python -m api.surrogate_keys - sekos is ClickHouse (jei dar nera)
+    for table in DIMENSION_KEYS:
+        created = seed_sequence(table)
+        print(f"{table}: {'sukurta' if created else 'jau yra'} ({r.get(sequence_key(table))})")
@@ -11,7 +11,10 @@ from api.utils import (
     parse_date_of_birth
 )
 import hashlib
-from redis_api.redis_client import get_redis
+from api.connection import get_redis
+from api.calendar_cache import TUTOR_CALENDAR, forget_owner_calendars
+from api.pagination import list_page_by_name
+from api.name_search import NAME_SEARCH_FIELD, name_search_doc, search_by_name
 from redis.exceptions import LockError
 
 redis_client = get_redis()
@@ -22,7 +25,6 @@ from pymongo.results import (
 )
 
 from api.connection import get_db
-import re
 from bson import ObjectId
 
 def create_new_tutor(tutor_collection, tutor_info: dict) -> InsertOneResult:
@@ -89,6 +91,7 @@ def create_new_tutor(tutor_collection, tutor_info: dict) -> InsertOneResult:
 
         # Papildomi laukai
         tutor['students_subjects'] = []
+        tutor[NAME_SEARCH_FIELD] = name_search_doc(tutor['first_name'], tutor['last_name'])
 
         # Įrašome į DB
         result = tutor_collection.insert_one(tutor)
@@ -204,16 +207,29 @@ def get_all_tutors(tutor_collection):
     tutors = tutor_collection.find()
     return [serialize_doc(t) for t in tutors]
 
-def get_tutors_by_name(tutor_collection, first_name: str, last_name: str):
+# Laukai, rodomi korepetitoriu sarase (be slaptazodzio ir students_subjects)
+TUTOR_LIST_PROJECTION = {
+    'first_name': 1,
+    'last_name': 1,
+    'email': 1,
+    'subjects': 1
+}
+
+def list_tutors_page(tutor_collection, page_size=None, after: str = None) -> dict:
     """
-    Ieško korepetitorių pagal vardą ir pavardę (case-insensitive).
+    Vienas korepetitorių sąrašo puslapis, surikiuotas pagal vardą ir pavardę.
+    Grąžina {'items', 'next' (kito puslapio after), 'total_estimate'}.
     """
-    query = {
-        "first_name": re.compile(first_name, re.IGNORECASE),
-        "last_name": re.compile(last_name, re.IGNORECASE)
-    }
+    return list_page_by_name(tutor_collection, TUTOR_LIST_PROJECTION, page_size, after)
 
-    tutors = tutor_collection.find(query)
+def get_tutors_by_name(tutor_collection, first_name: str, last_name: str):
+    """
+    Ieško korepetitorių pagal vardą ir/ar pavardę (be didžiųjų raidžių ir
+    diakritikų, per indeksą - žr. api/name_search.py).
+    """
+    tutors = search_by_name(
+        tutor_collection, first_name, last_name, TUTOR_LIST_PROJECTION
+    )
     return [serialize_doc(t) for t in tutors]
 
 def find_tutors_by_subject_and_class(tutor_collection, subject, student_class):
@@ -261,6 +277,8 @@ def delete_tutor(tutor_collection, tutor_id: str) -> dict:
     
     try:
         result = tutor_collection.delete_one({"_id": ObjectId(tutor_id)})
+        if result.deleted_count == 1:
+            forget_owner_calendars(TUTOR_CALENDAR, tutor_id)
         return {"deleted": result.deleted_count == 1}
     finally:
         try:
@@ -310,6 +328,62 @@ def remove_student_from_tutor(
         except:
             pass
 
+def get_tutor_name_index(tutor_collection, tutor_ids) -> tuple[dict, dict]:
+    """
+    Viena $in užklausa paima visus nurodytus korepetitorius ir sudaro vardų indeksus:
+        - {tutor_id: "Vardas Pavardė"}
+        - {(tutor_id, student_id): "Vardas Pavardė"} pagal tutor.students_subjects
+    Naudojama sąrašams, kuriuose tas pats korepetitorius kartojasi daug kartų.
+    """
+    object_ids = [ObjectId(tutor_id) for tutor_id in set(tutor_ids)]
+    if not object_ids:
+        return {}, {}
+
+    # Imame tik vardus - be slaptažodžių ir kitų laukų
+    projection = {
+        "first_name": 1,
+        "last_name": 1,
+        "students_subjects.student.student_id": 1,
+        "students_subjects.student.first_name": 1,
+        "students_subjects.student.last_name": 1
+    }
+
+    tutor_names = {}
+    student_names = {}
+    for tutor in tutor_collection.find({"_id": {"$in": object_ids}}, projection):
+        tutor_id = str(tutor["_id"])
+        tutor_names[tutor_id] = f"{tutor['first_name']} {tutor['last_name']}"
+
+        for entry in tutor.get("students_subjects", []):
+            student = entry.get("student")
+            if not student or "student_id" not in student:
+                continue
+
+            student_names[(tutor_id, str(student["student_id"]))] = \
+                f"{student['first_name']} {student['last_name']}"
+
+    return tutor_names, student_names
+
+def get_tutor_ids_by_names(tutor_collection, names: list[tuple[str, str]]) -> dict:
+    """
+    Grąžina {(vardas, pavardė): _id string} visiems rastiems korepetitoriams
+    viena užklausa (indeksas name).
+    """
+    if not names:
+        return {}
+
+    query = {"$or": [
+        {"first_name": first_name, "last_name": last_name}
+        for first_name, last_name in set(names)
+    ]}
+
+    tutor_ids = {}
+    for tutor in tutor_collection.find(query, {"first_name": 1, "last_name": 1}):
+        # Kaip get_tutor_id_by_name - jei vardai sutampa, imamas pirmas
+        tutor_ids.setdefault((tutor["first_name"], tutor["last_name"]), str(tutor["_id"]))
+
+    return tutor_ids
+
 def get_tutor_id_by_name(db, first_name, last_name):
     """
     Grąžina MongoDB ObjectId string korepetitoriui pagal vardą ir pavardę.
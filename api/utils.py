@@ -51,7 +51,6 @@ def get_student_name(
 
     for student_subject in subjects_students:
         student = student_subject['student']
-        print(student)
 
         if str(student['student_id']) == student_id:
             return f"{student['first_name']} {student['last_name']}"
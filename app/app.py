@@ -5,9 +5,9 @@ from flask import (
     redirect,
     url_for,
     flash,
-    session
+    session,
+    g
 )
-from pymongo import MongoClient
 from dotenv import load_dotenv
 import hashlib
 import traceback
@@ -27,12 +27,13 @@ from api.tutor import (
     get_tutor_by_id,
     get_tutor_students,
     get_all_tutors,
+    list_tutors_page,
     delete_tutor,
     create_new_tutor,
     get_tutors_by_name,
     assign_student_to_tutor,
     remove_student_from_tutor,
-    get_tutor_id_by_name
+    get_tutor_ids_by_names
 )
 from api.student import (
     get_students_tutors,
@@ -47,6 +48,7 @@ from api.reviews import (
 )
 from api.student import (
     get_all_students,
+    list_students_page,
     get_student_by_id,
     get_students_by_name,
     create_new_student,
@@ -54,21 +56,16 @@ from api.student import (
     remove_tutor_from_student
 )
 from api.aggregates import (
-    pay_month_student,
-    pay_month_tutor,
-    calculate_tutor_rating,
-    get_student_review_count,
-    get_tutor_review_count,
-    invalidate_tutor_review_cache,
+    get_tutor_dashboard,
+    get_student_dashboard,
     invalidate_tutor_pay_cache,
-    invalidate_student_pay_cache,
-    invalidate_student_review_cache,
-    invalidate_tutor_rating_cache
+    invalidate_student_pay_cache
 )
 from api.lesson import (
     list_lessons_student_week,
     delete_lesson as func_delete_lesson,
     create_lesson,
+    create_lessons_bulk,
     change_lesson_date,
     list_lessons_tutor_month,
     list_lesson_student_month
@@ -93,31 +90,44 @@ from api.neo4j import (
     accept_friend_request,
     decline_friend_request,
     get_pending_friend_requests,
-    create_student,
-    set_student_school,
-    set_student_tutor,
     # create_tutor
 )
 
-from redis_api.redis_client import get_redis
 from redis.exceptions import LockError
-from cassandra_db.cassandra_client import get_cassandra_session
 from flask_socketio import SocketIO, emit, join_room
-from cassandra.query import SimpleStatement
+from cassandra_db.statements import get_statement
+from api.chat import (
+    get_recent_messages,
+    get_message_page
+)
+from api.chat_writer import send_chat_message, start_chat_writer
+from api.outbox import (
+    CLICKHOUSE_TARGET,
+    NEO4J_TARGET,
+    outbox_event,
+    publish_events,
+    start_outbox_workers
+)
+from api.review_stats import backfill_review_stats
+from api.jwt_cache import (
+    get_cached_payload,
+    cache_payload,
+    publish_revocation,
+    start_revocation_listener
+)
 from datetime import datetime
 from uuid import uuid1
 from cassandra.util import uuid_from_time
-from neo4j import GraphDatabase
 
 
+from api.connection import (
+    get_db,
+    get_redis,
+    get_cassandra_session,
+    get_neo4j_driver,
+    get_clickhouse_client
+)
 from api.clickhouse_api import (
-    get_clickhouse_client,
-    add_tutor_clickhouse,
-    add_student_clickhouse,
-    delete_student_clickhouse,
-    delete_tutor_clickhouse,
-    f_student_tutor_stat_add,
-    update_studied_with_tutor_to,
     update_student_tutor_lesson_count,
     update_student_tutor_rating,
     get_tutors_subjects_ratings,
@@ -129,15 +139,11 @@ from api.clickhouse_api import (
     select_school_count
 )
 
-client_clickhouse = get_clickhouse_client()
-
-
 load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = 'supersecretkey'
-client = MongoClient(os.getenv('MONGO_URI'))
-db = client['mendel-tutor']
+db = get_db()
 socketio = SocketIO(app, cors_allowed_origins="*")
 
 r = get_redis()
@@ -153,15 +159,27 @@ JWT_SECRET_KEY = 'labai-slaptas-raktas-1'
 JWT_ALGORITHM = 'HS256'
 JWT_EXPIRATION_HOURS = 1
 
-session_cassandra = get_cassandra_session()
+# Cassandra ir ClickHouse klientus imame is registro ten, kur naudojami,
+# nes jie jungiasi is karto (zr. api/connection.py)
+driver = get_neo4j_driver()
 
-NEO4J_URI = 'neo4j+s://d750cfd0.databases.neo4j.io'
-NEO4J_USERNAME = 'neo4j'
-NEO4J_PASSWORD = 'qwNQvz1-G-xC4NmSQo01PXIXSgIGgug5ZhRmGRSA6VQ'
-NEO4J_DATABASE = 'neo4j'
-AURA_INSTANCEID = 'd750cfd0'
+# Pirmas paleidimas po review_stats atsiradimo - be jo profiliuose butu 0 atsiliepimu
+backfill_review_stats(db.review)
 
-driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USERNAME, NEO4J_PASSWORD))
+# Po perkrovimo srautas chat:persist gali tureti dar neirasytu zinuciu -
+# rasytojas paleidziamas is karto, o ne tik atsiuntus nauja zinute
+start_chat_writer(r)
+
+# Outbox po perkrovimo gali tureti laukianciu (ir atidetu) ivykiu - darbuotojai
+# paleidziami is karto, o ne tik po pirmo naujo ivykio
+start_outbox_workers(db.outbox)
+
+
+def publish(*events):
+    """ ClickHouse ir Neo4j atnaujinimai per outbox (api/outbox.py) - maršrutas laukia tik Mongo. """
+    # Pakartotinai - po fork() gijos vaikiniame procese neperimamos
+    start_outbox_workers(db.outbox)
+    publish_events(db.outbox, list(events))
 
 
 @app.route("/")
@@ -262,27 +280,35 @@ def students():
         last_name = request.args.get("last_name")
         student_collection = db["student"]
 
+        # Paieska - be puslapiu, visas sarasas - puslapiais
+        page = {'next': None, 'total_estimate': None}
         if first_name and last_name:
             students_list = get_students_by_name(student_collection, first_name, last_name)
         else:
-
-            students_list = list(
-                student_collection.find({}).sort([("first_name", 1), ("last_name", 1)])
+            page = list_students_page(
+                student_collection,
+                request.args.get("page_size"),
+                request.args.get("after")
             )
+            students_list = page['items']
 
         if first_name is None:
             return render_template(
                 "students.html",
                 students=students_list,
                 first_name="Vardas",
-                last_name="Pavardė"
+                last_name="Pavardė",
+                next_after=page['next'],
+                total_estimate=page['total_estimate']
             )
         else:
             return render_template(
                 "students.html",
                 students=students_list,
                 first_name=first_name,
-                last_name=last_name
+                last_name=last_name,
+                next_after=page['next'],
+                total_estimate=page['total_estimate']
             )
 
     except Exception as e:
@@ -304,13 +330,16 @@ def view_student(student_id):
         # Mongo korepetitorių paieška (tiesiogiai priskirti)
         tutors_cursor = db.tutor.find({"students_subjects.student.student_id": student_id})
 
-        review_count = get_student_review_count(db['review'], student_id=student['_id'])
-        if review_count:
-            student['review_count'] = review_count
-
-        pay = pay_month_student(session_cassandra, db['tutor'], db['lesson'], student_id=student['_id'])
-        if pay:
-            student['pay'] = pay
+        dashboard = get_student_dashboard(
+            db['review'],
+            db['lesson'],
+            db['tutor'],
+            get_cassandra_session(),
+            student['_id']
+        )
+        for key in ('review_count', 'pay'):
+            if dashboard[key]:
+                student[key] = dashboard[key]
 
         lessons = []
         try:
@@ -345,13 +374,16 @@ def view_student(student_id):
                 max_path_length=4,
                 existing_tutors=existing_tutors
             )
-            print(friends_graph_tutors)
 
-            # Konvertuojam į MongoDB ObjectId naudojant vardą+pavardę
+            # Konvertuojam į MongoDB ObjectId naudojant vardą+pavardę (viena uzklausa)
             graph_tutors = []
             if friends_graph_tutors:
+                tutor_ids = get_tutor_ids_by_names(
+                    db["tutor"],
+                    [(t["first_name"], t["last_name"]) for t in friends_graph_tutors]
+                )
                 for t in friends_graph_tutors:
-                    tutor_id = get_tutor_id_by_name(db, t["first_name"], t["last_name"])
+                    tutor_id = tutor_ids.get((t["first_name"], t["last_name"]))
                     if tutor_id:  # jei randame MongoDB id
                         graph_tutors.append({
                             "tutor_id": tutor_id,          # MongoDB _id string
@@ -400,10 +432,16 @@ def add_student():
 
             try:
                 # įrašymas į pagrindinę DB
-                create_new_student(db.student, data)
+                new_student = create_new_student(db.student, data)
 
-                add_student_clickhouse(client_clickhouse, data["first_name"], data["last_name"],
-                                          data["class"], data["school_fk"], data["date_of_birth"])
+                publish(outbox_event(CLICKHOUSE_TARGET, 'student_created', {
+                    'student_id': str(new_student.inserted_id),
+                    'first_name': data["first_name"],
+                    'last_name': data["last_name"],
+                    'class': data["class"],
+                    'school': data["school_fk"],
+                    'date_of_birth': data["date_of_birth"]
+                }, key=f"student_created:{new_student.inserted_id}"))
 
                 flash("Mokinys sėkmingai pridėtas!", "success")
                 return redirect(url_for("students"))
@@ -435,22 +473,18 @@ def delete_student_ui(student_id):
             result = delete_student(db.student, db.tutor, student_id)
             if result["deleted"]:
                 flash(f"Mokinys {first_name} {last_name} sėkmingai ištrintas iš MongoDB!", "success")
+
+                # Iš ClickHouse ištrins outbox darbuotojas
+                publish(outbox_event(CLICKHOUSE_TARGET, 'student_deleted', {
+                    'student_id': student_id,
+                    'first_name': first_name,
+                    'last_name': last_name
+                }, key=f"student_deleted:{student_id}"))
             else:
                 flash(f"Mokinys {first_name} {last_name} MongoDB nerastas.", "warning")
         except LockError:
             flash(f"Mokinys {first_name} {last_name} šiuo metu redaguojamas kito naudotojo, pabandykite vėliau.", "warning")
 
-        # Ištriname studentą iš ClickHouse
-        deleted_ch = delete_student_clickhouse(
-            client_clickhouse,
-            first_name,
-            last_name
-        )
-        if deleted_ch:
-            flash(f"Mokinys {first_name} {last_name} sėkmingai ištrintas iš ClickHouse!", "success")
-        else:
-            flash(f"Mokinys {first_name} {last_name} ClickHouse nerastas.", "warning")
-
     except Exception as e:
         flash(str(e), "danger")
 
@@ -464,8 +498,6 @@ def sign_up_all():
 
 @app.route('/sign-up-student', methods=['GET', 'POST'])
 def sign_up_student():
-    from neo4j_db.neo4j_client import get_driver
-
     if request.method == 'POST':
         try:
             # Gaunam tutorius is html
@@ -532,42 +564,62 @@ def sign_up_student():
 
             # Sukuriame studentą mongo duomenų bazėje
             new_student = create_new_student(db.student, student_info)
-            add_student_clickhouse(client_clickhouse, student_info["first_name"], student_info["last_name"],
-                                   student_info["class"], student_info["school"], student_info["date_of_birth"])
-            driver = get_driver()
-            # Sukuriame studento neo4j duomenų bazėje
-            create_student(driver, student_info['first_name'], student_info['last_name'], student_info['class'])
-            # Priskiriam studentą mokyklai
-            set_student_school(driver, student_info['first_name'], student_info['last_name'], student_info['school'])
             student_id = new_student.inserted_id
 
+            # ClickHouse ir Neo4j atnaujins outbox darbuotojai
+            events = [outbox_event(CLICKHOUSE_TARGET, 'student_created', {
+                'student_id': str(student_id),
+                'first_name': student_info["first_name"],
+                'last_name': student_info["last_name"],
+                'class': student_info["class"],
+                'school': student_info["school"],
+                'date_of_birth': student_info["date_of_birth"]
+            }, key=f"student_created:{student_id}")]
+
             # Priskiriam studenta prie pasirinktu korepetitoriu
-            if selected_tutors:
-                subjects_for_student = student_info.get('subjects') or []
-                for t_id in selected_tutors:
-                    tutor_id_str = str(t_id)
-                    # Skaitom korepetitoriaus subjectus
-                    try:
-                        tutor_doc = db['tutor'].find_one({"_id": ObjectId(tutor_id_str)})
-                        tutor_subjects = [s.get('subject') for s in tutor_doc.get('subjects', [])]
-                    except Exception:
-                        tutor_subjects = []
-
-                    # Priskiriam prie dalyku kuriuos pasirinko ir studentas ir kuriuos turi tutor
-                    if subjects_for_student:
-                        to_assign = [s for s in subjects_for_student if s in tutor_subjects]
-                        if not to_assign:
-                            raise ValueError("Rinkitės korepetitorius su jūsų nurodytais dalykais")
-                        for subj in to_assign:
-                            try:
-                                assign_student_to_tutor(db.tutor, db.student, tutor_id_str, str(student_id), subj)
-                                f_student_tutor_stat_add(client_clickhouse, student_id, tutor_id_str, subj, db)
-
-                            except LockError:
-                                # skipinam tutor
-                                pass
-                            except Exception as assn_e:
-                                print(f"Nepavyko priskirt (tutor={tutor_id_str}, subj={subj}): {assn_e}")
+            assigned_tutors = set()
+            try:
+                if selected_tutors:
+                    subjects_for_student = student_info.get('subjects') or []
+                    for t_id in selected_tutors:
+                        tutor_id_str = str(t_id)
+                        # Skaitom korepetitoriaus subjectus
+                        try:
+                            tutor_doc = db['tutor'].find_one({"_id": ObjectId(tutor_id_str)})
+                            tutor_subjects = [s.get('subject') for s in tutor_doc.get('subjects', [])]
+                        except Exception:
+                            tutor_subjects = []
+
+                        # Priskiriam prie dalyku kuriuos pasirinko ir studentas ir kuriuos turi tutor
+                        if subjects_for_student:
+                            to_assign = [s for s in subjects_for_student if s in tutor_subjects]
+                            if not to_assign:
+                                raise ValueError("Rinkitės korepetitorius su jūsų nurodytais dalykais")
+                            for subj in to_assign:
+                                try:
+                                    assign_student_to_tutor(db.tutor, db.student, tutor_id_str, str(student_id), subj)
+                                    assigned_tutors.add((tutor_doc['first_name'], tutor_doc['last_name']))
+                                    events.append(outbox_event(CLICKHOUSE_TARGET, 'student_tutor_assigned', {
+                                        'student_id': str(student_id),
+                                        'tutor_id': tutor_id_str,
+                                        'subject': subj
+                                    }))
+
+                                except LockError:
+                                    # skipinam tutor
+                                    pass
+                                except Exception as assn_e:
+                                    print(f"Nepavyko priskirt (tutor={tutor_id_str}, subj={subj}): {assn_e}")
+            finally:
+                # Neo4j: mokinys, mokykla ir korepetitoriai - viena transakcija (register_student)
+                events.append(outbox_event(NEO4J_TARGET, 'student_registered', {
+                    'first_name': student_info['first_name'],
+                    'last_name': student_info['last_name'],
+                    'class': student_info['class'],
+                    'school': student_info['school'],
+                    'tutors': [list(tutor) for tutor in sorted(assigned_tutors)]
+                }, key=f"student_registered:{student_id}"))
+                publish(*events)
 
             session['user_id'] = str(student_id)
             session['session_type'] = STUDENT_TYPE
@@ -584,8 +636,6 @@ def sign_up_student():
     schools = []
     all_tutors = []
     try:
-        from neo4j_db.neo4j_client import get_driver
-        driver = get_driver()
         schools = get_schools(driver)
     except Exception as e:
         print(f"Error fetching schools: {e}")
@@ -646,12 +696,12 @@ def sign_up_tutor():
             session['user_name'] = f"{tutor_info['first_name']} {tutor_info['last_name']}"
             session['logged_in'] = True
 
-            try:
-                add_tutor_clickhouse(client_clickhouse, tutor_info["first_name"], tutor_info["last_name"],
-                                     tutor_info["date_of_birth"])
-            except Exception as e:
-                print("ClickHouse insert error:", e)
-                flash("ClickHouse insert failed: " + str(e), "danger")
+            publish(outbox_event(CLICKHOUSE_TARGET, 'tutor_created', {
+                'tutor_id': str(tutor_id),
+                'first_name': tutor_info["first_name"],
+                'last_name': tutor_info["last_name"],
+                'date_of_birth': tutor_info["date_of_birth"]
+            }, key=f"tutor_created:{tutor_id}"))
 
             flash("Korepetitorius sėkmingai užregistruotas!", "success")
             return redirect(url_for("view_tutor", tutor_id=tutor_id))
@@ -694,6 +744,7 @@ def login():
 
                     # Store in Redis
                     r.setex(redis_key, JWT_EXPIRATION_HOURS * 3600, json.dumps(token_data))
+                    publish_revocation(r, token_data['user_id'])
 
                     session['jwt_token'] = token
                     session['user_id'] = str(tutor['_id'])
@@ -719,6 +770,7 @@ def login():
                     token_data = {'token': token, 'user_type': STUDENT_TYPE, 'user_id': str(student['_id']),
                                   'user_name': f"{student['first_name']} {student['last_name']}"}
                     r.setex(redis_key, JWT_EXPIRATION_HOURS * 3600, json.dumps(token_data))
+                    publish_revocation(r, token_data['user_id'])
 
                     session['jwt_token'] = token
                     session['user_id'] = str(student['_id'])
@@ -735,6 +787,7 @@ def login():
                 redis_key = "jwt:user:admin"
                 token_data = {'token': token, 'user_type': ADMIN_TYPE, 'user_id': 'admin', 'user_name': 'Administrator'}
                 r.setex(redis_key, JWT_EXPIRATION_HOURS * 3600, json.dumps(token_data))
+                publish_revocation(r, token_data['user_id'])
 
                 session['jwt_token'] = token
                 session['session_type'] = ADMIN_TYPE
@@ -755,6 +808,7 @@ def logout():
     if 'user_id' in session:
         redis_key = f"jwt:user:{session['user_id']}"
         r.delete(redis_key)
+        publish_revocation(r, session['user_id'])
 
     session.clear()
     flash('Sėkmingai atsijungėte!', 'info')
@@ -772,6 +826,7 @@ def tutors():
         school_name = request.args.get("school_name", "").strip()
 
         tutors_list = []
+        page = {'next': None, 'total_estimate': None}
 
         if school_name:
             # Jei nurodyta mokykla, filtruojame pagal mokyklą
@@ -781,16 +836,21 @@ def tutors():
             if first_name or last_name:
                 tutors_list = get_tutors_by_name(tutor_collection, first_name, last_name)
             else:
-                tutors_list = list(
-                    tutor_collection.find({}).sort([("first_name", 1), ("last_name", 1)])
+                page = list_tutors_page(
+                    tutor_collection,
+                    request.args.get("page_size"),
+                    request.args.get("after")
                 )
+                tutors_list = page['items']
 
         return render_template(
             "tutors.html",
             tutors=tutors_list,
             first_name=first_name,
             last_name=last_name,
-            school_name=school_name
+            school_name=school_name,
+            next_after=page['next'],
+            total_estimate=page['total_estimate']
         )
     except Exception as e:
         return f"Klaida: {e}", 500
@@ -806,22 +866,17 @@ def view_tutor(tutor_id):
     try:
         tutor = get_tutor_by_id(db.tutor, tutor_id)
 
-        rating = calculate_tutor_rating(db['review'], tutor['_id'])
-        if rating:
-            tutor['rating'] = rating
-
-        review_count = get_tutor_review_count(db['review'], tutor_id=tutor['_id'])
-        if review_count:
-            tutor['review_count'] = review_count
-
-        pay = pay_month_tutor(
+        # Ivertinimas, atsiliepimu skaicius ir atlyginimas - vienu Redis kreipiniu
+        dashboard = get_tutor_dashboard(
+            db['review'],
             db['lesson'],
             db['tutor'],
-            session_cassandra,
+            get_cassandra_session(),
             tutor['_id']
         )
-        if pay:
-            tutor['pay'] = pay
+        for key in ('rating', 'review_count', 'pay'):
+            if dashboard[key]:
+                tutor[key] = dashboard[key]
 
         if not tutor:
             return render_template("tutor.html", tutor=None, students=None)
@@ -850,23 +905,18 @@ def remove_tutor(tutor_id):
             result = delete_tutor(db.tutor, tutor_id)
             if result["deleted"]:
                 flash(f"Korepetitorius {first_name} {last_name} sėkmingai ištrintas iš MongoDB!", "success")
+
+                # Iš ClickHouse ištrins outbox darbuotojas
+                publish(outbox_event(CLICKHOUSE_TARGET, 'tutor_deleted', {
+                    'tutor_id': tutor_id,
+                    'first_name': first_name,
+                    'last_name': last_name
+                }, key=f"tutor_deleted:{tutor_id}"))
             else:
                 flash(f"Korepetitorius {first_name} {last_name} MongoDB nerastas.", "warning")
         except LockError:
             flash(f"Korepetitorius {first_name} {last_name} šiuo metu redaguojamas kito naudotojo, pabandykite vėliau.", "warning")
 
-        # Ištriname korepetitorių iš ClickHouse
-        # Pagal first_name, last_name
-        query = f"SELECT tutor_sk FROM d_tutors WHERE first_name = '{first_name}' AND last_name = '{last_name}'"
-
-        result_ch = client_clickhouse.query(query)
-        if result_ch.result_set and result_ch.result_set[0]:
-            tutor_sk = result_ch.result_set[0][0]
-            client_clickhouse.command(f"ALTER TABLE d_tutors DELETE WHERE tutor_sk = {tutor_sk}")
-            flash(f"Korepetitorius {first_name} {last_name} sėkmingai ištrintas iš ClickHouse!", "success")
-        else:
-            flash(f"Korepetitorius {first_name} {last_name} ClickHouse nerastas.", "warning")
-
     except Exception as e:
         flash(str(e), "danger")
 
@@ -906,13 +956,13 @@ def add_tutor():
                 })
 
             # ---- DB OPERACIJOS ----
-            create_new_tutor(db.tutor, tutor_info)
-            try:
-                add_tutor_clickhouse(client_clickhouse, tutor_info["first_name"], tutor_info["last_name"],
-                                     tutor_info["date_of_birth"])
-            except Exception as e:
-                print("ClickHouse insert error:", e)
-                flash("ClickHouse insert failed: " + str(e), "danger")
+            tutor_id = create_new_tutor(db.tutor, tutor_info).inserted_id
+            publish(outbox_event(CLICKHOUSE_TARGET, 'tutor_created', {
+                'tutor_id': str(tutor_id),
+                'first_name': tutor_info["first_name"],
+                'last_name': tutor_info["last_name"],
+                'date_of_birth': tutor_info["date_of_birth"]
+            }, key=f"tutor_created:{tutor_id}"))
 
             flash("Korepetitorius sėkmingai pridėtas!", "success")
             return redirect(url_for("tutors"))
@@ -930,8 +980,7 @@ def add_new_review_tutor(tutor_id):
     """
     Leidžia dėstytojui sukurti atsiliepimą savo mokiniui.
     Pridedant naują atsiliepimą:
-        - įrašome jį į MongoDB
-        - aktyviai išvalome Redis kešą
+        - įrašome jį į MongoDB (kartu atnaujinami atsiliepimų skaitliukai)
         - atnaujiname ClickHouse lentelėje f_student_tutor_stat mokinio vertinimą
     """
 
@@ -971,9 +1020,6 @@ def add_new_review_tutor(tutor_id):
             }
         )
 
-        # Aktyviai išvalome Redis kešą
-        invalidate_student_review_cache(student_id)
-
         flash('Atsiliepimas sėkmingai pateiktas!', 'success')
         return redirect(url_for('view_tutor', tutor_id=tutor_id))
 
@@ -986,8 +1032,7 @@ def add_new_review_student(student_id):
     """
     Leidžia studentui sukurti atsiliepimą savo dėstytojui.
     Įrašius atsiliepimą:
-        - įrašome į MongoDB
-        - aktyviai išvalome Redis kešą dėstytojui
+        - įrašome į MongoDB (kartu atnaujinami dėstytojo skaitliukai)
         - atnaujiname ClickHouse lentelėje f_student_tutor_stat studento vertinimą
     """
 
@@ -1035,14 +1080,10 @@ def add_new_review_student(student_id):
             }
         )
 
-        # Aktyviai išvalome Redis kešą – dėstytojo peržiūrų skaičius gali pasikeisti
-        invalidate_tutor_review_cache(tutor_id)
-        invalidate_tutor_rating_cache(tutor_id)
-
         # ATNAUJINAME ClickHouse lentelėje studento vertinimą
         try:
             update_student_tutor_rating(
-                client_clickhouse,
+                get_clickhouse_client(),
                 student_id,
                 tutor_id,
                 db,
@@ -1098,7 +1139,7 @@ def payment_student(student_id):
         # Išsaugome atsiliepimą Cassandra duomenų bazėje
         try:
             create_payment(
-                session_cassandra,
+                get_cassandra_session(),
                 student_id,
                 tutor_id,
                 payment_amount
@@ -1167,28 +1208,22 @@ def add_student_to_tutor(tutor_id):
                         # Gauname studento duomenis MongoDB
                         student = get_student_by_id(db['student'], student_id)
 
-                        # Pridedame į f_student_tutor_stat ClickHouse
-                        try:
-                            f_student_tutor_stat_add(
-                                client_clickhouse,
-                                student_id,
-                                tutor_id,
-                                subject,
-                                db=db,
-                                rating=float(rating) if rating else None,
-                                lessons=int(lessons) if lessons else None,
-                                date=date
-                            )
-                        except Exception as e_ch:
-                            flash(f"Klaida įrašant ClickHouse: {str(e_ch)}", "warning")
-
-                        # Papildoma logika Neo4j
-                        set_student_tutor(
-                            driver,
-                            student['first_name'],
-                            student['last_name'],
-                            tutor['first_name'],
-                            tutor['last_name']
+                        # f_student_tutor_stat (ClickHouse) ir TEACHES (Neo4j) - per outbox
+                        publish(
+                            outbox_event(CLICKHOUSE_TARGET, 'student_tutor_assigned', {
+                                'student_id': student_id,
+                                'tutor_id': tutor_id,
+                                'subject': subject,
+                                'rating': float(rating) if rating else None,
+                                'lessons': int(lessons) if lessons else None,
+                                'date': date
+                            }),
+                            outbox_event(NEO4J_TARGET, 'student_tutor_linked', {
+                                'student_first_name': student['first_name'],
+                                'student_last_name': student['last_name'],
+                                'tutor_first_name': tutor['first_name'],
+                                'tutor_last_name': tutor['last_name']
+                            })
                         )
 
                         return redirect(url_for("view_tutor", tutor_id=tutor_id))
@@ -1239,15 +1274,10 @@ def remove_student_from_tutor_route(tutor_id, student_id):
 
                 tutor = get_tutor_by_id(db.tutor, tutor_id)
 
-                try:
-                    update_studied_with_tutor_to(
-                        client_clickhouse,
-                        student_id,
-                        tutor_id,
-                        db=db
-                    )
-                except Exception as e_ch:
-                    flash(f"Klaida atnaujinant ClickHouse: {str(e_ch)}", "warning")
+                publish(outbox_event(CLICKHOUSE_TARGET, 'student_tutor_removed', {
+                    'student_id': student_id,
+                    'tutor_id': tutor_id
+                }))
 
 
             else:
@@ -1295,15 +1325,10 @@ def remove_tutor_from_student_route(student_id, tutor_id):
 
                 tutor = get_tutor_by_id(db.tutor, tutor_id)
 
-                try:
-                    update_studied_with_tutor_to(
-                        client_clickhouse,
-                        student_id,
-                        tutor_id,
-                        db=db
-                    )
-                except Exception as e_ch:
-                    flash(f"Klaida atnaujinant ClickHouse: {str(e_ch)}", "warning")
+                publish(outbox_event(CLICKHOUSE_TARGET, 'student_tutor_removed', {
+                    'student_id': student_id,
+                    'tutor_id': tutor_id
+                }))
 
             else:
                 flash("Nepavyko pašalinti korepetitoriaus.", "danger")
@@ -1353,16 +1378,13 @@ def tutor_revoke_review(tutor_id, review_id):
         student_oid = review.get("student", {}).get("student_id")
         student_id_str = str(student_oid)
 
-        # Atšaukiame kešą
-        invalidate_student_review_cache(student_id_str)
-
         # Atšaukiame atsiliepimą MongoDB
         revoke_review(db['review'], review_id)
 
         # ATNAUJINAME ClickHouse vertinimą
         try:
             update_student_tutor_rating(
-                client_clickhouse,
+                get_clickhouse_client(),
                 student_id_str,
                 tutor_id,
                 db,
@@ -1390,17 +1412,13 @@ def student_revoke_review(student_id, review_id):
         tutor_oid = review.get("tutor", {}).get("tutor_id")
         tutor_id_str = str(tutor_oid)
 
-        # Išvalome Redis kešus
-        invalidate_tutor_review_cache(tutor_id_str)
-        invalidate_tutor_rating_cache(tutor_id_str)
-
         # Atšaukiame atsiliepimą MongoDB
         revoke_review(db['review'], review_id)
 
         # ATNAUJINAME ClickHouse lentelėje studento vertinimą
         try:
             update_student_tutor_rating(
-                client_clickhouse,
+                get_clickhouse_client(),
                 student_id,
                 tutor_id_str,
                 db,
@@ -1527,22 +1545,36 @@ def create_new_lesson(tutor_id):
         hour = request.form.get('hour')
         student_ids = request.form.getlist('student_ids[]')
         subject = request.form.get('subject')
+        repeat_until = request.form.get('repeat_until')
+
+        lesson_info = {
+            'time': f'{date_of_lesson} {hour:0>{2}}:00',
+            'tutor_id': tutor_id,
+            'student_ids': student_ids,
+            'subject': subject,
+        }
 
         try:
-            create_lesson(
-                db['lesson'],
-                db['tutor'],
-                db['student'],
-                lesson_info={
-                    'time': f'{date_of_lesson} {hour:0>{2}}:00',
-                    'tutor_id': tutor_id,
-                    'student_ids': student_ids,
-                    'subject': subject,
-                }
-            )
+            if repeat_until:
+                # Kas savaite iki nurodytos datos
+                insert_result = create_lessons_bulk(
+                    db['lesson'],
+                    db['tutor'],
+                    db['student'],
+                    lesson_info=lesson_info | {'until': repeat_until}
+                )
+                lesson_count = len(insert_result.inserted_ids)
+            else:
+                create_lesson(
+                    db['lesson'],
+                    db['tutor'],
+                    db['student'],
+                    lesson_info=lesson_info
+                )
+                lesson_count = 1
 
             # CLICKHOUSE UPDATE
-            update_student_tutor_lesson_count(client_clickhouse, tutor_id, student_ids, db, 1)
+            update_student_tutor_lesson_count(get_clickhouse_client(), tutor_id, student_ids, db, lesson_count)
 
         except Exception as e:
             traceback.print_exc()
@@ -1576,7 +1608,7 @@ def delete_lesson(lesson_id, tutor_id):
 
         # 🔥 CLICKHOUSE - pamoka panaikinta → total_lessons -1
         if student_ids:
-            update_student_tutor_lesson_count(client_clickhouse, tutor_id, student_ids, db, -1)
+            update_student_tutor_lesson_count(get_clickhouse_client(), tutor_id, student_ids, db, -1)
 
         # Triname pamoką
         func_delete_lesson(db['lesson'], lesson_id)
@@ -1625,7 +1657,24 @@ def generate_jwt_token(user_id, user_type, user_name):
 
 
 def verify_jwt_token(token):
-    """Verify and decode a JWT token, checking Redis storage"""
+    """Verify a JWT token once per request (see _verify_jwt_token)"""
+    # Tas pats tokenas per viena uzklausa tikrinamas kelis kartus
+    # (check_session_type, check_*_session), todel rezultata isimenam
+    payloads = g.setdefault('jwt_payloads', {})
+    if token not in payloads:
+        payloads[token] = _verify_jwt_token(token)
+
+    return payloads[token]
+
+
+def _verify_jwt_token(token):
+    """Verify and decode a JWT token, checking the in-process cache and Redis storage"""
+    start_revocation_listener(r)
+
+    payload = get_cached_payload(token)
+    if payload is not None:
+        return payload
+
     try:
         # First, decode the JWT to get the payload
         payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
@@ -1649,6 +1698,7 @@ def verify_jwt_token(token):
             # Token mismatch - possible security issue
             return None
 
+        cache_payload(token, payload)
         return payload
 
     except jwt.ExpiredSignatureError:
@@ -1775,21 +1825,22 @@ def handle_join(data):
     room = f"{tutor_id}_{student_id}"
     join_room(room)
 
-    query = f"""
-        SELECT sender_role, message_text, sent_at 
-        FROM messages.by_pair 
-        WHERE tutor_id = %s AND student_id = %s 
-    """
-    rows = session_cassandra.execute(query, (tutor_id, student_id))
-    messages = [
-        {
-            "sender": row.sender_role,
-            "message": row.message_text,
-            "timestamp": row.sent_at.isoformat() if row.sent_at else ""
-        }
-        for row in rows
-    ]
-    emit("load_messages", messages)
+    # Naujausios zinutes is Redis, senesnes - per "load_older"
+    messages, next_cursor = get_recent_messages(
+        r, get_cassandra_session(), tutor_id, student_id
+    )
+    emit("load_messages", {"messages": messages, "next_cursor": next_cursor})
+
+
+@socketio.on("load_older")
+def handle_load_older(data):
+    messages, next_cursor = get_message_page(
+        get_cassandra_session(),
+        data["tutor_id"],
+        data["student_id"],
+        before_message_id=data["before"]
+    )
+    emit("older_messages", {"messages": messages, "next_cursor": next_cursor})
 
 
 @socketio.on("send_message")
@@ -1802,45 +1853,25 @@ def handle_send_message(data):
     message_id = uuid1()  # TIMEUUID
     sent_at = datetime.utcnow()
 
-
-    query_pair = """
-        INSERT INTO messages.by_pair (tutor_id, student_id, message_id, sender_role, message_text, sent_at)
-        VALUES (%s, %s, %s, %s, %s, %s)
-    """
-    session_cassandra.execute(
-        query_pair,
-        (tutor_id, student_id, message_id, sender_role, message_text, sent_at)
-    )
-
-    sender_id = tutor_id if sender_role == "tutor" else student_id
-
-    query_sender = """
-        INSERT INTO messages.by_sender (sender_role, sender_id, tutor_id, student_id, message_id, message_text, sent_at)
-        VALUES (%s, %s, %s, %s, %s, %s, %s)
-    """
-    session_cassandra.execute(
-        query_sender,
-        (sender_role, sender_id, tutor_id, student_id, message_id, message_text, sent_at)
+    # I Cassandra zinute iraso fono rasytojas (api/chat_writer.py);
+    # pakartotinai - po fork() gija vaikiniame procese neperimama
+    start_chat_writer(r)
+    message = send_chat_message(
+        r, tutor_id, student_id, sender_role, message_id, message_text, sent_at
     )
 
-
     room = f"{tutor_id}_{student_id}"
-    emit("receive_message", {
-        "sender": sender_role,
-        "message": message_text,
-        "timestamp": sent_at.isoformat()
-    }, room=room)
+    emit("receive_message", message, room=room)
 
 
 @app.route("/admin/messages/<role>/<user_id>")
 def admin_messages_by_sender(role, user_id):
     try:
-        query = """
-            SELECT tutor_id, student_id, message_text, sent_at
-            FROM messages.by_sender
-            WHERE sender_role = %s AND sender_id = %s
-        """
-        rows = session_cassandra.execute(query, (role, user_id))
+        session_cassandra = get_cassandra_session()
+        rows = session_cassandra.execute(
+            get_statement(session_cassandra, 'select_messages_by_sender'),
+            (role, user_id)
+        )
         messages = list(rows)
 
 
@@ -1860,12 +1891,11 @@ def admin_messages_by_sender(role, user_id):
 def admin_payments_by_sender(role, user_id):
     try:
         if role == "student":
-            query = """
-                SELECT tutor_id, student_id, payment, time_payment
-                FROM payments.student_by_tutor_time
-                WHERE student_id = %s
-            """
-            rows = session_cassandra.execute(query, (user_id,))
+            session_cassandra = get_cassandra_session()
+            rows = session_cassandra.execute(
+                get_statement(session_cassandra, 'select_payments_from_student'),
+                (user_id,)
+            )
         else:
             flash("Klaida", "warning")
             return redirect("/")
@@ -1896,14 +1926,13 @@ def admin_all_payments():
         payments = []
 
         payments = list_payments(
-            session_cassandra,
+            get_cassandra_session(),
             db['tutor'],
             payment_min=payment_min,
             payment_max=payment_max
         )
 
-        payments.sort(key=lambda m: m.get('time_payment'), reverse=True)
-        
+        # list_payments grazina jau surikiuotus (naujausi pirmi)
         return render_template(
             "admin_all_payments.html",
             payments=payments,
@@ -1917,7 +1946,7 @@ def admin_all_payments():
 @app.route("/tutor/<tutor_id>/payments/")
 def tutor_payments(tutor_id):
     try:
-        raw = read_payments_to_tutor(session_cassandra, db['tutor'], tutor_id)
+        raw = read_payments_to_tutor(get_cassandra_session(), db['tutor'], tutor_id)
 
         tutor_doc = get_tutor_by_id(db['tutor'], tutor_id)
         tutor_name = f"{tutor_doc.get('first_name','')} {tutor_doc.get('last_name','')}" if tutor_doc else '-'
@@ -1964,8 +1993,6 @@ def tutor_payments(tutor_id):
 @app.route('/api/tutors/by_school/<path:school_name>')
 def api_tutors_by_school(school_name):
     try:
-        from neo4j_db.neo4j_client import get_driver
-        driver = get_driver()
         tutors = get_tutors_by_school(driver, school_name)
         mongo_tutor = db['tutor']
 
@@ -2003,7 +2030,7 @@ def api_tutors_by_school(school_name):
 @app.route("/student/<student_id>/payments/")
 def student_payments(student_id):
     try:
-        raw = read_payments_from_student(session_cassandra, db['tutor'], student_id)
+        raw = read_payments_from_student(get_cassandra_session(), db['tutor'], student_id)
 
         payments = []
         for r in raw or []:
@@ -2075,7 +2102,20 @@ def search_students_route(student_id):
     if not q:
         return jsonify([])
 
-    results = search_students(driver, q, exclude_element_id=student_id)
+    # Neo4j mazgai neturi Mongo id - save atmetam pagal varda ir pavarde.
+    # Prisijungusio mokinio vardas jau sesijoje, Mongo kiekvienam paspaudimui nekvieciam
+    if session.get('user_id') == student_id and session.get('user_name'):
+        exclude_name = session['user_name']
+    elif ObjectId.is_valid(student_id):
+        student = db['student'].find_one(
+            {'_id': ObjectId(student_id)},
+            {'first_name': 1, 'last_name': 1}
+        )
+        exclude_name = f"{student['first_name']} {student['last_name']}" if student else None
+    else:
+        return "Student not found", 404
+
+    results = search_students(driver, q, exclude_name=exclude_name)
     return jsonify(results)
 
 @app.route("/student/<student_id>/friends/request", methods=["POST"])
@@ -2155,6 +2195,7 @@ def decline_request_route(student_id):
 
 @app.route("/powerbi_report/")
 def tutor_powerbi_report():
+    client_clickhouse = get_clickhouse_client()
     analytics=get_tutors_subjects_ratings(client_clickhouse)
 
     subject_lesson_counts = select_subject_lesson_counts(client_clickhouse)
@@ -2275,28 +2316,22 @@ def add_tutor_to_student_route(student_id, tutor_id):
                         # Gauname studento duomenis MongoDB
                         student = get_student_by_id(db['student'], student_id)
 
-                        # Pridedame į f_student_tutor_stat ClickHouse
-                        try:
-                            f_student_tutor_stat_add(
-                                client_clickhouse,
-                                student_id,
-                                tutor_id,
-                                subject,
-                                db=db,
-                                rating=float(rating) if rating else None,
-                                lessons=int(lessons) if lessons else None,
-                                date=date
-                            )
-                        except Exception as e_ch:
-                            flash(f"Klaida įrašant ClickHouse: {str(e_ch)}", "warning")
-
-                        # Papildoma logika Neo4j
-                        set_student_tutor(
-                            driver,
-                            student['first_name'],
-                            student['last_name'],
-                            tutor['first_name'],
-                            tutor['last_name']
+                        # f_student_tutor_stat (ClickHouse) ir TEACHES (Neo4j) - per outbox
+                        publish(
+                            outbox_event(CLICKHOUSE_TARGET, 'student_tutor_assigned', {
+                                'student_id': student_id,
+                                'tutor_id': tutor_id,
+                                'subject': subject,
+                                'rating': float(rating) if rating else None,
+                                'lessons': int(lessons) if lessons else None,
+                                'date': date
+                            }),
+                            outbox_event(NEO4J_TARGET, 'student_tutor_linked', {
+                                'student_first_name': student['first_name'],
+                                'student_last_name': student['last_name'],
+                                'tutor_first_name': tutor['first_name'],
+                                'tutor_last_name': tutor['last_name']
+                            })
                         )
 
                         return redirect(url_for("view_student", student_id=student_id))
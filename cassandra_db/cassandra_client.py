@@ -5,7 +5,7 @@ load_dotenv()
 from cassandra.cluster import Cluster
 from cassandra.auth import PlainTextAuthProvider
 
-def get_cassandra_session():
+def create_cassandra_session(executor_threads: int = 2):
     cloud_config = {
         'secure_connect_bundle': 'secure-connect-mendltutors.zip'
     }
@@ -17,11 +17,21 @@ def get_cassandra_session():
         raise ValueError("NO CLIENT ID OR SECRET")
 
     auth_provider = PlainTextAuthProvider(CLIENT_ID, CLIENT_SECRET)
-    cluster = Cluster(cloud=cloud_config, auth_provider=auth_provider)
+    cluster = Cluster(
+        cloud=cloud_config,
+        auth_provider=auth_provider,
+        executor_threads=executor_threads
+    )
     session = cluster.connect()
 
     return session
 
+
+def get_cassandra_session():
+    # Importuojam cia, kad nebutu circular import
+    from api.connection import get_cassandra_session as get_registry_session
+    return get_registry_session()
+
 if __name__ == "__main__":
     session = get_cassandra_session()
 
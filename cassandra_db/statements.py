@@ -0,0 +1,100 @@
+"""
+Visos programos Cassandra užklausos.
+
+Užklausos paruošiamos (session.prepare) tik vieną kartą kiekvienai sesijai ir
+laikomos keše, todėl serveris CQL teksto kiekvieną kartą nebeanalizuoja.
+Denormalizuotos kopijos (pvz. mokėjimas trijose lentelėse) rašomos lygiagrečiai
+per execute_concurrent - visas įrašymas trunka vieną kelionę iki serverio.
+"""
+
+import threading
+import weakref
+from cassandra.concurrent import execute_concurrent
+
+PAYMENT_COLUMNS = "id, tutor_id, student_id, payment_group, payment, time_payment, is_complete"
+
+# Mokėjimas rašomas į visas tris lenteles
+PAYMENT_TABLES = ['tutor_by_student_time', 'student_by_tutor_time', 'by_amount']
+
+STATEMENTS = {
+    **{
+        f'insert_payment_{table}': f"""
+            INSERT INTO payments.{table} ({PAYMENT_COLUMNS})
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """
+        for table in PAYMENT_TABLES
+    },
+    'select_payments_to_tutor': """
+        SELECT * FROM payments.tutor_by_student_time WHERE tutor_id = ?
+    """,
+    'select_payments_from_student': """
+        SELECT * FROM payments.student_by_tutor_time WHERE student_id = ?
+    """,
+    'select_payments_by_amount': """
+        SELECT * FROM payments.by_amount
+        WHERE payment_group = ? AND payment > ? AND payment < ?
+    """,
+    'insert_message_by_pair': """
+        INSERT INTO messages.by_pair (tutor_id, student_id, message_id, sender_role, message_text, sent_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """,
+    'insert_message_by_sender': """
+        INSERT INTO messages.by_sender (sender_role, sender_id, tutor_id, student_id, message_id, message_text, sent_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """,
+    'select_messages_by_pair_latest': """
+        SELECT message_id, sender_role, message_text, sent_at
+        FROM messages.by_pair
+        WHERE tutor_id = ? AND student_id = ?
+        ORDER BY message_id DESC
+        LIMIT ?
+    """,
+    'select_messages_by_pair_before': """
+        SELECT message_id, sender_role, message_text, sent_at
+        FROM messages.by_pair
+        WHERE tutor_id = ? AND student_id = ? AND message_id < ?
+        ORDER BY message_id DESC
+        LIMIT ?
+    """,
+    'select_messages_by_sender': """
+        SELECT tutor_id, student_id, message_text, sent_at
+        FROM messages.by_sender
+        WHERE sender_role = ? AND sender_id = ?
+    """,
+}
+
+# Paruoštos užklausos pagal sesiją; sesijai išnykus, išnyksta ir jos užklausos
+_prepared = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def get_statement(session, name: str):
+    """ Grąžina paruoštą užklausą pagal pavadinimą (paruošia tik pirmą kartą). """
+
+    statements = _prepared.get(session)
+    if statements is not None and name in statements:
+        return statements[name]
+
+    with _lock:
+        statements = _prepared.setdefault(session, {})
+        if name not in statements:
+            statements[name] = session.prepare(STATEMENTS[name])
+
+    return statements[name]
+
+
+def execute_writes(session, writes: list[tuple[str, tuple]]):
+    """
+    Lygiagrečiai įvykdo kelis įrašymus: writes - [(užklausos pavadinimas, parametrai)].
+    Grąžina tik kai visi įrašymai baigti; pirmoji klaida metama toliau.
+    """
+    statements_and_params = [
+        (get_statement(session, name), params) for name, params in writes
+    ]
+
+    return execute_concurrent(
+        session,
+        statements_and_params,
+        concurrency=max(len(statements_and_params), 1),
+        raise_on_first_error=True
+    )
@@ -7,19 +7,14 @@ Kaip veikia:
 4. Is Neo4j ir mongo kolekciju review ir lesson sukuriam faktu lentele.
 """
 
-from clickhouse.clickhouse_config import (
-    USERNAME,
-    PASSWORD,
-    HOST,
-)
-
-import clickhouse_connect
-from neo4j_db.neo4j_client import get_driver as get_neo4j_driver
+from api.connection import get_clickhouse_client, get_neo4j_driver
 import pandas as pd
 from datetime import date, datetime
 from api.student import get_students_by_name
 from api.tutor import get_tutors_by_name
 from api.connection import get_db
+from api.surrogate_keys import next_key, reserve_keys
+from api.key_mapping import STUDENT_ENTITY, TUTOR_ENTITY, record_sks
 
 FACT_TABLE_COLUMNS = [
     'student_fk',
@@ -32,6 +27,32 @@ FACT_TABLE_COLUMNS = [
 ]
 
 
+# Cypher uzklausos (tikrinamos neo4j_db/schema.py check)
+ALL_SCHOOLS_QUERY = """
+MATCH (sch:School)
+RETURN sch.name AS name,
+       sch.nationality AS nationality
+"""
+
+STUDENT_SCHOOL_QUERY = """
+MATCH (s:Student {first_name: $first_name, last_name: $last_name})-[:ATTENDS]->(sch:School)
+RETURN
+    sch.name AS name,
+    sch.nationality AS nationality
+"""
+
+FACT_TABLE_QUERY = """
+MATCH (s:Student)
+OPTIONAL MATCH (t:Tutor)-[st_conn:TEACHES]->(s)
+RETURN s.first_name AS student_first_name,
+    s.last_name AS student_last_name,
+    s.class_num AS class,
+    t.first_name AS tutor_first_name,
+    t.last_name AS tutor_last_name,
+    st_conn.subjects AS subjects
+"""
+
+
 class ItemNotFoundInMongo(Exception):
     pass
 
@@ -39,12 +60,7 @@ class ItemNotFoundInMongo(Exception):
 class DataWarehouseInitializer:
 
     def __init__(self):
-        self.client = clickhouse_connect.get_client(
-            host=HOST,
-            user=USERNAME,
-            password=PASSWORD,
-            secure=True
-        )
+        self.client = get_clickhouse_client()
 
         self.neo4j_driver = get_neo4j_driver()
         self.mongo_driver = get_db()
@@ -52,15 +68,9 @@ class DataWarehouseInitializer:
     def get_all_schools(self):
         """ Surenka mokyklas ir sukuria jiems dimensine lentele. """
 
-        query = """
-        MATCH (sch:School)
-        RETURN sch.name AS name,
-               sch.nationality AS nationality;
-        """
-
         # Get all students and their schools
         with self.neo4j_driver.session() as session:
-            results = session.run(query)
+            results = session.run(ALL_SCHOOLS_QUERY)
             schools = [record.data() for record in results]
 
         assert len(schools) > 0, "Nesurinkta mokyklu"
@@ -73,9 +83,12 @@ class DataWarehouseInitializer:
             'nationality': 'Nenurodyta'
         } )
 
-        for ix, school in enumerate(schools):
+        # Raktai is tos pacios sekos kaip ir naujiems irasams (api/surrogate_keys.py)
+        school_keys = reserve_keys('dim_schools', len(schools), self.client)
+
+        for school_sk, school in zip(school_keys, schools):
             self.dim_schools.append({
-                'school_sk': ix + 1,
+                'school_sk': school_sk,
                 'name': school['name'],
                 'nationality': school['nationality'],
             })
@@ -84,16 +97,12 @@ class DataWarehouseInitializer:
 
         assert hasattr(self, "dim_schools"), "Schools have not been defined yet"
 
-        query = f"""
-        MATCH (s:Student {{first_name: "{student['first_name']}", last_name: "{student['last_name']}"}})
-        MATCH (s:Student)-[:ATTENDS]->(sch:School)
-        RETURN
-            sch.name AS name,
-            sch.nationality AS nationality;
-        """
-
         with self.neo4j_driver.session() as session:
-            results = session.run(query)
+            results = session.run(
+                STUDENT_SCHOOL_QUERY,
+                first_name=student['first_name'],
+                last_name=student['last_name']
+            )
             results = list(results)
 
             if len(results) == 0:
@@ -117,11 +126,20 @@ class DataWarehouseInitializer:
         """ Surenka studentus ir sukuria jiems dimensine lentele. """
 
         self.dim_students = []
+        # Mongo _id -> student_sk (api/key_mapping.py)
+        self.student_sk_map = {}
         student_collection = self.mongo_driver['student']
 
-        for ix, student in enumerate( student_collection.find({}) ):
+        students = list(student_collection.find({}))
+        if not students:
+            return
+
+        student_keys = reserve_keys('dim_students', len(students), self.client)
+
+        for student_sk, student in zip(student_keys, students):
+            self.student_sk_map[str(student['_id'])] = student_sk
             self.dim_students.append({
-                'student_sk': ix + 1,
+                'student_sk': student_sk,
                 'first_name': student['first_name'],
                 'last_name': student['last_name'],
                 'date_of_birth': student['date_of_birth'],
@@ -142,11 +160,20 @@ class DataWarehouseInitializer:
             'date_of_birth': None
         } )
 
+        # Mongo _id -> tutor_sk (api/key_mapping.py)
+        self.tutor_sk_map = {}
         tutor_collection = self.mongo_driver['tutor']
 
-        for ix, tutor in enumerate( tutor_collection.find({})):
+        tutors = list(tutor_collection.find({}))
+        if not tutors:
+            return
+
+        tutor_keys = reserve_keys('dim_tutors', len(tutors), self.client)
+
+        for tutor_sk, tutor in zip(tutor_keys, tutors):
+            self.tutor_sk_map[str(tutor['_id'])] = tutor_sk
             self.dim_tutors.append({
-                'tutor_sk': ix + 1,
+                'tutor_sk': tutor_sk,
                 'first_name': tutor['first_name'],
                 'last_name': tutor['last_name'],
                 'date_of_birth': tutor['date_of_birth']
@@ -257,19 +284,8 @@ class DataWarehouseInitializer:
             'Nenurodyta': 0
         }
 
-        query = """
-        MATCH (s:Student)
-        OPTIONAL MATCH (t:Tutor)-[st_conn:TEACHES]->(s)
-        RETURN s.first_name AS student_first_name, 
-            s.last_name AS student_last_name, 
-            s.class_num AS class,
-            t.first_name AS tutor_first_name,
-            t.last_name AS tutor_last_name,
-            st_conn.subjects AS subjects
-        """
-
         with self.neo4j_driver.session() as session:
-            results = session.run(query)
+            results = session.run(FACT_TABLE_QUERY)
             results = list(results)
 
         for student_tutor_pair in results:
@@ -289,7 +305,7 @@ class DataWarehouseInitializer:
                 # Jei nebuvo itrauktas i dimensine lentele, idedam
                 # Taip galesim surinkti dimensine lentele dalyku
                 else:
-                    subject_fk = len(self.dim_subjects_dict)
+                    subject_fk = next_key('dim_subjects', self.client)
                     self.dim_subjects_dict[subject] = subject_fk
 
                 # Kad butu patogiau ir nereiketu irasyti atskirai, sudedam studentu ir korepetitoriu
@@ -361,6 +377,10 @@ class DataWarehouseInitializer:
         self.dim_students['date_of_birth'] = pd.to_datetime(self.dim_students['date_of_birth'], errors='coerce')
         self.client.insert_df('dim_students', self.dim_students)
 
+        # Atvaizdis, kad veliau raktu nereiketu ieskoti pagal varda
+        record_sks(STUDENT_ENTITY, self.student_sk_map, self.client)
+        record_sks(TUTOR_ENTITY, self.tutor_sk_map, self.client)
+
     def main(self):
         self.get_all_schools()
         self.get_all_students()
@@ -0,0 +1,243 @@
+"""
+Mongo indeksų aprašas ir jo sinchronizavimas.
+
+INDEXES - kokie indeksai turi būti kiekvienoje kolekcijoje. sync_indexes
+sukuria trūkstamus, perkuria pasikeitusius ir ištrina neaprašytus indeksus
+(kartojant nieko nebekeičia). check_queries per explain() patikrina, kad
+dažniausios api/* užklausos nenaudoja COLLSCAN.
+
+Naudojimas (iš model/ katalogo):
+    python indexes.py sync [--dry-run]
+    python indexes.py check
+"""
+
+import argparse
+import sys
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+# api/name_search.py: prefiksas pagal varda ar pavarde ir poeilute per trigramas
+NAME_SEARCH_INDEXES = [
+    {'name': 'name_search_first_last',
+     'keys': [('name_search.first', 1), ('name_search.last', 1)]},
+    {'name': 'name_search_last', 'keys': [('name_search.last', 1)]},
+    {'name': 'name_search_trigrams', 'keys': [('name_search.trigrams', 1)]},
+]
+
+# kolekcija -> [{'name', 'keys', papildomi create_index parametrai}]
+INDEXES = {
+    'lesson': [
+        # list_lessons_tutor_*, pamokų persidengimas, pay_month_tutor
+        {'name': 'tutor_time', 'keys': [('tutor.tutor_id', 1), ('time', 1)]},
+        # list_lessons_student_*, pamokų persidengimas, pay_month_student
+        {'name': 'students_time', 'keys': [('students.student_id', 1), ('time', 1)]},
+    ],
+    'review': [
+        # list_reviews_tutor, avg_rating_student_tutor
+        {'name': 'tutor_time', 'keys': [('tutor.tutor_id', 1), ('time', 1)]},
+        # list_reviews_student, list_reviews_student_tutor
+        {'name': 'student_time', 'keys': [('student.student_id', 1), ('time', 1)]},
+    ],
+    'tutor': [
+        # Prisijungimas ir create_new_tutor unikalumo tikrinimas
+        {'name': 'email_unique', 'keys': [('email', 1)], 'unique': True},
+        # get_students_tutors, view_student
+        {'name': 'students_subjects_student',
+         'keys': [('students_subjects.student.student_id', 1)]},
+        # get_tutor_id_by_name, list_tutors_page (puslapiavimas pagal varda + _id)
+        {'name': 'name', 'keys': [('first_name', 1), ('last_name', 1), ('_id', 1)]},
+        *NAME_SEARCH_INDEXES,
+    ],
+    'student': [
+        # Prisijungimas
+        {'name': 'student_email', 'keys': [('student_email', 1)]},
+        # create_new_student dublikatų tikrinimas
+        {'name': 'first_name_date_of_birth', 'keys': [('first_name', 1), ('date_of_birth', 1)]},
+        # list_students_page (puslapiavimas pagal varda + _id)
+        {'name': 'name', 'keys': [('first_name', 1), ('last_name', 1), ('_id', 1)]},
+        *NAME_SEARCH_INDEXES,
+    ],
+    'outbox': [
+        # api/outbox.py: tas pats ivykis idedamas tik viena karta
+        {'name': 'key_unique', 'keys': [('key', 1)], 'unique': True},
+        # claim_batch: laukiantys ir nebegaliojancios nuomos ivykiai
+        {'name': 'target_status_available',
+         'keys': [('target', 1), ('status', 1), ('available_at', 1), ('_id', 1)]},
+        {'name': 'lease', 'keys': [('lease', 1)], 'sparse': True},
+        # claim_batch: ankstesni neatlikti tos pacios esybes ivykiai
+        {'name': 'target_entities_status',
+         'keys': [('target', 1), ('entities', 1), ('status', 1), ('_id', 1)]},
+        # Atlikti ivykiai istrinami po savaites (processed_at turi tik 'done')
+        {'name': 'processed_ttl', 'keys': [('processed_at', 1)], 'expireAfterSeconds': 7 * 24 * 3600},
+    ],
+}
+
+# Parametrai, kuriuos lyginame su esamu indeksu
+INDEX_OPTIONS = ['unique', 'sparse', 'partialFilterExpression', 'expireAfterSeconds']
+
+
+def _representative_queries() -> list[tuple[str, str, dict]]:
+    """ (pavadinimas, kolekcija, filtras) - tokios pat formos kaip api/* užklausos. """
+    some_id = ObjectId()
+    now = datetime.now()
+    week = {"$gt": now, "$lt": now + timedelta(weeks=1)}
+    month = {"$gte": now - timedelta(days=30), "$lt": now}
+    # api/pagination.py: irasai po zymeklio (first_name, last_name, _id)
+    after_name = {'$or': [
+        {'first_name': {'$gt': 'Vardas'}},
+        {'first_name': 'Vardas', 'last_name': {'$gt': 'Pavarde'}},
+        {'first_name': 'Vardas', 'last_name': 'Pavarde', '_id': {'$gt': some_id}}
+    ]}
+    active_lesson = [
+        {"type": {"$exists": False}},
+        {"type": "ACTIVE"}
+    ]
+
+    return [
+        ('list_lessons_tutor_week', 'lesson', {'tutor.tutor_id': some_id, 'time': week}),
+        ('list_lessons_student_week', 'lesson', {'students.student_id': some_id, 'time': week}),
+        ('tutor_lesson_same_time', 'lesson', {'tutor.tutor_id': some_id, 'time': now}),
+        ('student_lesson_same_time', 'lesson', {'students.student_id': some_id, 'time': now}),
+        ('find_lesson_conflicts', 'lesson', {
+            '$or': [
+                {'tutor.tutor_id': some_id, 'time': week},
+                {'students.student_id': {'$in': [some_id]}, 'time': week}
+            ],
+            'type': {'$ne': 'DELETED'}
+        }),
+        ('pay_month_tutor', 'lesson', {'tutor.tutor_id': some_id, '$or': active_lesson}),
+        ('pay_month_student', 'lesson', {'students.student_id': some_id, '$or': active_lesson}),
+        ('list_reviews_tutor', 'review', {'tutor.tutor_id': some_id, 'time': month}),
+        ('list_reviews_student', 'review', {'student.student_id': some_id, 'time': month}),
+        ('list_reviews_student_tutor', 'review', {
+            'for_tutor': True,
+            'student.student_id': some_id,
+            'tutor.tutor_id': some_id
+        }),
+        ('login_tutor', 'tutor', {'email': 'vardas@pastas.lt'}),
+        ('login_student', 'student', {'student_email': 'vardas@pastas.lt'}),
+        ('get_students_tutors', 'tutor', {'students_subjects.student.student_id': str(some_id)}),
+        ('get_tutor_id_by_name', 'tutor', {'first_name': 'Vardas', 'last_name': 'Pavarde'}),
+        ('list_tutors_page', 'tutor', after_name),
+        ('search_by_name_prefix', 'student', {
+            'name_search.first': {'$regex': '^jon'},
+            'name_search.last': {'$regex': '^kaz'}
+        }),
+        ('search_by_name_last', 'tutor', {'name_search.last': {'$regex': '^kaz'}}),
+        ('search_by_name_trigrams', 'student', {
+            'name_search.trigrams': {'$all': ['azl', 'kaz', 'zla']},
+            '_id': {'$nin': [some_id]}
+        }),
+        ('list_students_page', 'student', after_name),
+        ('create_new_student', 'student', {
+            'first_name': 'Vardas',
+            'date_of_birth': {'$gte': now, '$lt': now + timedelta(days=1)}
+        }),
+        ('outbox_claim_batch', 'outbox', {
+            'target': 'clickhouse',
+            '$or': [
+                {'status': 'pending', 'available_at': {'$lte': now}},
+                {'status': 'processing', 'lease_until': {'$lt': now}},
+            ]
+        }),
+        ('outbox_leased', 'outbox', {'lease': 'nuoma'}),
+        ('outbox_blocked', 'outbox', {
+            'target': 'clickhouse',
+            'entities': {'$in': ['student:000000000000000000000000']},
+            'status': {'$in': ['pending', 'processing', 'failed']},
+        }),
+    ]
+
+
+def _index_matches(existing: dict, spec: dict) -> bool:
+    if [tuple(key) for key in existing['key']] != [tuple(key) for key in spec['keys']]:
+        return False
+
+    return all(existing.get(option) == spec.get(option) for option in INDEX_OPTIONS)
+
+
+def sync_indexes(db, spec: dict = INDEXES, dry_run: bool = False) -> list[str]:
+    """
+    Suderina kolekcijų indeksus su spec. Grąžina atliktų (ar, jei dry_run,
+    numatomų) veiksmų sąrašą.
+    """
+    actions = []
+
+    for collection_name, indexes in spec.items():
+        collection = db[collection_name]
+        existing = collection.index_information()
+        wanted = {index['name']: index for index in indexes}
+
+        # Neaprasyti ar pasikeite indeksai istrinami (_id_ niekada)
+        for name, info in existing.items():
+            if name == '_id_':
+                continue
+
+            if name not in wanted or not _index_matches(info, wanted[name]):
+                actions.append(f"{collection_name}: trinamas {name}")
+                if not dry_run:
+                    collection.drop_index(name)
+
+        for name, index in wanted.items():
+            if name in existing and _index_matches(existing[name], index):
+                continue
+
+            actions.append(f"{collection_name}: kuriamas {name} {index['keys']}")
+            if not dry_run:
+                options = {key: value for key, value in index.items() if key != 'keys'}
+                collection.create_index(index['keys'], **options)
+
+    return actions
+
+
+def _has_collscan(plan) -> bool:
+    """ Ar plano medyje yra COLLSCAN etapas. """
+    if isinstance(plan, dict):
+        if plan.get('stage') == 'COLLSCAN':
+            return True
+        return any(_has_collscan(value) for value in plan.values())
+
+    if isinstance(plan, list):
+        return any(_has_collscan(value) for value in plan)
+
+    return False
+
+
+def check_queries(db) -> list[str]:
+    """ Grąžina užklausų, kurios skenuoja visą kolekciją, pavadinimus. """
+    collscans = []
+
+    for name, collection_name, query in _representative_queries():
+        explain = db[collection_name].find(query).explain()
+        # Tik laimejes planas - atmestuose COLLSCAN gali buti visada
+        if _has_collscan(explain.get('queryPlanner', {}).get('winningPlan', {})):
+            collscans.append(name)
+
+    return collscans
+
+
+if __name__ == "__main__":
+    from model_init import get_database
+
+    parser = argparse.ArgumentParser(description="Mongo indeksų valdymas")
+    parser.add_argument('command', choices=['sync', 'check'])
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    db = get_database()
+
+    if args.command == 'sync':
+        actions = sync_indexes(db, dry_run=args.dry_run)
+        for action in actions:
+            print(action)
+        if not actions:
+            print("Indeksai jau atitinka aprašą")
+
+    else:
+        collscans = check_queries(db)
+        for name in collscans:
+            print(f"COLLSCAN: {name}")
+        if collscans:
+            sys.exit(1)
+        print("Visos užklausos naudoja indeksus")
@@ -1,6 +1,7 @@
 from pymongo import MongoClient
 
 import os
+import sys
 from dotenv import load_dotenv
 from validators import (
     student_schema_validation, 
@@ -9,6 +10,11 @@ from validators import (
     review_schema_validation
 )
 
+from indexes import sync_indexes
+
+# api/ paketas - is repozitorijos saknies
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from api.review_stats import reconcile_review_stats
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 
@@ -56,4 +62,11 @@ if __name__ == "__main__":
             continue
         create_collection(db, name, schema)
 
-    print("Collections after instantiation", db.list_collection_names())
\ No newline at end of file
+    print("Collections after instantiation", db.list_collection_names())
+
+    # Indeksai pagal aprašą indexes.py
+    for action in sync_indexes(db):
+        print(action)
+
+    # Atsiliepimu skaitliukai (review_stats) is esamu atsiliepimu
+    print(f"Perskaičiuota atsiliepimų skaitliukų: {reconcile_review_stats(db['review'])}")
@@ -292,6 +292,12 @@ lesson_schema_validation = {
             'link': {
                 'bsonType': 'string',
                 'description': "Link for the lesson"
+            },
+            'duration': {
+                'bsonType': 'int',
+                'minimum': 1,
+                'maximum': 180,
+                'description': "Lesson duration in minutes"
             }
         }
     }
@@ -1,146 +1,308 @@
+"""
+Mongo -> Neo4j migracija (mokiniai, korepetitoriai, TEACHES ryšiai, mokyklos).
+
+Mongo kolekcijos skaitomos srautu (rikiuojant pagal _id), eilutės rašomos
+paketais per UNWIND $rows valdomose transakcijose (execute_write - su
+pakartojimu laikinų klaidų atveju). Paketai rašomi lygiagrečiai:
+MERGE su unikalumo apribojimais (neo4j_db/schema.py) saugus ir lygiagrečiai,
+todėl migraciją galima kartoti.
+
+Po kiekvieno iš eilės baigto paketo įrašomas paskutinis _id (checkpoint,
+CHECKPOINT_PATH arba --checkpoint), todėl nutrūkusi migracija tęsiama nuo
+ten, kur sustojo. Jei unikalumo apribojimų sukurti nepavyko (dublikatai),
+rašoma viena gija.
+
+Naudojimas:
+    python -m neo4j_db.migrate_from_mongo_script [students tutors teaches schools]
+        [--batch-size 1000] [--workers 4] [--reset]
+"""
+
+import argparse
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from bson import ObjectId
+from dotenv import load_dotenv
+
 from neo4j_db.neo4j_client import get_driver
+from neo4j_db.schema import ensure_schema
 from api.connection import get_db
-from api.student import get_all_students
-from api.tutor import get_all_tutors
 
-import os
-from dotenv import load_dotenv
 load_dotenv()
 
 NEO4J_DATABASE = os.getenv("NEO4J_DATABASE")
 
-def create_student_node(driver, student: dict):
-    query = f"""
-    CREATE (student:Student {{first_name: '{student['first_name']}', 
-                              last_name: '{student['last_name']}',
-                              class_num: {student['class']}, 
-                              subjects: {student['subjects']}}})
-    """
-
-    result = driver.execute_query(query,
-        database_=NEO4J_DATABASE)
-
-
-def create_tutor_node(driver, tutor: dict):
-
-    if 'rating' in tutor:
-        query = f"""
-        CREATE (tutor:Tutor {{first_name: '{tutor['first_name']}', 
-                            last_name: '{tutor['last_name']}',
-                            rating: {tutor['rating']}, 
-                            subjects: {tutor['subjects']}}})
-        """
-
-    elif len(tutor['subjects']) > 0:
-
-        if isinstance( tutor['subjects'][0], dict):
-            subjects = [subj['subject'] for subj in tutor['subjects']]
-            query = f"""
-            CREATE (tutor:Tutor {{first_name: '{tutor['first_name']}', 
-                                last_name: '{tutor['last_name']}',
-                                subjects: {subjects}}})
-            """
-        
-        else:
-            query = f"""
-            CREATE (tutor:Tutor {{first_name: '{tutor['first_name']}', 
-                                last_name: '{tutor['last_name']}',
-                                subjects: {tutor['subjects']}}})
-            """
-
-    else:
-        query = f"""
-        CREATE (tutor:Tutor {{first_name: '{tutor['first_name']}', 
-                            last_name: '{tutor['last_name']}',
-                            subjects: {tutor['subjects']}}})
-        """
-    
-    result = driver.execute_query(query,
-        database_=NEO4J_DATABASE)
-
-
-def create_relationships(neo4j_driver, tutor: dict):
+MIGRATION_BATCH_SIZE = 1000
+MIGRATION_WORKERS = 4
+# Ne saltinio kataloge - kad nepatektu i git
+CHECKPOINT_PATH = os.getenv(
+    'MIGRATION_CHECKPOINT_PATH',
+    os.path.join(os.path.expanduser('~'), '.cache', 'mendl', 'neo4j_migration_checkpoint.json')
+)
+PROGRESS_EVERY_SECONDS = 5
+
+STUDENTS_QUERY = """
+UNWIND $rows AS row
+MERGE (student:Student {first_name: row.first_name, last_name: row.last_name})
+SET student.class_num = row.class_num,
+    student.subjects = row.subjects
+"""
+
+TUTORS_QUERY = """
+UNWIND $rows AS row
+MERGE (tutor:Tutor {first_name: row.first_name, last_name: row.last_name})
+SET tutor.subjects = row.subjects,
+    tutor.rating = coalesce(row.rating, tutor.rating)
+"""
+
+TEACHES_QUERY = """
+UNWIND $rows AS row
+MATCH (t:Tutor {first_name: row.tutor_first_name, last_name: row.tutor_last_name})
+MATCH (s:Student {first_name: row.student_first_name, last_name: row.student_last_name})
+MERGE (t)-[teaches:TEACHES]->(s)
+SET teaches.subjects = row.subjects
+"""
+
+SCHOOLS_QUERY = """
+UNWIND $rows AS row
+MERGE (school:School {name: row.school_name})
+SET school.country = row.country,
+    school.nationality = row.nationality
+"""
+
+SCHOOLS = [
+    {'school_name': 'A gimnazija', 'country': 'LIT', 'nationality': 'lithuanian'},
+    {'school_name': 'R gimnazija', 'country': 'LIT', 'nationality': 'russian'},
+    {'school_name': 'L vidusskola', 'country': 'LAT', 'nationality': 'latvian'},
+]
+
+
+def student_rows(student: dict) -> list[dict]:
+    return [{
+        'first_name': student['first_name'],
+        'last_name': student['last_name'],
+        'class_num': student.get('class'),
+        'subjects': list(student.get('subjects', []))
+    }]
+
+
+def tutor_rows(tutor: dict) -> list[dict]:
+    # Dalykai gali buti {'subject', 'max_class'} arba tiesiog pavadinimai
+    subjects = [
+        subject['subject'] if isinstance(subject, dict) else subject
+        for subject in tutor.get('subjects', [])
+    ]
 
-    subject_lists: dict = {}
+    return [{
+        'first_name': tutor['first_name'],
+        'last_name': tutor['last_name'],
+        'subjects': subjects,
+        'rating': tutor.get('rating')
+    }]
 
-    for student_subject in tutor['students_subjects']:
 
-        first = student_subject['student']['first_name']
-        last = student_subject['student']['last_name']
+def teaches_rows(tutor: dict) -> list[dict]:
+    """ Vienas ryšys kiekvienam korepetitoriaus mokiniui, su visais jo dalykais. """
+    subject_lists: dict = {}
 
+    for student_subject in tutor.get('students_subjects', []):
         if 'subject' not in student_subject:
             continue
 
-        if (first,last) not in subject_lists:
-            subject_lists[(first, last)] = [student_subject['subject']]
-        else:
-            subject_lists[(first, last)].append(
-                student_subject['subject']
-            )
+        key = (student_subject['student']['first_name'], student_subject['student']['last_name'])
+        subject_lists.setdefault(key, []).append(student_subject['subject'])
+
+    return [
+        {
+            'tutor_first_name': tutor['first_name'],
+            'tutor_last_name': tutor['last_name'],
+            'student_first_name': first_name,
+            'student_last_name': last_name,
+            'subjects': subjects
+        }
+        for (first_name, last_name), subjects in subject_lists.items()
+    ]
 
-    for (first_name, last_name), subjects in subject_lists.items():
 
-        query = f"""
-        MATCH (t:Tutor {{first_name: "{tutor['first_name']}", last_name: "{tutor['last_name']}"}}), 
-            (s:Student {{first_name: "{first_name}", last_name: "{last_name}"}})
+# sekcija -> (kolekcija, projekcija, eiluciu funkcija, Cypher)
+SECTIONS = {
+    'students': (
+        'student',
+        {'first_name': 1, 'last_name': 1, 'class': 1, 'subjects': 1},
+        student_rows,
+        STUDENTS_QUERY
+    ),
+    'tutors': (
+        'tutor',
+        {'first_name': 1, 'last_name': 1, 'subjects': 1, 'rating': 1},
+        tutor_rows,
+        TUTORS_QUERY
+    ),
+    'teaches': (
+        'tutor',
+        {'first_name': 1, 'last_name': 1, 'students_subjects': 1},
+        teaches_rows,
+        TEACHES_QUERY
+    ),
+}
+
+
+def load_checkpoint(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+
+    with open(path, encoding='utf-8') as checkpoint_file:
+        return json.load(checkpoint_file)
+
+
+def save_checkpoint(path: str, checkpoint: dict):
+    # Pirma i laikina faila - nutrukus rasymui, senas checkpoint islieka
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file)
+    os.replace(tmp_path, path)
+
+
+def _write_batch(tx, query: str, rows: list[dict]):
+    tx.run(query, rows=rows).consume()
+
+
+def write_batch(driver, query: str, rows: list[dict]) -> int:
+    """ Vienas paketas vienoje valdomoje transakcijoje (sesija - kiekvienai gijai atskira). """
+    with driver.session(database=NEO4J_DATABASE) as session:
+        session.execute_write(_write_batch, query, rows)
+    return len(rows)
+
+
+def _batches(collection, projection: dict, to_rows, after_id, batch_size: int):
+    """ (paskutinis _id, eilutės) paketai iš Mongo kursoriaus. """
+    query = {'_id': {'$gt': ObjectId(after_id)}} if after_id else {}
+    cursor = collection.find(query, projection).sort('_id', 1).batch_size(batch_size)
+
+    rows, last_id = [], None
+    for doc in cursor:
+        rows += to_rows(doc)
+        last_id = str(doc['_id'])
+
+        if len(rows) >= batch_size:
+            yield last_id, rows
+            rows = []
+
+    if rows or last_id:
+        yield last_id, rows
+
+
+def migrate_section(
+    driver,
+    db,
+    section: str,
+    checkpoint: dict,
+    checkpoint_path: str,
+    batch_size: int = MIGRATION_BATCH_SIZE,
+    workers: int = MIGRATION_WORKERS
+) -> int:
+    """
+    Migruoja vieną sekciją nuo checkpoint[section]. Checkpoint pastumiamas
+    tik kai baigti visi ankstesni paketai, todėl tęsiant niekas nepraleidžiama.
+    """
+    collection_name, projection, to_rows, query = SECTIONS[section]
 
-        CREATE (t)-[:TEACHES {{subjects: {subjects}}}]->(s)
-        """
+    started_at = time.monotonic()
+    last_report = started_at
+    written = 0
 
-        result = neo4j_driver.execute_query(query,
-            database_=NEO4J_DATABASE)
+    # Paketai eiles tvarka: (paskutinis _id, future)
+    in_flight = deque()
 
+    def finish_oldest():
+        nonlocal written, last_report
 
-def generate_school(neo4j_driver, school: dict):
-    query = f"""
-    CREATE (school:School {{name: '{school['school_name']}', 
-                            country: '{school['country']}',
-                            nationality: '{school['nationality']}' }})
-    """
+        last_id, future = in_flight.popleft()
+        written += future.result()
 
-    result = neo4j_driver.execute_query(query,
-        database_=NEO4J_DATABASE)
+        checkpoint[section] = last_id
+        save_checkpoint(checkpoint_path, checkpoint)
 
+        if time.monotonic() - last_report >= PROGRESS_EVERY_SECONDS:
+            last_report = time.monotonic()
+            elapsed = last_report - started_at
+            print(f"{section}: {written} eilučių, {written / elapsed:.0f} eil./s")
 
-def main():
-    neo4j_driver = get_driver()
-    mongo_driver = get_db()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for last_id, rows in _batches(
+            db[collection_name], projection, to_rows, checkpoint.get(section), batch_size
+        ):
+            in_flight.append((last_id, executor.submit(write_batch, driver, query, rows)))
 
-    # Migrate students ###################
+            # Neskaitom is Mongo daug toliau, nei spejam irasyti
+            while len(in_flight) > workers * 2:
+                finish_oldest()
 
-    # student_collection = mongo_driver['student']
+        while in_flight:
+            finish_oldest()
 
-    # for student in get_all_students(student_collection):
-    #     create_student_node(neo4j_driver, student)
-    #     print('-' * 50)
+    elapsed = max(time.monotonic() - started_at, 1e-9)
+    print(f"{section}: baigta, {written} eilučių per {elapsed:.1f} s ({written / elapsed:.0f} eil./s)")
+    return written
 
 
-    # Migrate tutors ##########################3
+def migrate_schools(driver, schools: list[dict] = SCHOOLS) -> int:
+    return write_batch(driver, SCHOOLS_QUERY, schools)
 
-    # tutor_collection = mongo_driver['tutor']
 
-    # for tutor in get_all_tutors(tutor_collection):
-    #     create_tutor_node(neo4j_driver, tutor)
-    #     print('-' * 50)
+def main():
+    parser = argparse.ArgumentParser(description="Mongo -> Neo4j migracija")
+    parser.add_argument(
+        'sections',
+        nargs='*',
+        default=['schools', 'students', 'tutors', 'teaches'],
+        choices=['schools', 'students', 'tutors', 'teaches']
+    )
+    parser.add_argument('--batch-size', type=int, default=MIGRATION_BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=MIGRATION_WORKERS)
+    parser.add_argument('--checkpoint', default=CHECKPOINT_PATH)
+    parser.add_argument('--reset', action='store_true', help="pradėti iš naujo, ignoruojant checkpoint")
+    args = parser.parse_args()
 
+    neo4j_driver = get_driver()
+    mongo_driver = get_db()
 
-    # Create relationships #####################3
+    # Be apribojimu MERGE skenuotu visus mazgus ir lygiagretus rasymas kurtu dublikatus
+    warnings = ensure_schema(neo4j_driver)
+    for warning in warnings:
+        print(warning)
 
-    # tutor_collection = mongo_driver['tutor']
+    workers = args.workers
+    if warnings and workers > 1:
+        # Vietoj unikalumo apribojimo tik indeksas - lygiagretus MERGE kurtu dublikatus
+        print(f"Unikalumo apribojimų nėra - rašoma viena gija (ne {workers})")
+        workers = 1
 
-    # for tutor in get_all_tutors(tutor_collection):
-    #     create_relationships(neo4j_driver, tutor)
+    checkpoint = {} if args.reset else load_checkpoint(args.checkpoint)
 
-    schools = [
-        {'school_name': 'A gimnazija', 'country': 'LIT', 'nationality': 'lithuanian'},
-        {'school_name': 'R gimnazija', 'country': 'LIT', 'nationality': 'russian'},
-        {'school_name': 'L vidusskola', 'country': 'LAT', 'nationality': 'latvian'},
-    ]
+    # TEACHES ryšiams reikia abieju mazgu - todel sekcijos vykdomos paeiliui
+    for section in ['schools', 'students', 'tutors', 'teaches']:
+        if section not in args.sections:
+            continue
 
-    for school in schools:
-        generate_school(neo4j_driver, school)
+        if section == 'schools':
+            print(f"schools: {migrate_schools(neo4j_driver)} eilučių")
+            continue
 
+        migrate_section(
+            neo4j_driver,
+            mongo_driver,
+            section,
+            checkpoint,
+            args.checkpoint,
+            batch_size=args.batch_size,
+            workers=workers
+        )
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -11,10 +11,19 @@ NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD")
 NEO4J_DATABASE = os.getenv("NEO4J_DATABASE")
 AURA_INSTANCEID = os.getenv("AURA_INSTANCEID")
 
-def get_driver() -> Neo4jDriver:
-    driver = GraphDatabase.driver(NEO4J_URI, auth=(NEO4J_USERNAME, NEO4J_PASSWORD))
+def create_driver(max_connection_pool_size: int = 100) -> Neo4jDriver:
+    driver = GraphDatabase.driver(
+        NEO4J_URI,
+        auth=(NEO4J_USERNAME, NEO4J_PASSWORD),
+        max_connection_pool_size=max_connection_pool_size
+    )
     return driver
 
+def get_driver() -> Neo4jDriver:
+    # Importuojam cia, kad nebutu circular import
+    from api.connection import get_neo4j_driver
+    return get_neo4j_driver()
+
 def run_query(driver, query):
     with driver.session(database=NEO4J_DATABASE) as session:
         result = session.run(query)
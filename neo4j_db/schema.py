@@ -0,0 +1,216 @@
+"""
+Neo4j schema: apribojimai (constraints) ir indeksai.
+
+Student ir Tutor mazgai visur ieškomi pagal {first_name, last_name}, School -
+pagal name, todėl jiems kuriami sudėtiniai unikalumo apribojimai (kartu ir
+indeksas). Jei duomenyse jau yra dublikatų, vietoj apribojimo sukuriamas
+paprastas indeksas, kad paieška vis tiek nebūtų label scan.
+
+Visi sakiniai su IF NOT EXISTS, todėl paleisti galima kiekvieno diegimo metu:
+    python -m neo4j_db.schema sync
+    python -m neo4j_db.schema check   # EXPLAIN programos užklausoms; ar nėra NodeByLabelScan
+"""
+
+import argparse
+import sys
+
+from neo4j.exceptions import ClientError
+
+from neo4j_db.neo4j_client import get_driver, NEO4J_DATABASE
+
+# Mokiniu paieska pagal varda ir pavarde (api/neo4j.search_students).
+# standard-folding analizatorius nuima diakritikus: "sarunas" randa "Šarūnas"
+STUDENT_NAME_FULLTEXT_INDEX = "student_name_fulltext"
+
+# {'name', 'statement', 'fallback' - jei statement nepavyksta (pvz. dublikatai)}
+SCHEMA = [
+    {
+        'name': 'student_name_unique',
+        'statement': """
+        CREATE CONSTRAINT student_name_unique IF NOT EXISTS
+        FOR (s:Student) REQUIRE (s.first_name, s.last_name) IS UNIQUE
+        """,
+        'fallback': """
+        CREATE INDEX student_name IF NOT EXISTS
+        FOR (s:Student) ON (s.first_name, s.last_name)
+        """
+    },
+    {
+        'name': 'tutor_name_unique',
+        'statement': """
+        CREATE CONSTRAINT tutor_name_unique IF NOT EXISTS
+        FOR (t:Tutor) REQUIRE (t.first_name, t.last_name) IS UNIQUE
+        """,
+        'fallback': """
+        CREATE INDEX tutor_name IF NOT EXISTS
+        FOR (t:Tutor) ON (t.first_name, t.last_name)
+        """
+    },
+    {
+        'name': 'school_name_unique',
+        'statement': """
+        CREATE CONSTRAINT school_name_unique IF NOT EXISTS
+        FOR (school:School) REQUIRE school.name IS UNIQUE
+        """,
+        'fallback': """
+        CREATE INDEX school_name IF NOT EXISTS
+        FOR (school:School) ON (school.name)
+        """
+    },
+    {
+        'name': STUDENT_NAME_FULLTEXT_INDEX,
+        'statement': f"""
+        CREATE FULLTEXT INDEX {STUDENT_NAME_FULLTEXT_INDEX} IF NOT EXISTS
+        FOR (s:Student) ON EACH [s.first_name, s.last_name]
+        OPTIONS {{indexConfig: {{`fulltext.analyzer`: 'standard-folding'}}}}
+        """
+    },
+]
+
+# Operatoriai, kurie reiskia, kad ieskoma ne per indeksa
+SCAN_OPERATORS = ('NodeByLabelScan', 'AllNodesScan')
+
+
+def ensure_schema(driver, schema: list[dict] = SCHEMA) -> list[str]:
+    """
+    Sukuria trūkstamus apribojimus ir indeksus, palaukia, kol jie paruošti.
+    Grąžina pranešimus apie atsarginius (fallback) indeksus.
+    """
+    warnings = []
+
+    with driver.session(database=NEO4J_DATABASE) as session:
+        for item in schema:
+            try:
+                session.run(item['statement']).consume()
+
+            except ClientError as e:
+                if 'fallback' not in item:
+                    raise
+
+                warnings.append(f"{item['name']}: nepavyko ({e.message}), kuriamas indeksas")
+                session.run(item['fallback']).consume()
+
+        # Naujas indeksas pildomas fone - laukiam, kad uzklausos jo nepraleistu
+        session.run("CALL db.awaitIndexes(300)").consume()
+
+    return warnings
+
+
+def _app_queries() -> list[tuple[str, str, dict]]:
+    """
+    (pavadinimas, užklausa, pavyzdiniai parametrai) - tos pačios konstantos,
+    kurias vykdo api/neo4j.py ir clickhouse/initial_push.py.
+    """
+    # Importuojam cia - api/neo4j.py pats importuoja si moduli
+    from api import neo4j as api_neo4j
+    from clickhouse import initial_push
+
+    student = {'student_first_name': 'Vardas', 'student_last_name': 'Pavarde'}
+    pair = {
+        'from_student_first_name': 'Vardas', 'from_student_last_name': 'Pavarde',
+        'to_student_first_name': 'Kitas', 'to_student_last_name': 'Kitaitis',
+    }
+
+    return [
+        ('api.neo4j.get_schools', api_neo4j.SCHOOLS_QUERY, {}),
+        ('api.neo4j.get_tutors_by_school', api_neo4j.TUTORS_BY_SCHOOL_QUERY,
+            {'school_name': 'Mokykla'}),
+        ('api.neo4j.set_student_school', api_neo4j.SET_STUDENT_SCHOOL_QUERY,
+            student | {'school_name': 'Mokykla'}),
+        ('api.neo4j.set_student_tutor', api_neo4j.SET_STUDENT_TUTOR_QUERY,
+            student | {'tutor_first_name': 'Kitas', 'tutor_last_name': 'Kitaitis'}),
+        ('api.neo4j.register_student', api_neo4j.REGISTER_STUDENT_QUERY,
+            student | {'class_num': 5, 'school_name': 'Mokykla', 'tutors': [['Kitas', 'Kitaitis']]}),
+        ('api.neo4j.send_friend_request', api_neo4j.SEND_FRIEND_REQUEST_QUERY, pair),
+        ('api.neo4j.accept_friend_request', api_neo4j.ACCEPT_FRIEND_REQUEST_QUERY, pair),
+        ('api.neo4j.decline/cancel_friend_request', api_neo4j.DELETE_FRIEND_REQUEST_QUERY, pair),
+        ('api.neo4j.get_pending_friend_requests', api_neo4j.PENDING_FRIEND_REQUESTS_QUERY, student),
+        ('api.neo4j.get_friends', api_neo4j.FRIENDS_QUERY, student),
+        ('api.neo4j.remove_friend', api_neo4j.REMOVE_FRIEND_QUERY, {
+            'student1_first_name': 'Vardas', 'student1_last_name': 'Pavarde',
+            'student2_first_name': 'Kitas', 'student2_last_name': 'Kitaitis',
+        }),
+        ('api.neo4j.get_sent_friend_requests', api_neo4j.SENT_FRIEND_REQUESTS_QUERY, student),
+        ('api.neo4j.get_subject_tutors_by_student_friends_path_length_to_that_tutor',
+            api_neo4j.RECOMMEND_TUTORS_QUERY, student | {
+                'subject': 'Matematika', 'max_path_length': 4, 'existing_tutors': [], 'limit': 10,
+            }),
+        ('api.neo4j.search_students', api_neo4j.SEARCH_STUDENTS_QUERY,
+            {'index': STUDENT_NAME_FULLTEXT_INDEX, 'q': 'vard*', 'limit': 26}),
+        ('initial_push.get_all_schools', initial_push.ALL_SCHOOLS_QUERY, {}),
+        ('initial_push.get_student_school', initial_push.STUDENT_SCHOOL_QUERY,
+            {'first_name': 'Vardas', 'last_name': 'Pavarde'}),
+        ('initial_push.make_fact_table', initial_push.FACT_TABLE_QUERY, {}),
+    ]
+
+
+# Uzklausos, kurios ima visus mazgus tycia (visu mokyklu sarasas, DW eksportas) -
+# skenavimas rodomas, bet check nelaikomas klaida
+FULL_SCAN_QUERIES = {
+    'api.neo4j.get_schools',
+    'initial_push.get_all_schools',
+    'initial_push.make_fact_table',
+}
+
+
+def _scan_operators(plan) -> list[str]:
+    """ Plano medžio operatoriai, skenuojantys visus mazgus. """
+    if not plan:
+        return []
+
+    operator = plan.get('operatorType', '')
+    found = [operator] if operator.split('@')[0] in SCAN_OPERATORS else []
+
+    for child in plan.get('children', []):
+        found += _scan_operators(child)
+
+    return found
+
+
+def check_queries(driver) -> list[tuple[str, list[str]]]:
+    """
+    EXPLAIN kiekvienai programos užklausai. Grąžina (užklausa, skenavimo
+    operatoriai arba klaida) užklausoms be indekso.
+    """
+    scans = []
+
+    with driver.session(database=NEO4J_DATABASE) as session:
+        for name, query, params in _app_queries():
+            try:
+                summary = session.run(f"EXPLAIN {query}", **params).consume()
+            except ClientError as e:
+                # Pvz. nera APOC - uzklausa programoje irgi nepavyktu
+                scans.append((name, [f"klaida: {e.message}"]))
+                continue
+
+            operators = _scan_operators(summary.plan)
+            if operators:
+                scans.append((name, operators))
+
+    return scans
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Neo4j schemos valdymas")
+    parser.add_argument('command', nargs='?', default='sync', choices=['sync', 'check'])
+    args = parser.parse_args()
+
+    driver = get_driver()
+
+    if args.command == 'sync':
+        for warning in ensure_schema(driver):
+            print(warning)
+        print("Neo4j schema paruošta")
+
+    else:
+        scans = check_queries(driver)
+        failed = False
+        for name, operators in scans:
+            expected = name in FULL_SCAN_QUERIES and all(
+                not operator.startswith('klaida') for operator in operators
+            )
+            print(f"{name}: {', '.join(operators)}{' (numatyta)' if expected else ''}")
+            failed = failed or not expected
+        if failed:
+            sys.exit(1)
+        print("Visos užklausos naudoja indeksus")
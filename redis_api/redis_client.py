@@ -4,13 +4,29 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-redis_client = redis.Redis(
-    host='redis-10435.c311.eu-central-1-1.ec2.redns.redis-cloud.com',
-    port=10435,
-    decode_responses=True,
-    username="default",
-    password=os.getenv('REDIS_PASS')
-)
+REDIS_HOST = 'redis-10435.c311.eu-central-1-1.ec2.redns.redis-cloud.com'
+REDIS_PORT = 10435
+
+
+def create_redis_client(max_connections: int = 50, timeout: int = 5) -> redis.Redis:
+    """
+    Sukuria Redis klientą su ribotu jungčių telkiniu.
+    Kai visos jungtys užimtos, laukiama iki timeout sekundžių, o ne metama klaida.
+    """
+    pool = redis.BlockingConnectionPool(
+        host=REDIS_HOST,
+        port=REDIS_PORT,
+        decode_responses=True,
+        username="default",
+        password=os.getenv('REDIS_PASS'),
+        max_connections=max_connections,
+        timeout=timeout
+    )
+
+    return redis.Redis(connection_pool=pool)
+
 
 def get_redis():
-    return redis_client
\ No newline at end of file
+    # Importuojam cia, kad nebutu circular import
+    from api.connection import get_redis as get_registry_redis
+    return get_registry_redis()